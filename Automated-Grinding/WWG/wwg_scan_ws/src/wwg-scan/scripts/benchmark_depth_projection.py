@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the depth deprojection used by pointcloud_to_csv.py.
+
+Runs DepthProjector on synthetic depth frames at the RealSense resolution
+from my_realsense_launch (640x480@30 by default), checks it against the
+original per-pixel loop on a small crop, and reports whether it keeps up
+with the camera frame rate. Does not need ROS.
+
+Usage:
+python3 benchmark_depth_projection.py --width 640 --height 480 --fps 30
+"""
+import argparse
+import time
+
+import numpy as np
+
+from depth_projection import DepthProjector, POINT_DTYPE
+
+# D435 depth intrinsics at 640x480, close enough for timing purposes
+DEFAULT_INTRINSICS = (385.0, 385.0, 320.0, 240.0)
+
+
+def synthetic_depth(width, height, seed=0, invalid_fraction=0.1):
+    """
+    Tilted plane with noise and a share of zero (invalid) pixels, in mm.
+    """
+    rng = np.random.default_rng(seed)
+    u, v = np.meshgrid(np.arange(width), np.arange(height))
+    depth = 600.0 + 0.2 * u + 0.1 * v + rng.normal(0.0, 2.0, (height, width))
+    depth[rng.random((height, width)) < invalid_fraction] = 0
+    return depth.astype(np.uint16)
+
+
+def loop_deprojection(depth, fx, fy, cx, cy, depth_scale=0.001):
+    """
+    Per-pixel reference, same math as the original image_to_pointcloud.
+    """
+    points = []
+    for v in range(depth.shape[0]):
+        for u in range(depth.shape[1]):
+            z = depth[v, u] * depth_scale
+            if z > 0:
+                points.append(((u - cx) * z / fx, (v - cy) * z / fy, z, 255))
+    return np.array(points, dtype=POINT_DTYPE)
+
+
+def check(projector, depth, crop=64):
+    # Compare on a crop so the Python loop stays fast; the crop keeps the full-frame intrinsics
+    sample = np.ascontiguousarray(depth[:crop, :crop])
+    vectorized = projector.project(sample)
+    reference = loop_deprojection(sample, projector.fx, projector.fy, projector.cx, projector.cy,
+                                  projector.depth_scale)
+    assert len(vectorized) == len(reference)
+    for name in ('x', 'y', 'z'):
+        np.testing.assert_allclose(vectorized[name], reference[name], rtol=1e-5, atol=1e-6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--fps', type=float, default=30.0, help='camera rate the projection has to sustain')
+    parser.add_argument('--frames', type=int, default=300)
+    args = parser.parse_args()
+
+    projector = DepthProjector(*DEFAULT_INTRINSICS)
+    frames = [synthetic_depth(args.width, args.height, seed=i) for i in range(8)]
+    check(projector, frames[0])
+
+    out = np.empty(args.width * args.height, dtype=POINT_DTYPE)
+    projector.project(frames[0], out=out)  # builds the cached grid
+    times = np.empty(args.frames)
+    for i in range(args.frames):
+        start = time.perf_counter()
+        points = projector.project(frames[i % len(frames)], out=out)
+        payload = points.tobytes()  # what to_pointcloud2 does
+        times[i] = time.perf_counter() - start
+
+    budget_ms = 1000.0 / args.fps
+    p50, p99 = np.percentile(times, [50, 99]) * 1000.0
+    print(f"{args.width}x{args.height}: {len(points)} points, {len(payload) / 1e6:.1f} MB per cloud")
+    print(f"projection + pack: p50 {p50:.2f} ms, p99 {p99:.2f} ms, {1000.0 / p50:.0f} fps "
+          f"(budget {budget_ms:.1f} ms at {args.fps:g} fps)")
+    print("OK" if p99 < budget_ms else "TOO SLOW")
+
+
+if __name__ == '__main__':
+    main()
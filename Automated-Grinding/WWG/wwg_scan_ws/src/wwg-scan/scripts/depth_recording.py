@@ -0,0 +1,256 @@
+"""
+Append-only binary recording of depth frames.
+
+A recording is a directory holding:
+- header.json: format version, pixel dtype, encoding and any extra metadata
+- segment_00000.raw, ...: raw little-endian frames written back to back;
+  a new segment starts every segment_frames frames or when the resolution changes
+- index.bin: one INDEX_DTYPE record per frame (stamp, segment, offset, size)
+
+Frame data is written before its index record, so a recording cut short by a
+crash or Ctrl-C is still readable up to the last complete frame. Reading
+memory-maps the segments, nothing is parsed or copied up front.
+
+    recorder = DepthRecorder("/tmp/images/scan_0001")
+    recorder.append(depth, stamp)
+    recorder.close()
+    recording = DepthRecording("/tmp/images/scan_0001")
+    depth = recording[10]                 # np.memmap view of frame 10
+"""
+import json
+import os
+import threading
+from collections import deque
+
+import numpy as np
+
+FORMAT_VERSION = 1
+HEADER_FILE = 'header.json'
+INDEX_FILE = 'index.bin'
+
+INDEX_DTYPE = np.dtype([
+    ('stamp', '<f8'),
+    ('segment', '<u4'),
+    ('offset', '<u8'),
+    ('height', '<u4'),
+    ('width', '<u4'),
+])
+
+
+def segment_path(directory, segment):
+    return os.path.join(directory, f'segment_{segment:05d}.raw')
+
+
+class DepthRecorder:
+    """
+    Writes frames of one dtype (uint16 for 16UC1) into a recording directory.
+    """
+
+    def __init__(self, directory, dtype='<u2', encoding='16UC1', segment_frames=300, **metadata):
+        self.directory = directory
+        self.dtype = np.dtype(dtype)
+        self.segment_frames = segment_frames
+        self.segment = -1
+        self.segment_file = None
+        self.segment_count = 0
+        self.shape = None
+        self.frames = 0
+        os.makedirs(directory, exist_ok=True)
+        self.header = {
+            'version': FORMAT_VERSION,
+            'dtype': self.dtype.str,
+            'encoding': encoding,
+        }
+        self.header.update(metadata)
+        self.write_header()
+        self.index_file = open(os.path.join(directory, INDEX_FILE), 'ab')
+
+    def write_header(self):
+        tmp_path = os.path.join(self.directory, HEADER_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.header, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.directory, HEADER_FILE))
+
+    def update_header(self, **metadata):
+        """
+        Add metadata (e.g. camera intrinsics) once it is known.
+        """
+        self.header.update(metadata)
+        self.write_header()
+
+    def _next_segment(self, shape):
+        if self.segment_file is not None:
+            self.segment_file.close()
+        self.segment += 1
+        self.segment_file = open(segment_path(self.directory, self.segment), 'ab')
+        self.segment_count = 0
+        self.shape = shape
+
+    def append(self, frame, stamp):
+        frame = np.ascontiguousarray(frame, dtype=self.dtype)
+        if self.segment_file is None or frame.shape != self.shape or self.segment_count == self.segment_frames:
+            self._next_segment(frame.shape)
+        record = np.zeros(1, dtype=INDEX_DTYPE)
+        record['stamp'] = stamp
+        record['segment'] = self.segment
+        record['offset'] = self.segment_file.tell()
+        record['height'], record['width'] = frame.shape
+        self.segment_file.write(frame.data)
+        self.segment_file.flush()
+        self.index_file.write(record.tobytes())
+        self.index_file.flush()
+        self.segment_count += 1
+        self.frames += 1
+
+    def close(self):
+        if self.segment_file is not None:
+            self.segment_file.close()
+            self.segment_file = None
+        if not self.index_file.closed:
+            self.index_file.close()
+
+
+class DepthRecording:
+    """
+    Read-only, memory-mapped view of a recording directory.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, HEADER_FILE)) as f:
+            self.header = json.load(f)
+        self.dtype = np.dtype(self.header['dtype'])
+        index_path = os.path.join(directory, INDEX_FILE)
+        records = os.path.getsize(index_path) // INDEX_DTYPE.itemsize
+        self.index = np.fromfile(index_path, dtype=INDEX_DTYPE, count=records)
+        self.segments = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def stamps(self):
+        return self.index['stamp']
+
+    def segment(self, segment):
+        """
+        Whole segment as a (frames, height, width) memmap.
+        """
+        if segment not in self.segments:
+            records = self.index[self.index['segment'] == segment]
+            height, width = int(records['height'][0]), int(records['width'][0])
+            path = segment_path(self.directory, segment)
+            # Only map complete frames
+            frames = min(len(records), os.path.getsize(path) // (height * width * self.dtype.itemsize))
+            self.segments[segment] = np.memmap(path, dtype=self.dtype, mode='r', shape=(frames, height, width))
+        return self.segments[segment]
+
+    def __getitem__(self, i):
+        record = self.index[i]
+        frame_bytes = int(record['height']) * int(record['width']) * self.dtype.itemsize
+        return self.segment(int(record['segment']))[int(record['offset']) // frame_bytes]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.stamps[i], self[i]
+
+
+DROP_POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+
+class AsyncFrameWriter:
+    """
+    Bounded queue in front of a DepthRecorder, drained by a background thread.
+
+    submit() never touches the disk. When the queue is full the policy decides:
+    - drop_oldest: discard the oldest queued frame to make room (default)
+    - drop_newest: discard the frame being submitted
+    - block: wait up to block_timeout for room, then discard the new frame
+    Every discarded frame is counted in dropped. close() writes out whatever
+    is still queued before closing the recorder.
+    """
+
+    def __init__(self, recorder, max_queue=60, policy='drop_oldest', block_timeout=0.1):
+        if policy not in DROP_POLICIES:
+            raise ValueError(f"policy must be one of {DROP_POLICIES}, got {policy!r}")
+        self.recorder = recorder
+        self.max_queue = max_queue
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.closing = False
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.high_water = 0
+        self.thread = threading.Thread(target=self._run, name='depth-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, frame, stamp):
+        """
+        Queue a frame for writing. Returns False if a frame was dropped.
+        """
+        with self.condition:
+            if self.closing:
+                self.dropped += 1
+                return False
+            self.submitted += 1
+            accepted = True
+            if len(self.queue) >= self.max_queue and self.policy == 'block':
+                self.condition.wait_for(lambda: len(self.queue) < self.max_queue or self.closing,
+                                        self.block_timeout)
+            if len(self.queue) >= self.max_queue or self.closing:
+                if self.policy != 'drop_oldest' or self.closing:
+                    self.dropped += 1
+                    return False
+                self.queue.popleft()
+                self.dropped += 1
+                accepted = False
+            self.queue.append((frame, stamp))
+            self.high_water = max(self.high_water, len(self.queue))
+            self.condition.notify_all()
+            return accepted
+
+    def pending(self):
+        with self.condition:
+            return len(self.queue)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.queue or self.closing)
+                if not self.queue:
+                    return
+                frame, stamp = self.queue.popleft()
+                self.condition.notify_all()
+            try:
+                self.recorder.append(frame, stamp)
+                self.written += 1
+            except Exception as e:
+                self.errors += 1
+                print(f"Error writing depth frame: {e}")
+
+    def close(self, timeout=10.0):
+        """
+        Flush the queue to disk and close the recorder.
+        """
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            print(f"Depth writer did not finish within {timeout} s, {self.pending()} frames not written")
+        else:
+            self.recorder.close()
+
+    def stats(self):
+        return {
+            'submitted': self.submitted,
+            'written': self.written,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'pending': self.pending(),
+            'high_water': self.high_water,
+        }
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Offline CSV export for depth recordings.
+
+Writes each frame of a recording made by pointcloud_to_csv.py as a CSV file
+of raw depth values, one image row per line, named image_<stamp>.csv like
+the node used to write them live.
+
+Usage:
+python3 depth_to_csv.py /tmp/images/scan_<time> /tmp/images/csv
+python3 depth_to_csv.py /tmp/images/scan_<time> /tmp/images/csv --start 100 --stop 200
+"""
+import argparse
+import os
+
+import numpy as np
+
+from depth_recording import DepthRecording
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recording', help='recording directory')
+    parser.add_argument('output_dir', help='directory for the CSV files')
+    parser.add_argument('--start', type=int, default=0, help='first frame to export')
+    parser.add_argument('--stop', type=int, default=None, help='frame to stop before')
+    args = parser.parse_args()
+
+    recording = DepthRecording(args.recording)
+    os.makedirs(args.output_dir, exist_ok=True)
+    frames = range(len(recording))[args.start:args.stop]
+    for i in frames:
+        filename = os.path.join(args.output_dir, f'image_{recording.stamps[i]}.csv')
+        np.savetxt(filename, recording[i], fmt='%d', delimiter=',')
+    print(f"Exported {len(frames)} frames to {args.output_dir}")
+
+
+if __name__ == '__main__':
+    main()
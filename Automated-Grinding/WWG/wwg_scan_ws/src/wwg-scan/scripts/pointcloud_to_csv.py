@@ -6,46 +6,30 @@ Date: 06/07/24
 
 PointCloud to CSV Converter Node
 
-This ROS node subscribes to a PointCloud2 topic from a Realsense camera,
-converts the point cloud data to CSV format, and saves it to a specified directory.
+This ROS node subscribes to the depth image topic from a Realsense camera,
+records every frame to a binary recording (see depth_recording.py) in a
+specified directory and publishes the deprojected point cloud. Recordings are
+memory-mappable; use depth_to_csv.py to export them to CSV offline.
 
 Parameters:
-- ~output_dir (string): The directory where the CSV files will be saved. Default is '/tmp/pointclouds'.
+- ~output_dir (string): The directory where recordings are saved, one scan_<time> directory per run. Default is '/tmp/images'.
+- ~segment_frames (int): Frames per recording segment file. Default is 300.
+- ~write_queue (int): Frames buffered for the background disk writer. Default is 60 (2 s at 30 fps).
+- ~drop_policy (string): What to do when the write queue is full: drop_oldest, drop_newest or block. Default is drop_oldest.
+- ~camera_info_topic (string): CameraInfo topic providing the depth intrinsics. Default is '/camera/depth/camera_info'.
 
 Usage:
-rosrun wwg_scan pointcloud_to_csv.py _output_dir:=/path/to/save/csv
+rosrun wwg_scan pointcloud_to_csv.py _output_dir:=/path/to/save/scans
 """
 import rospy
-from sensor_msgs.msg import Image, PointCloud2, PointField
-from sensor_msgs import point_cloud2
+from sensor_msgs.msg import Image, PointCloud2, CameraInfo
 from cv_bridge import CvBridge, CvBridgeError
-import cv2
 import os
-import numpy as np
-
-def image_to_pointcloud(cv_image):
-    """
-    Convert a depth image to a point cloud.
-    """
-    points = []
-    fx = 1.0  # Focal length x (change as per your camera)
-    fy = 1.0  # Focal length y (change as per your camera)
-    cx = cv_image.shape[1] / 2.0
-    cy = cv_image.shape[0] / 2.0
-
-    for u in range(cv_image.shape[0]):
-        for v in range(cv_image.shape[1]):
-            depth = cv_image[u, v] / 1000.0  # Convert from mm to meters
-            if depth > 0:
-                x = (v - cx) * depth / fx
-                y = (u - cy) * depth / fy
-                z = depth
-                points.append([x, y, z, 255])  # Assuming intensity is 255 for all points
-
-    return points
+from depth_projection import DepthProjector, to_pointcloud2
+from depth_recording import DepthRecorder, AsyncFrameWriter
 
 def callback(msg, args):
-    output_dir, pointcloud_pub = args
+    writer, pointcloud_pub, projector = args
     # Callback function to process the received image data
     rospy.loginfo("Received image data")
     
@@ -57,37 +41,33 @@ def callback(msg, args):
         rospy.logerr(f"Could not convert image: {e}")
         return
     
-    # Get the current timestamp to use in the filename
-    timestamp = rospy.Time.now().to_sec()
-    filename = os.path.join(output_dir, f'image_{timestamp}.csv')
-    
-    # Open a CSV file to write the image data
-    with open(filename, 'w') as csvfile:
-        csvwriter = csv.writer(csvfile)
-        # Write the pixel data
-        for row in cv_image:
-            csvwriter.writerow(row)
-    
-    rospy.loginfo(f"Image data saved to {filename}")
+    # Queue the raw frame for the background writer, stamped with the camera time when available
+    timestamp = msg.header.stamp.to_sec() or rospy.Time.now().to_sec()
+    if not writer.submit(cv_image, timestamp):
+        rospy.logwarn_throttle(5.0, f"Disk writer falling behind, {writer.dropped} frames dropped so far")
     
+    if not projector.ready:
+        rospy.logwarn_throttle(5.0, "No camera info received yet, skipping point cloud")
+        return
+
     # Convert image to point cloud
-    points = image_to_pointcloud(cv_image)
+    points = projector.project(cv_image)
     
     # Create PointCloud2 message
-    fields = [
-        PointField('x', 0, PointField.FLOAT32, 1),
-        PointField('y', 4, PointField.FLOAT32, 1),
-        PointField('z', 8, PointField.FLOAT32, 1),
-        PointField('intensity', 12, PointField.UINT8, 1)
-    ]
-    
-    header = msg.header
-    pointcloud_msg = point_cloud2.create_cloud(header, fields, points)
+    pointcloud_msg = to_pointcloud2(msg.header, points)
     
     # Publish the point cloud message
     pointcloud_pub.publish(pointcloud_msg)
     rospy.loginfo(f"Point cloud data published to {pointcloud_pub.name}")
 
+def camera_info_callback(info, args):
+    projector, recorder = args
+    projector.update_camera_info(info)
+    if 'K' not in recorder.header:
+        # Store the intrinsics with the recording so it can be deprojected offline
+        recorder.update_header(K=list(info.K), frame_id=info.header.frame_id,
+                               depth_scale=projector.depth_scale)
+
 def main():
     # Initialize the ROS node
     rospy.init_node('image_to_pointcloud', anonymous=True)
@@ -95,18 +75,37 @@ def main():
     # Get the output directory parameter, default is '/tmp/images'
     output_dir = rospy.get_param('~output_dir', '/tmp/images')
     pointcloud_topic = rospy.get_param('~pointcloud_topic', '/camera/pointcloud')
+    camera_info_topic = rospy.get_param('~camera_info_topic', '/camera/depth/camera_info')
+    segment_frames = rospy.get_param('~segment_frames', 300)
     
     # Create the output directory if it does not exist
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
     
+    # One recording directory per run
+    recording_dir = os.path.join(output_dir, f'scan_{rospy.Time.now().to_sec():.0f}')
+    recorder = DepthRecorder(recording_dir, segment_frames=segment_frames)
+    
+    # Disk I/O runs on a background thread so a slow disk never backs up the subscriber
+    writer = AsyncFrameWriter(recorder, max_queue=rospy.get_param('~write_queue', 60),
+                              policy=rospy.get_param('~drop_policy', 'drop_oldest'))
+    
+    def shutdown():
+        writer.close()
+        rospy.loginfo(f"Recording closed: {writer.stats()}")
+    rospy.on_shutdown(shutdown)
+    
     # Create a publisher for the point cloud data
     pointcloud_pub = rospy.Publisher(pointcloud_topic, PointCloud2, queue_size=10)
     
+    # Intrinsics come from the camera; cached pixel grids are rebuilt if they ever change
+    projector = DepthProjector()
+    rospy.Subscriber(camera_info_topic, CameraInfo, camera_info_callback, (projector, recorder), queue_size=1)
+    
     # Subscribe to the depth image topic
-    rospy.Subscriber('/camera/depth/image_raw', Image, callback, (output_dir, pointcloud_pub))
+    rospy.Subscriber('/camera/depth/image_raw', Image, callback, (writer, pointcloud_pub, projector))
     
-    rospy.loginfo("Node initialized, listening for image data and publishing point cloud data...")
+    rospy.loginfo(f"Node initialized, recording to {recording_dir} and publishing point cloud data...")
     
     # Keep the node running
     rospy.spin()
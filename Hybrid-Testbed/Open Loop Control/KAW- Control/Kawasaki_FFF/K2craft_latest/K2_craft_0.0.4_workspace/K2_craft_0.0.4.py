@@ -1,21 +1,39 @@
 import tkinter as tk
-from tkinter import ttk
+from tkinter import ttk, filedialog
 from PIL import Image, ImageTk
-from pypylon import pylon
-import cv2
-import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import socket
-import selectors
-import types
 import threading
 import time
-
-# Initialize Server Socket
-sel = selectors.DefaultSelector()
+from k2_vision import VisionEngine, ANALYSIS_SCALES
+from k2_plots import RollingPlot
+from k2_server import ControllerServer
+from k2_sources import PylonFrameSource
+from k2_core import K2Core
+import as_program
+from extrusion_scheduler import DEFAULT_LATENCY_MS, ExtrusionScheduler, build_profile
+
+# Size of the camera view on the Camera View tab
+DISPLAY_WIDTH, DISPLAY_HEIGHT = 770, 400
+# While the stage timing overlay is on, percentiles are refreshed every TIMING_REFRESH_MS
+# and written to the telemetry directory every TIMING_EXPORT_S
+TIMING_REFRESH_MS = 500
+TIMING_EXPORT_S = 10
+# Refresh period of the toolpath extrusion status while it runs
+TOOLPATH_STATUS_MS = 500
+
+# Controller server address
 host, port = '192.168.1.1', 10000
 
+
+def entry_value(var):
+    # -> the number in a numeric entry, or None when it is empty or not a number
+    try:
+        return var.get()
+    except tk.TclError:
+        return None
+
+
 class Kaw2FFFControl:
     def __init__(self, root):
         print("Initializing...")
@@ -30,8 +48,19 @@ class Kaw2FFFControl:
         # Initialize display variable after creating the root window
         self.display_var = tk.StringVar(value="both")
 
-        # Initialize camera variable
-        self.camera = None
+        self.camera_feed_job = None
+
+        # Indexed .pg program and the scheduler that drives extrusion from it
+        self.toolpath = None
+        self.extrusion_scheduler = None
+        self.profile_request = 0
+
+        # Controller link, IO state, camera and vision live in the core; this class is only its front end
+        self.core = K2Core(ControllerServer(host, port), PylonFrameSource(), VisionEngine(),
+                           after=self.root.after, display_size=(DISPLAY_WIDTH, DISPLAY_HEIGHT))
+        self.core.on_connection = self.update_connection_status
+        self.core.on_input = self.handle_input
+        self.core.on_text = self.process_received_data
 
         # Initialize GUI elements
         self.initialize_gui()
@@ -41,77 +70,32 @@ class Kaw2FFFControl:
         print("Setting up camera...")
         self.setup_camera()
 
-        # Start server in a separate thread
-        self.server_thread = threading.Thread(target=self.setup_server)
-        self.server_thread.daemon = True
-        self.server_thread.start()
-
-    def setup_server(self):
-        lsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        lsock.bind((host, port))
-        lsock.listen()
-        print(f"Listening on {(host, port)}")
-        lsock.setblocking(False)
-        sel.register(lsock, selectors.EVENT_READ, data=None)
-
-        try:
-            while True:
-                events = sel.select(timeout=None)
-                for key, mask in events:
-                    if key.data is None:
-                        self.accept_wrapper(key.fileobj)
-                    else:
-                        self.service_connection(key, mask)
-        except KeyboardInterrupt:
-            print("Caught keyboard interrupt, exiting")
-        finally:
-            sel.close()
-
-    def accept_wrapper(self, sock):
-        conn, addr = sock.accept()
-        print(f"Accepted connection from {addr}")
-        conn.setblocking(False)
-        data = types.SimpleNamespace(addr=addr, inb=b"", outb=b"")
-        events = selectors.EVENT_READ | selectors.EVENT_WRITE
-        sel.register(conn, events, data=data)
-        self.connection_state = True  # Set connection state to True when a connection is accepted
-
-    def service_connection(self, key, mask):
-        sock = key.fileobj
-        data = key.data
-        if mask & selectors.EVENT_READ:
-            recv_data = sock.recv(1024)
-            if recv_data:
-                data.outb += recv_data
-                self.process_received_data(recv_data.decode())
-            else:
-                print(f"Closing connection to {data.addr}")
-                sel.unregister(sock)
-                sock.close()
-                self.connection_state = False  # Set connection state to False when connection is closed
-        if mask & selectors.EVENT_WRITE:
-            if data.outb:
-                print(f"Echoing {data.outb!r} to {data.addr}")
-                try:
-                    sent = sock.send(data.outb)
-                    data.outb = data.outb[sent:]
-                except Exception as e:
-                    print(f"Error sending data to {data.addr}: {e}")
-                    self.connection_state = False
-
-    def send_data(self, message):
-        if self.connection_state:
-            for key in sel.get_map().values():
-                if key.data is not None:
-                    conn = key.fileobj
-                    try:
-                        conn.send(message.encode())
-                        print(f"Sent data: {message} to {key.data.addr}")
-                    except Exception as e:
-                        print(f"Error sending data to {key.data.addr}: {e}")
-                        self.connection_state = False
-        else:
-            print("Cannot send data. No active connection.")
+        # Start the controller server; its event loop runs on its own thread
+        self.core.start()
+        self.poll_server_events()
+        self.update_link_stats()
+
+    def poll_server_events(self):
+        # Tk thread: hand messages from the server thread to the core, which calls back into the GUI
+        self.core.poll()
+        self.server_poll_job = self.root.after(20, self.poll_server_events)
+
+    def update_link_stats(self):
+        stats = self.core.commands.stats()
+        acks = self.core.acks.stats()
+        lines = [
+            f"Commands submitted: {stats['submitted']}",
+            f"Commands sent:      {stats['sent']} in {stats['batches']} writes",
+            f"Coalesced:          {stats['coalesced']}",
+            f"Acknowledged:       {acks['acked']}  pending {acks['pending']}  retried {acks['retried']}  "
+            f"failed {acks['failed']}  unsent {acks['unsent']}",
+            "",
+            f"{'Round trip (ms)':24s}{'n':>7s}{'mean':>8s}{'p50':>8s}{'p95':>8s}{'p99':>8s}{'max':>8s}",
+        ]
+        for name, count, mean, p50, p95, p99, worst in self.core.acks.summary():
+            lines.append(f"{name[:23]:24s}{count:7d}{mean:8.1f}{p50:8.1f}{p95:8.1f}{p99:8.1f}{worst:8.1f}")
+        self.link_stats_label.config(text="\n".join(lines))
+        self.link_stats_job = self.root.after(1000, self.update_link_stats)
 
     def update_io_label(self, pin, state):
         pin_label = self.channel_1_pin_labels.get(pin) or self.channel_2_pin_labels.get(pin)
@@ -119,20 +103,8 @@ class Kaw2FFFControl:
             pin_label.config(text=f"Pin {pin}: {'High' if state else 'Low'}", background="green" if state else "red")
 
     def process_received_data(self, data):
-        data_str = data.strip()
-        print(f"Received data: {data_str}")
-        if "channel_1_states:" in data_str:
-            states = data_str.split('channel_1_states:')[1].split(',')
-            for pin, state in enumerate(states, start=1):
-                state = (state == '1')
-                if pin <= 16:
-                    self.update_input_indicator(1, pin, state)
-        if "channel_2_states:" in data_str:
-            states = data_str.split('channel_2_states:')[1].split(',')
-            for pin, state in enumerate(states, start=1):
-                state = (state == '1')
-                if pin <= 16:
-                    self.update_input_indicator(2, pin, state)
+        # Status lines from the controller that have no dedicated handler
+        print(f"Received data: {data.strip()}")
 
     def initialize_gui(self):
         # Using grid for the entire layout
@@ -150,6 +122,9 @@ class Kaw2FFFControl:
         self.stop_video_button = ttk.Button(self.camera_tab, text="Stop Video Feed", command=self.stop_video_feed)
         self.stop_video_button.grid(row=1, column=1, pady=10, sticky=tk.W)
 
+        self.save_data_button = ttk.Button(self.camera_tab, text="Save Data", command=self.save_data)
+        self.save_data_button.grid(row=7, column=0, pady=10, sticky=tk.W)
+
         # Styling for radio buttons
         style = ttk.Style()
         style.configure('Big.TRadiobutton', font=('Helvetica', 12))
@@ -221,6 +196,42 @@ class Kaw2FFFControl:
         self.upper_value_scale = ttk.Scale(self.color_param_frame, from_=0, to=255, orient=tk.HORIZONTAL, variable=self.upper_value_var)
         self.upper_value_scale.grid(row=5, column=1, sticky=(tk.W, tk.E))
 
+        # Region of interest and analysis resolution, applied to every display mode
+        self.analysis_frame = ttk.LabelFrame(self.camera_tab, text="Analysis Region (0 = full frame)", padding=(10, 5))
+        self.analysis_frame.grid(row=5, column=0, columnspan=2, pady=10, padx=10, sticky=tk.W)
+
+        self.roi_vars = []
+        for column, name in enumerate(["X", "Y", "Width", "Height"]):
+            ttk.Label(self.analysis_frame, text=f"{name}:").grid(row=0, column=2 * column, sticky=tk.W)
+            roi_var = tk.IntVar(value=0)
+            ttk.Entry(self.analysis_frame, textvariable=roi_var, width=6).grid(row=0, column=2 * column + 1, padx=(0, 5))
+            self.roi_vars.append(roi_var)
+
+        ttk.Label(self.analysis_frame, text="Analysis Scale:").grid(row=1, column=0, columnspan=2, sticky=tk.W, pady=(5, 0))
+        self.analysis_scale_var = tk.StringVar(value="1")
+        self.analysis_scale_box = ttk.Combobox(self.analysis_frame, textvariable=self.analysis_scale_var,
+                                               values=["1", "1/2", "1/4"], state="readonly", width=6)
+        self.analysis_scale_box.grid(row=1, column=2, columnspan=2, sticky=tk.W, pady=(5, 0))
+
+        # Plot options
+        self.plot_option_frame = ttk.LabelFrame(self.camera_tab, text="Plot Options", padding=(10, 5))
+        self.plot_option_frame.grid(row=6, column=0, columnspan=2, pady=10, padx=10, sticky=tk.W)
+
+        self.plot_history_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.plot_option_frame, text="Show full print history", variable=self.plot_history_var,
+                        command=self.update_plot_mode).grid(row=0, column=0, columnspan=2, sticky=tk.W)
+
+        ttk.Label(self.plot_option_frame, text="Refresh rate (Hz):").grid(row=1, column=0, sticky=tk.W)
+        self.plot_refresh_var = tk.DoubleVar(value=5.0)
+        ttk.Spinbox(self.plot_option_frame, from_=0.5, to=30, increment=0.5, textvariable=self.plot_refresh_var,
+                    width=6, command=self.update_plot_refresh_rate).grid(row=1, column=1, sticky=tk.W)
+
+        self.timing_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.plot_option_frame, text="Show stage timing (ms)", variable=self.timing_var,
+                        command=self.toggle_timing_overlay).grid(row=2, column=0, columnspan=2, sticky=tk.W)
+        self.timing_job = None
+        self.timing_exported = 0.0
+
         # Initialize channel labels for inputs and outputs side by side
         self.create_io_controls(self.IO_control_tab, 1, 16, 0)
         self.create_io_controls(self.IO_control_tab, 2, 16, 1)
@@ -232,12 +243,17 @@ class Kaw2FFFControl:
         # Set up the camera display label
         self.video_label = ttk.Label(self.camera_tab)
         self.video_label.grid(row=0, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S))
+        # Stage timing overlay, placed over the top left corner of the video while enabled
+        self.timing_label = tk.Label(self.camera_tab, text="", justify=tk.LEFT, font=('Courier', 8),
+                                     background="black", foreground="lime")
 
         # Set up the matplotlib graph
         self.fig, self.ax = plt.subplots(2, 1, figsize=(5, 8))
         self.canvas = FigureCanvasTkAgg(self.fig, master=self.camera_tab)
         self.canvas_widget = self.canvas.get_tk_widget()
         self.canvas_widget.grid(row=0, column=2, rowspan=7, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.count_plot = RollingPlot(self.fig, self.canvas, self.ax, ['Line Detection Count', 'Blob Detection Count'],
+                                      ['r', 'b'], window=600, refresh_hz=self.plot_refresh_var.get())
 
         # Initialize states
         self.control_state = False
@@ -340,6 +356,40 @@ class Kaw2FFFControl:
         self.disconnect_button = ttk.Button(control_frame, text="Disconnect server", command=self.toggle_disconnect)
         self.disconnect_button.grid(row=1, column=0, padx=5, pady=5, sticky=(tk.W, tk.E))
 
+        # Toolpath extrusion: flow setpoints follow the loaded .pg program once the printer is started. The
+        # replay is time-based unless a layer start input is set: the robot pulses it at every layer start
+        # and each pulse re-syncs the schedule to that layer
+        toolpath_frame = ttk.LabelFrame(Extruder_tab, text="Toolpath Extrusion", padding="10")
+        toolpath_frame.grid(row=4, column=0, columnspan=2, padx=5, pady=5, sticky=(tk.W, tk.E))
+        toolpath_frame.columnconfigure(1, weight=1)
+
+        ttk.Button(toolpath_frame, text="Load program...", command=self.load_toolpath).grid(row=0, column=0, padx=5, sticky=tk.W)
+        self.toolpath_label = ttk.Label(toolpath_frame, text="No program loaded")
+        self.toolpath_label.grid(row=0, column=1, columnspan=3, padx=5, sticky=tk.W)
+
+        ttk.Label(toolpath_frame, text="Displacement (mm³/rev):").grid(row=1, column=0, padx=5, sticky=tk.W)
+        self.displacement_var = tk.DoubleVar()
+        ttk.Entry(toolpath_frame, textvariable=self.displacement_var, width=10).grid(row=1, column=1, padx=5, sticky=tk.W)
+
+        ttk.Label(toolpath_frame, text="Lead (ms):").grid(row=1, column=2, padx=5, sticky=tk.W)
+        self.toolpath_latency_var = tk.DoubleVar(value=DEFAULT_LATENCY_MS)
+        ttk.Entry(toolpath_frame, textvariable=self.toolpath_latency_var, width=6).grid(row=1, column=3, padx=5, sticky=tk.W)
+
+        self.follow_toolpath_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(toolpath_frame, text="Follow toolpath on Start", variable=self.follow_toolpath_var).grid(
+            row=2, column=0, columnspan=2, padx=5, sticky=tk.W)
+
+        ttk.Label(toolpath_frame, text="Layer start input (channel, pin):").grid(row=2, column=2, padx=5, sticky=tk.W)
+        layer_signal_frame = ttk.Frame(toolpath_frame)
+        layer_signal_frame.grid(row=2, column=3, padx=5, sticky=tk.W)
+        # 0 = no layer signal; the schedule then runs on time alone
+        self.layer_signal_channel_var = tk.IntVar(value=0)
+        self.layer_signal_pin_var = tk.IntVar(value=0)
+        ttk.Entry(layer_signal_frame, textvariable=self.layer_signal_channel_var, width=3).pack(side=tk.LEFT)
+        ttk.Entry(layer_signal_frame, textvariable=self.layer_signal_pin_var, width=3).pack(side=tk.LEFT, padx=(5, 0))
+        self.toolpath_status_label = ttk.Label(toolpath_frame, text="", font=('Courier', 9))
+        self.toolpath_status_label.grid(row=3, column=0, columnspan=4, padx=5, sticky=tk.W)
+
         # Author label
         self.author_label = ttk.Label(main_frame, text="Author: Walter W Glockner", font=('Bold', 5, 'bold'))
         self.author_label.grid(row=1, column=0, columnspan=5, padx=0, pady=0, sticky=tk.E+tk.S)
@@ -414,6 +464,12 @@ class Kaw2FFFControl:
         self.other_label = ttk.Label(other_tab, text="I know, I'll get to it...", font=('Arial', 20, 'italic'))
         self.other_label.grid(row=0, column=0, columnspan=5, padx=0, pady=0, sticky=tk.E+tk.S)
 
+        # Controller link statistics
+        link_frame = ttk.LabelFrame(other_tab, text="Controller Link", padding="10")
+        link_frame.grid(row=1, column=0, columnspan=5, padx=10, pady=10, sticky=(tk.W, tk.E))
+        self.link_stats_label = ttk.Label(link_frame, text="", justify=tk.LEFT, font=('Courier', 9))
+        self.link_stats_label.grid(row=0, column=0, sticky=tk.W)
+
         # Author label
         self.author_label = ttk.Label(main_frame, text="Author: Walter W Glockner", font=('Bold', 5, 'bold'))
         self.author_label.grid(row=5, column=0, columnspan=5, padx=0, pady=0, sticky=tk.E+tk.S)
@@ -437,6 +493,14 @@ class Kaw2FFFControl:
                     pin_label.config(text="Pin 9: High", background="green")
                     self.set_output(channel, pin, True)
 
+    def handle_input(self, channel, pin, state):
+        self.update_input_indicator(channel, pin, state)
+        # Rising edge of the layer start input: the robot has begun the next layer
+        if (state and self.extrusion_scheduler is not None and self.extrusion_scheduler.running
+                and (channel, pin) == (entry_value(self.layer_signal_channel_var),
+                                       entry_value(self.layer_signal_pin_var))):
+            self.extrusion_scheduler.layer_started()
+
     def update_input_indicator(self, channel, pin, state):
         try:
             label = self.input_states[(channel, pin)]
@@ -453,8 +517,7 @@ class Kaw2FFFControl:
         button.config(text="Toggle Off" if new_state else "Toggle On")
 
     def set_output(self, channel, pin, state):
-        command = f"SET_OUTPUT:{channel}:{pin}:{1 if state else 0}"
-        self.send_data(command + "\n")
+        command = self.core.set_output(channel, pin, state)
         print(f"Command sent: {command}")
 
     def get_output_state(self, pin):
@@ -468,14 +531,7 @@ class Kaw2FFFControl:
             self.connection_status_label.config(text="Not Connected", background="red")
 
     def request_io_update(self):
-        if self.connection_state:
-            self.send_data("REQUEST_IO_UPDATE")
-
-    def auto_request_io_update(self):
-        while not self.stop_threads:
-            if self.root.winfo_exists():
-                self.request_io_update()
-            time.sleep(0.5)
+        self.core.request_io_update()
 
     def monitor_connection(self):
         def run():
@@ -494,11 +550,7 @@ class Kaw2FFFControl:
         threading.Thread(target=run, daemon=True).start()
 
     def send_variable_update(self, variable_name, value):
-        if self.connection_state:
-            message = f"{variable_name}:{value}\n"
-            self.send_data(message)
-        else:
-            print("Cannot send data. No active connection.")
+        self.core.set_variable(variable_name, value)
 
     def update_speed_scale(self, value):
         self.speed_var.set(round(float(value), 1))
@@ -560,6 +612,12 @@ class Kaw2FFFControl:
 
     def start_printer(self):
         if not self.printer_state:
+            toolpath_settings = None
+            if self.follow_toolpath_var.get():
+                # Checked before start_print goes out, so a bad entry cannot leave the print running unfollowed
+                toolpath_settings = self.toolpath_settings()
+                if toolpath_settings is None:
+                    return
             self.printer_state = True
             self.send_variable_update("command", "start_print")
             self.status_label.config(text="Printer Started", background="green")
@@ -567,6 +625,8 @@ class Kaw2FFFControl:
             self.stop_button.config(state=tk.NORMAL)
             self.pause_button.config(state=tk.NORMAL)
             print("Printer started")
+            if toolpath_settings is not None:
+                self.start_toolpath_extrusion(toolpath_settings)
 
     def stop_printer(self):
         if self.printer_state:
@@ -577,6 +637,8 @@ class Kaw2FFFControl:
             self.stop_button.config(state=tk.DISABLED)
             self.pause_button.config(state=tk.DISABLED)
             print("Printer stopped")
+            if self.extrusion_scheduler is not None:
+                self.extrusion_scheduler.stop()
 
     def pause_printer(self):
         self.printer_paused = not self.printer_paused
@@ -585,6 +647,106 @@ class Kaw2FFFControl:
         self.pause_button.config(text="Resume" if self.printer_paused else "Pause")
         self.status_label.config(text="Printer Paused", background="yellow" if self.printer_paused else "green")
         print("Printer paused" if self.printer_paused else "Printing resumed")
+        if self.extrusion_scheduler is not None:
+            if self.printer_paused:
+                self.extrusion_scheduler.pause()
+            else:
+                self.extrusion_scheduler.resume()
+
+    def load_toolpath(self):
+        path = filedialog.askopenfilename(title="Select AS program", filetypes=[("AS programs", "*.pg"), ("All files", "*.*")])
+        if not path:
+            return
+        self.toolpath_label.config(text=f"Indexing {path}...")
+
+        def run():
+            # Indexing a large program takes a few seconds; keep it off the Tk thread
+            try:
+                table = as_program.open_program(path)
+            except (OSError, ValueError) as e:
+                print(f"Cannot load {path}: {e}")
+                self.root.after(0, lambda: self.toolpath_label.config(text="No program loaded"))
+                return
+            self.root.after(0, lambda: self.toolpath_loaded(path, table))
+        threading.Thread(target=run, daemon=True).start()
+
+    def toolpath_loaded(self, path, table):
+        self.toolpath = table
+        self.toolpath_label.config(text=f"{table.program}: {len(table)} moves, {table.layer_count} layers")
+        print(f"Loaded toolpath {path}")
+
+    def toolpath_settings(self):
+        # Flow from feed x line width x layer height, using the Quality tab's settings. An empty or zero
+        # layer height / first layer entry means the program's own Z step / the default line width.
+        # -> dict, or None (reported) when something needed is missing
+        line_width = entry_value(self.default_line_width_var) or 0
+        displacement = entry_value(self.displacement_var) or 0
+        if self.toolpath is None or line_width <= 0 or displacement <= 0:
+            message = "Toolpath extrusion needs a loaded program, a line width and the extruder displacement"
+            print(message)
+            self.toolpath_status_label.config(text=message)
+            return None
+        latency_ms = entry_value(self.toolpath_latency_var)
+        return {
+            "line_width": line_width,
+            "displacement": displacement,
+            "layer_height": entry_value(self.layer_height_var) or None,
+            "first_layer_height": entry_value(self.first_layer_height_var) or None,
+            "first_layer_line_width": entry_value(self.first_layer_line_width_var) or None,
+            "latency_ms": DEFAULT_LATENCY_MS if latency_ms is None else latency_ms,
+        }
+
+    def start_toolpath_extrusion(self, settings):
+        started = time.monotonic()
+        table = self.toolpath
+        line_width = settings["line_width"]
+        displacement = settings["displacement"]
+        heights = (settings["layer_height"], settings["first_layer_height"])
+        first_layer_line_width = settings["first_layer_line_width"]
+        latency_ms = settings["latency_ms"]
+        self.profile_request += 1
+        request = self.profile_request
+        self.toolpath_status_label.config(text="Building extrusion profile...")
+
+        def run():
+            # Building the profile of a large program takes seconds; keep it off the Tk thread
+            try:
+                profile = build_profile(table, line_width, *heights, first_layer_line_width)
+            except Exception as e:
+                # Report anything, so the status never stays at "Building..." with a dead thread
+                message = f"Cannot follow toolpath: {e}"
+                print(message)
+                self.root.after(0, lambda: self.toolpath_status_label.config(text=message))
+                return
+            self.root.after(0, lambda: self.toolpath_profile_ready(request, profile, latency_ms,
+                                                                   60.0 / displacement, started))
+        threading.Thread(target=run, daemon=True).start()
+
+    def toolpath_profile_ready(self, request, profile, latency_ms, scale, started):
+        if request != self.profile_request or not self.printer_state:
+            # The printer was stopped or restarted while the profile was built
+            return
+        self.extrusion_scheduler = ExtrusionScheduler(profile, self.send_variable_update, after=self.root.after,
+                                                      latency_ms=latency_ms, scale=scale)
+        # The robot started when Start was clicked, not when the profile was ready
+        self.extrusion_scheduler.start(at=started)
+        if self.printer_paused:
+            self.extrusion_scheduler.pause()
+        print(f"Following toolpath: {len(profile) - 1} setpoints")
+        self.update_toolpath_status()
+
+    def update_toolpath_status(self):
+        status = self.extrusion_scheduler.status()
+        if status["synced_layer"] is None:
+            sync = "time-based"
+        else:
+            sync = f"synced at layer {status['synced_layer'] + 1}"
+        self.toolpath_status_label.config(
+            text=f"Layer {status['layer'] + 1}/{self.toolpath.layer_count}  {status['setpoint']:.1f} RPM  "
+                 f"{status['elapsed_s']:.0f}/{status['total_s']:.0f} s  ({sync})"
+                 + ("  (paused)" if status["paused"] else ""))
+        if status["running"]:
+            self.root.after(TOOLPATH_STATUS_MS, self.update_toolpath_status)
 
     def toggle_air(self):
         self.air_state = not self.air_state
@@ -623,177 +785,127 @@ class Kaw2FFFControl:
             time.sleep(0.25)
 
     def start_video_feed(self):
-        if self.camera and not self.camera.IsGrabbing():
+        if not self.core.capturing:
             try:
-                self.camera.StartGrabbing(pylon.GrabStrategy_LatestImages)
+                self.core.start_capture()
+                if self.camera_feed_job is not None:
+                    self.root.after_cancel(self.camera_feed_job)
                 self.update_camera_feed()
                 print("Video feed started.")
             except Exception as e:
                 print(f"Failed to start video feed: {e}")
 
     def stop_video_feed(self):
-        if self.camera and self.camera.IsGrabbing():
-            self.camera.StopGrabbing()
+        if self.core.capturing:
+            self.core.stop_capture()
             print("Video feed stopped.")
 
     def setup_camera(self):
-        self.release_camera()
-        self.line_counts = []
-        self.blob_counts = []
-        self.camera = pylon.InstantCamera(pylon.TlFactory.GetInstance().CreateFirstDevice())
-        self.camera.Open()
-        self.converter = pylon.ImageFormatConverter()
-        self.converter.OutputPixelFormat = pylon.PixelType_BGR8packed
-        self.blob_detector = self.setup_blob_detector()
-        self.update_camera_feed()
-
-    def release_camera(self):
-        if self.camera is not None:
-            if (self.camera.IsGrabbing()):
-                self.camera.StopGrabbing()
-            self.camera.Close()
-            self.camera = None
-
-    def setup_blob_detector(self):
-        params = cv2.SimpleBlobDetector_Params()
-        params.filterByArea = True
-        params.minArea = 150
-        params.filterByCircularity = True
-        params.minCircularity = 0.1
-        params.filterByConvexity = True
-        params.minConvexity = 0.5
-        params.filterByInertia = True
-        params.minInertiaRatio = 0.01
-        return cv2.SimpleBlobDetector_create(params)
+        self.count_plot.clear()
+        self.core.vision_settings = self.read_vision_settings()
+        self.core.open_camera()
+
+    def read_vision_settings(self):
+        # Tk variables may only be read on the Tk thread, so the vision worker uses this snapshot
+        return {
+            "mode": self.display_var.get(),
+            "edge_low": self.edge_low_threshold_var.get(),
+            "edge_high": self.edge_high_threshold_var.get(),
+            "lower_hsv": (self.lower_hue_var.get(), self.lower_saturation_var.get(), self.lower_value_var.get()),
+            "upper_hsv": (self.upper_hue_var.get(), self.upper_saturation_var.get(), self.upper_value_var.get()),
+            "roi": self.read_roi(),
+            "analysis_scale": ANALYSIS_SCALES[["1", "1/2", "1/4"].index(self.analysis_scale_var.get())],
+        }
+
+    def read_roi(self):
+        try:
+            roi = tuple(var.get() for var in self.roi_vars)
+        except tk.TclError:
+            # Entry is mid-edit; keep the previous ROI
+            return self.core.vision_settings.get("roi")
+        return roi if any(roi) else None
 
     def update_camera_feed(self):
-        if self.camera and self.camera.IsGrabbing() and self.root.winfo_exists():
-            try:
-                grabResult = self.camera.RetrieveResult(500, pylon.TimeoutHandling_ThrowException)
-                if grabResult.GrabSucceeded():
-                    image = self.converter.Convert(grabResult).GetArray()
-                    self.process_image(image)
-                grabResult.Release()
-                if self.root.winfo_exists():
-                    self.root.after(10, self.update_camera_feed)
-            except Exception as e:
-                print(f"Error during camera feed update: {e}")
+        self.camera_feed_job = None
+        if self.core.capturing and self.root.winfo_exists():
+            settings = self.read_vision_settings()
+            settings["display"] = self.camera_tab_visible()
+            self.core.vision_settings = settings
+            result = self.core.take_result()
+            if result is not None:
+                self.show_result(result)
+            self.camera_feed_job = self.root.after(15, self.update_camera_feed)
         else:
             print("Camera not grabbing or window closed, stopping updates.")
 
-    def process_image(self, image):
-        display_image = image
-        if self.display_var.get() == "lines":
-            display_image, _ = self.detect_lines(image)
-        elif self.display_var.get() == "blobs":
-            display_image, _ = self.detect_blobs(image)
-        elif self.display_var.get() == "color":
-            display_image = self.color_segmentation(image)
-        elif self.display_var.get() == "edges":
-            display_image = self.edge_detection(image)
-        elif self.display_var.get() == "contours":
-            display_image = self.contour_detection(image)
-        elif self.display_var.get() == "shapes":
-            display_image = self.shape_detection(image)
-        else:
-            line_image, line_count = self.detect_lines(image)
-            blob_image, blob_count = self.detect_blobs(image)
-            display_image = cv2.addWeighted(line_image, 0.5, blob_image, 0.5, 0)
-            self.line_counts.append(line_count)
-            self.blob_counts.append(blob_count)
-
-        display_image = self.resize_image(display_image, 770, 400)
-        self.update_image(self.video_label, display_image)
+    def camera_tab_visible(self):
+        return self.tab_control.select() == str(self.camera_tab)
+
+    def show_result(self, result):
+        timer = self.core.timer
+        if result.image is not None:
+            t = timer.start()
+            self.update_image(self.video_label, result.image)
+            timer.lap("photo", t)
+            self.core.release_result(result)
+        # Counts are only graphed in "both" mode
+        if result.line_count is not None and result.blob_count is not None:
+            self.count_plot.append(result.line_count, result.blob_count)
+        t = timer.start()
         self.update_graphs()
+        timer.lap("graphs", t)
+        # Grab to screen
+        timer.lap("frame", result.timestamp)
+
+    def toggle_timing_overlay(self):
+        enabled = self.timing_var.get()
+        self.core.timer.enabled = enabled
+        if enabled:
+            self.core.timer.reset()
+            self.timing_label.place(in_=self.video_label, x=5, y=5)
+            self.update_timing_overlay()
+        else:
+            if self.timing_job is not None:
+                self.root.after_cancel(self.timing_job)
+                self.timing_job = None
+            self.timing_label.place_forget()
+
+    def update_timing_overlay(self):
+        self.timing_label.config(text=self.core.timer.format())
+        if time.monotonic() - self.timing_exported >= TIMING_EXPORT_S:
+            self.core.timer.export()
+            self.timing_exported = time.monotonic()
+        self.timing_job = self.root.after(TIMING_REFRESH_MS, self.update_timing_overlay)
+
+    def save_data(self):
+        path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV files", "*.csv")])
+        if path:
+            rows = self.core.telemetry.export_csv(path)
+            print(f"Saved {rows} rows of vision data to {path}")
 
     def update_image(self, label, image):
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        image = Image.fromarray(image)
-        image = ImageTk.PhotoImage(image)
-        label.config(image=image)
-        label.image = image
+        # One PhotoImage per label, created once and pasted into for every frame. The frame is
+        # already RGB, so Image.frombuffer wraps the pooled buffer without a copy.
+        height, width = image.shape[:2]
+        photo = getattr(label, "image", None)
+        if photo is None or (photo.width(), photo.height()) != (width, height):
+            photo = ImageTk.PhotoImage("RGB", (width, height))
+            label.config(image=photo)
+            label.image = photo
+        photo.paste(Image.frombuffer("RGB", (width, height), image, "raw", "RGB", 0, 1))
 
     def update_graphs(self):
-        self.ax[0].clear()
-        self.ax[0].plot(self.line_counts, 'r-')
-        self.ax[0].set_title('Line Detection Count')
-        self.ax[1].clear()
-        self.ax[1].plot(self.blob_counts, 'b-')
-        self.ax[1].set_title('Blob Detection Count')
-        self.canvas.draw()
-        self.canvas.flush_events()
-
-    def detect_lines(self, image):
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        blurred_gray = cv2.GaussianBlur(gray, (5, 5), 0)
-        edges = cv2.Canny(blurred_gray, self.edge_low_threshold_var.get(), self.edge_high_threshold_var.get(), apertureSize=3)
-        lines = cv2.HoughLinesP(edges, 1, np.pi / 180, 50, minLineLength=50, maxLineGap=20)
-        line_image = image.copy()
-        if lines is not None:
-            for line in lines:
-                x1, y1, x2, y2 = line[0]
-                cv2.line(line_image, (x1, y1), (x2, y2), (0, 255, 0), 2)
-        return line_image, len(lines) if lines is not None else 0
-
-    def detect_blobs(self, image):
-        keypoints = self.blob_detector.detect(image)
-        blob_image = cv2.drawKeypoints(image, keypoints, None, (0, 0, 255), cv2.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS)
-        return blob_image, len(keypoints)
-
-    def color_segmentation(self, image):
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-        lower_bound = np.array([self.lower_hue_var.get(), self.lower_saturation_var.get(), self.lower_value_var.get()])
-        upper_bound = np.array([self.upper_hue_var.get(), self.upper_saturation_var.get(), self.upper_value_var.get()])
-        mask = cv2.inRange(hsv, lower_bound, upper_bound)
-        segmented_image = cv2.bitwise_and(image, image, mask=mask)
-        return segmented_image
-
-    def edge_detection(self, image):
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        edges = cv2.Canny(gray, self.edge_low_threshold_var.get(), self.edge_high_threshold_var.get())
-        edge_image = cv2.cvtColor(edges, cv2.COLOR_GRAY2BGR)
-        return edge_image
-
-    def contour_detection(self, image):
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-        edged = cv2.Canny(blurred, 50, 150)
-        contours, _ = cv2.findContours(edged, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        contour_image = image.copy()
-        cv2.drawContours(contour_image, contours, -1, (0, 255, 0), 2)
-        return contour_image
-
-    def shape_detection(self, image):
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-        edged = cv2.Canny(blurred, 50, 150)
-        contours, _ = cv2.findContours(edged, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        shape_image = image.copy()
-        for contour in contours:
-            approx = cv2.approxPolyDP(contour, 0.04 * cv2.arcLength(contour, True), True)
-            if len(approx) == 3:
-                shape = "Triangle"
-            elif len(approx) == 4:
-                (x, y, w, h) = cv2.boundingRect(approx)
-                ar = w / float(h)
-                shape = "Square" if 0.95 <= ar <= 1.05 else "Rectangle"
-            elif len(approx) == 5:
-                shape = "Pentagon"
-            else:
-                shape = "Circle"
-            cv2.drawContours(shape_image, [approx], -1, (0, 255, 0), 2)
-            x, y = approx[0][0]
-            cv2.putText(shape_image, shape, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 0), 2)
-        return shape_image
+        # Throttled to the plot refresh rate; in between frames this returns immediately
+        self.count_plot.refresh()
 
-    def resize_image(self, image, width, height):
-        return cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+    def update_plot_mode(self):
+        self.count_plot.set_history_mode(self.plot_history_var.get())
 
-    def update_image_display(self, image):
-        image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-        image = ImageTk.PhotoImage(image)
-        self.video_label.config(image=image)
-        self.video_label.image = image
+    def update_plot_refresh_rate(self):
+        try:
+            self.count_plot.refresh_hz = max(0.5, self.plot_refresh_var.get())
+        except tk.TclError:
+            pass
 
     def setup_motor_control_ui(self):
         motor_frame = ttk.LabelFrame(self.motor_control_tab, text="Motor Commands", padding="10")
@@ -820,7 +932,9 @@ class Kaw2FFFControl:
     def on_closing(self):
         print("Shutting down server...")
         self.is_running = False
-        sel.close()
+        if self.extrusion_scheduler is not None:
+            self.extrusion_scheduler.stop()
+        self.core.close()
         self.root.destroy()
 
 # Main program
@@ -0,0 +1,261 @@
+"""
+Run time and extrusion estimate for an indexed AS program.
+
+Works on the move table from as_program, in chunks of whole C1MOVE/C2MOVE
+pairs, with NumPy only:
+
+- geometry: LMOVE/JMOVE are straight segments; a C1MOVE/C2MOVE pair is the
+  circular arc through the previous end point, the C1 via point and the C2
+  end point, with its length and its entry/exit tangents
+- junctions: the speed through the corner between two segments is limited
+  by the robot's blending. ACCURACY (mm) is used as the allowed deviation
+  from the corner, so v^2 = a * d * s / (1 - s) with s = sin(corner / 2),
+  a straight continuation keeps full speed and a reversal stops
+- velocity profile: every segment accelerates from its entry speed to its
+  SPEED, cruises and decelerates to its exit speed (trapezoid, or triangle
+  when it is too short). Entry/exit speeds that acceleration cannot reach
+  are lowered with one backward and one forward pass, both expressed as
+  running minima of v^2 minus the distance already available for speeding
+  up, so no per-move Python loop is needed
+- extrusion: printing moves (not rapids) deposit line width x layer height
+  per mm. The layer height is each layer's Z step unless given.
+
+Orientation (O, A, T) changes are not timed; the Fusion post keeps the tool
+orientation fixed. Chunk boundaries are treated as a stop, which adds a few
+milliseconds per million moves.
+
+Usage:
+python as_estimate.py part.pg --line-width 6 [--layer-height 2] [--accel 2000] [--mm3-per-rev 1200] [--csv layers.csv]
+"""
+import argparse
+import time
+
+import numpy as np
+
+import as_program
+from as_program import C1MOVE, C2MOVE, FLAG_RAPID
+
+DEFAULT_ACCEL = 2000.0        # mm/s^2, path acceleration assumed for the profiles
+DEFAULT_ACCURACY = 1.0        # mm, when the program has no ACCURACY statement
+
+LAYER_ESTIMATE_DTYPE = np.dtype([
+    ("layer", "<i4"), ("z", "<f8"), ("height", "<f8"),
+    ("time_s", "<f8"), ("print_time_s", "<f8"), ("travel_time_s", "<f8"),
+    ("print_mm", "<f8"), ("travel_mm", "<f8"), ("volume_mm3", "<f8"),
+])
+
+
+def _unit(vectors):
+    norm = np.linalg.norm(vectors, axis=1)
+    safe = np.where(norm > 1e-12, norm, 1.0)
+    return vectors / safe[:, None], norm
+
+
+def circle_through(start, via, end):
+    # -> (center, normal, radius, round) of the circles through rows of three points. The points run
+    # counter-clockwise about normal; round is False where they are (nearly) collinear.
+    u = via - start
+    w = end - start
+    n = np.cross(u, w)
+    n2 = np.einsum("ij,ij->i", n, n)
+    uu = np.einsum("ij,ij->i", u, u)
+    ww = np.einsum("ij,ij->i", w, w)
+    round_ = n2 > 1e-12 * np.maximum(uu * ww, 1e-30)
+    safe = np.where(round_, n2, 1.0)
+    # Circumcentre of the triangle start, via, end
+    center = start + (ww[:, None] * np.cross(n, u) + uu[:, None] * np.cross(w, n)) / (2.0 * safe[:, None])
+    normal = n / np.sqrt(safe)[:, None]
+    radius = np.linalg.norm(start - center, axis=1)
+    return center, normal, radius, round_
+
+
+def arc_angles(points, center, normal, radius):
+    # Angles (0 .. 2 pi) of points about one circle, measured from points[0] counter-clockwise about normal
+    e1 = (points[0] - center) / radius
+    e2 = np.cross(normal, e1)
+    relative = points - center
+    return np.mod(np.arctan2(relative @ e2, relative @ e1), 2 * np.pi), relative
+
+
+def segment_geometry(start, via, end, is_arc):
+    # -> (length, entry direction, exit direction) for segments start -> end, arcs passing through via
+    chord, length = _unit(end - start)
+    entry = chord.copy()
+    exit_ = chord.copy()
+    if is_arc.any():
+        s, v, e = start[is_arc], via[is_arc], end[is_arc]
+        center, normal, radius, round_ = circle_through(s, v, e)
+        # Nearly collinear "arcs" are measured as the polyline through the via point
+        arc_length = np.linalg.norm(v - s, axis=1) + np.linalg.norm(e - v, axis=1)
+        arc_entry, _ = _unit(v - s)
+        arc_exit, _ = _unit(e - v)
+        if round_.any():
+            s, e, center, normal, radius = s[round_], e[round_], center[round_], normal[round_], radius[round_]
+            e1 = (s - center) / radius[:, None]
+            e2 = np.cross(normal, e1)
+            radius_end = e - center
+            # s -> v -> e runs counter-clockwise about normal, so the sweep is the angle of e in (0, 2 pi]
+            sweep = np.mod(np.arctan2(np.einsum("ij,ij->i", radius_end, e2),
+                                      np.einsum("ij,ij->i", radius_end, e1)), 2 * np.pi)
+            sweep = np.where(sweep <= 1e-12, 2 * np.pi, sweep)
+            arc_length[round_] = radius * sweep
+            arc_entry[round_] = e2
+            arc_exit[round_] = np.cross(normal, radius_end / radius[:, None])
+        length[is_arc] = arc_length
+        entry[is_arc] = arc_entry
+        exit_[is_arc] = arc_exit
+    return length, entry, exit_
+
+
+def junction_limits(exit_prev, entry_next, accel, accuracy):
+    # Maximum v^2 through the corner between two segments
+    cos_theta = -np.einsum("ij,ij->i", exit_prev, entry_next)
+    sin_half = np.sqrt(np.clip(0.5 * (1.0 - cos_theta), 0.0, 1.0))
+    with np.errstate(divide="ignore"):
+        return np.where(sin_half > 1.0 - 1e-9, np.inf, accel * accuracy * sin_half / (1.0 - sin_half))
+
+
+def plan_speeds(length, feed, corner_v2, accel):
+    # Junction v^2 (len(length) + 1 values, stopped at both ends) that respects the corner limits,
+    # each segment's SPEED and the acceleration available along every segment
+    cap = np.empty(len(length) + 1)
+    cap[0] = cap[-1] = 0.0
+    cap[1:-1] = np.minimum(corner_v2, np.minimum(feed[:-1], feed[1:]) ** 2)
+    reach = np.concatenate(([0.0], np.cumsum(2.0 * accel * length)))
+    # Backward pass: w[i] <= w[i+1] + 2 a L[i], i.e. w[i] - reach[i] <= min over j >= i of (cap[j] - reach[j])
+    backward = np.minimum.accumulate((cap + reach)[::-1])[::-1] - reach
+    # Forward pass: w[i+1] <= w[i] + 2 a L[i]
+    return np.minimum.accumulate(backward - reach) + reach
+
+
+def segment_times(length, feed, v0, v1, accel):
+    # Trapezoidal (or triangular) profile time for every segment
+    with np.errstate(invalid="ignore", divide="ignore"):
+        accel_distance = (feed ** 2 - v0 ** 2) / (2.0 * accel)
+        decel_distance = (feed ** 2 - v1 ** 2) / (2.0 * accel)
+        cruise = length - accel_distance - decel_distance
+        trapezoid = (feed - v0) / accel + (feed - v1) / accel + cruise / feed
+        peak = np.sqrt(np.maximum((2.0 * accel * length + v0 ** 2 + v1 ** 2) / 2.0, 0.0))
+        triangle = (peak - v0) / accel + (peak - v1) / accel
+        times = np.where(cruise >= 0.0, trapezoid, triangle)
+    return np.where(length > 0.0, times, 0.0)
+
+
+def layer_heights(table, layer_height=None, first_layer_height=None):
+    # -> height of every layer: each layer's Z step (the first layer takes the second's) unless given
+    heights = np.zeros(table.layer_count)
+    steps = np.diff(table.layers["z"])
+    if layer_height is not None:
+        heights[:] = layer_height
+    elif len(steps):
+        heights[1:] = steps
+        heights[0] = steps[0]
+    if first_layer_height is not None and len(heights):
+        heights[0] = first_layer_height
+    if len(heights) and not heights.any():
+        raise ValueError("Single-layer program: pass layer_height")
+    return heights
+
+
+def iter_segments(table, accel=DEFAULT_ACCEL, accuracy=None, chunk_size=1 << 20):
+    # Yields (rows, length, time, layer, printing) arrays per chunk of the MoveTable, one entry per
+    # segment; rows are the move indices of the segments' end points (C2MOVE for arcs)
+    accuracy = accuracy if accuracy is not None else (table.header.get("accuracy") or DEFAULT_ACCURACY)
+    rapid_feed = table.header.get("rapid_feed", 250.0)
+    moves = table.moves
+    previous_end = None
+    for start, stop in as_program.chunk_ranges(moves["type"], chunk_size):
+        chunk = moves[start:stop]
+        position = np.column_stack((chunk["x"], chunk["y"], chunk["z"]))
+        chunk_types = np.asarray(chunk["type"])
+        rows = np.flatnonzero(chunk_types != C1MOVE)
+        if not len(rows):
+            continue
+        end = position[rows]
+        begin = np.empty_like(end)
+        begin[1:] = end[:-1]
+        # The program's first move starts wherever the robot is; it is not counted
+        begin[0] = end[0] if previous_end is None else previous_end
+        previous_end = end[-1]
+        is_arc = (chunk_types[rows] == C2MOVE) & (rows > 0)
+        is_arc[is_arc] &= chunk_types[rows[is_arc] - 1] == C1MOVE
+        via = end.copy()
+        via[is_arc] = position[rows[is_arc] - 1]
+
+        length, entry, exit_ = segment_geometry(begin, via, end, is_arc)
+        feed = np.asarray(chunk["feed"][rows], dtype=np.float64)
+        feed = np.where(np.isfinite(feed) & (feed > 0), feed, rapid_feed)
+        corner_v2 = junction_limits(exit_[:-1], entry[1:], accel, accuracy)
+        v2 = plan_speeds(length, feed, corner_v2, accel)
+        times = segment_times(length, feed, np.sqrt(v2[:-1]), np.sqrt(v2[1:]), accel)
+        printing = (np.asarray(chunk["flags"][rows]) & FLAG_RAPID) == 0
+        yield start + rows, length, times, np.asarray(chunk["layer"][rows]), printing
+
+
+def estimate(table, line_width, layer_height=None, first_layer_height=None, accel=DEFAULT_ACCEL,
+             accuracy=None, chunk_size=1 << 20):
+    # -> LAYER_ESTIMATE_DTYPE array with one row per layer of the MoveTable
+    layers = np.zeros(table.layer_count, dtype=LAYER_ESTIMATE_DTYPE)
+    layers["layer"] = np.arange(table.layer_count)
+    layers["z"] = table.layers["z"]
+    layers["height"] = layer_heights(table, layer_height, first_layer_height)
+    count = table.layer_count
+    for rows, length, times, layer, printing in iter_segments(table, accel, accuracy, chunk_size):
+        layers["time_s"] += np.bincount(layer, times, count)
+        layers["print_time_s"] += np.bincount(layer, np.where(printing, times, 0.0), count)
+        layers["print_mm"] += np.bincount(layer, np.where(printing, length, 0.0), count)
+        layers["travel_mm"] += np.bincount(layer, np.where(printing, 0.0, length), count)
+    layers["travel_time_s"] = layers["time_s"] - layers["print_time_s"]
+    layers["volume_mm3"] = layers["print_mm"] * line_width * layers["height"]
+    return layers
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimate run time and extrusion of an AS program")
+    parser.add_argument("program", help=".pg file (indexed on first use)")
+    parser.add_argument("--line-width", type=float, required=True, help="Bead width (mm)")
+    parser.add_argument("--layer-height", type=float, help="Layer height (mm, default: each layer's Z step)")
+    parser.add_argument("--first-layer-height", type=float)
+    parser.add_argument("--accel", type=float, default=DEFAULT_ACCEL, help="Path acceleration (mm/s^2)")
+    parser.add_argument("--accuracy", type=float, help="Blending distance (mm, default: the program's ACCURACY)")
+    parser.add_argument("--mm3-per-rev", type=float, help="Extruder displacement, to report screw revolutions/RPM")
+    parser.add_argument("--layers", action="store_true", help="Print every layer")
+    parser.add_argument("--csv", help="Write the per-layer estimate to this file")
+    args = parser.parse_args()
+
+    table = as_program.open_program(args.program)
+    started = time.perf_counter()
+    layers = estimate(table, args.line_width, args.layer_height, args.first_layer_height, args.accel, args.accuracy)
+    elapsed = time.perf_counter() - started
+
+    total = layers["time_s"].sum()
+    printing = layers["print_time_s"].sum()
+    volume = layers["volume_mm3"].sum()
+    print(f"{table.program}: {len(table)} moves, {table.layer_count} layers (estimated in {elapsed:.2f} s)")
+    print(f"  run time     {format_duration(total)}  (printing {format_duration(printing)}, "
+          f"travel {format_duration(total - printing)})")
+    print(f"  path         {layers['print_mm'].sum() / 1000:.1f} m printed, {layers['travel_mm'].sum() / 1000:.1f} m travel")
+    print(f"  extrusion    {volume / 1000:.1f} cm^3, mean {volume / printing if printing else 0:.1f} mm^3/s while printing")
+    if args.mm3_per_rev:
+        revolutions = volume / args.mm3_per_rev
+        print(f"  extruder     {revolutions:.0f} rev, mean {revolutions / (printing / 60) if printing else 0:.1f} RPM")
+    if args.layers:
+        print(f"{'layer':>6s}{'z':>10s}{'time':>10s}{'print mm':>11s}{'volume mm3':>12s}")
+        for row in layers:
+            print(f"{row['layer']:6d}{row['z']:10.3f}{format_duration(row['time_s']):>10s}{row['print_mm']:11.1f}"
+                  f"{row['volume_mm3']:12.1f}")
+    if args.csv:
+        header = ",".join(LAYER_ESTIMATE_DTYPE.names)
+        np.savetxt(args.csv, layers, delimiter=",", header=header, comments="",
+                   fmt=["%d", "%.4f", "%.4f", "%.3f", "%.3f", "%.3f", "%.3f", "%.3f", "%.3f"])
+        print(f"Wrote {len(layers)} layers to {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
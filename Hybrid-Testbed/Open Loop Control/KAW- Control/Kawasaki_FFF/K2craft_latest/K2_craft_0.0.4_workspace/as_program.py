@@ -0,0 +1,496 @@
+"""
+Streaming parser and move-table index for Kawasaki AS programs (.pg).
+
+The Fusion post-processor (Fusion_Post_Processor/2023-11-15 simple.cps)
+writes a .PROGRAM section of SPEED / LMOVE / C1MOVE / C2MOVE statements
+that refer to poses by name, followed by a .TRANS section holding the poses:
+
+    .PROGRAM JDHpart
+    ACCURACY 0.01 ALWAYS
+    SPEED 250.00 mm/s
+    LMOVE linear.t1
+    SPEED 25.00 mm/s ALWAYS
+    C1MOVE circular.t2
+    C2MOVE circular.t3
+    .STOP
+    .END
+    .TRANS
+    linear.t1  1156.0000 919.0000 1240.0000 90.000 90.000 0.000
+    ...
+    .END
+
+The file is read line by line. Moves and poses are buffered in fixed-size
+chunks and spilled to raw files, so parsing memory stays flat for programs
+with hundreds of thousands of moves. Pose references are resolved once both
+sections have been read, chunk by chunk against the sorted pose references
+(8 bytes per pose). The result is a move table (MOVE_DTYPE) in an index
+directory next to the program:
+
+    <program>.pgidx/
+        index.json    source size/mtime, counts and the layer table
+        moves.raw     MOVE_DTYPE rows, memory-mapped by MoveTable
+
+Layers are derived from Z: a new layer starts at the first printing move more
+than layer_tolerance above the current layer, and the travel moves leading up
+to it belong to the new layer. Rapids are the moves at the post-processor's
+RapidFeed; they carry FLAG_RAPID.
+
+    table = open_program("part.pg")      # builds the index, or reuses a fresh one
+    first = table.layer(0)               # memmap slice, no parsing
+
+ProgramWriter writes moves back out in the same layout.
+"""
+import argparse
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+FORMAT_VERSION = 2
+INDEX_SUFFIX = ".pgidx"
+INDEX_FILE = "index.json"
+MOVES_FILE = "moves.raw"
+
+# Move types
+LMOVE, C1MOVE, C2MOVE, JMOVE = 0, 1, 2, 3
+MOVE_TYPES = {"LMOVE": LMOVE, "C1MOVE": C1MOVE, "C2MOVE": C2MOVE, "JMOVE": JMOVE}
+MOVE_NAMES = {value: name for name, value in MOVE_TYPES.items()}
+
+# Move flags
+FLAG_RAPID = 1
+
+# Positions need float64: the post adds the robot base offsets (~1000 mm) to 4-decimal coordinates
+MOVE_DTYPE = np.dtype([
+    ("x", "<f8"), ("y", "<f8"), ("z", "<f8"),
+    ("o", "<f4"), ("a", "<f4"), ("t", "<f4"),
+    ("feed", "<f4"),        # mm/s
+    ("type", "u1"),
+    ("flags", "u1"),
+    ("layer", "<i4"),
+    ("trans", "<i4"),       # row in the .TRANS section
+    ("line", "<i4"),        # line number of the move statement in the .pg
+])
+
+LAYER_DTYPE = np.dtype([("start", "<i8"), ("stop", "<i8"), ("z", "<f8")])
+
+# Raw records written while parsing, before poses are resolved
+_PENDING_DTYPE = np.dtype([("ref", "<i8"), ("feed", "<f4"), ("type", "u1"), ("line", "<i4")])
+_POSE_DTYPE = np.dtype([("ref", "<i8"), ("pose", "<f8", 6)])
+
+_NUMBERED_NAME = re.compile(r"^[A-Za-z_][\w]*\.t(\d+)$")
+_UNIT_SCALE = {"MM/S": 1.0, "MM/MIN": 1.0 / 60.0}
+
+
+class ProgramError(ValueError):
+    def __init__(self, message, line=None):
+        super().__init__(f"line {line}: {message}" if line is not None else message)
+        self.line = line
+
+
+def index_dir(path):
+    return path + INDEX_SUFFIX
+
+
+class _ChunkWriter:
+    # Collects up to chunk_size row tuples, then converts them to dtype in one
+    # go and appends them to a raw file
+    def __init__(self, path, dtype, chunk_size):
+        self.file = open(path, "wb")
+        self.dtype = dtype
+        self.chunk_size = chunk_size
+        self.rows = []
+        self.count = 0
+
+    def append(self, row):
+        self.rows.append(row)
+        self.count += 1
+        if len(self.rows) == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.file.write(np.array(self.rows, dtype=self.dtype).tobytes())
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class _References:
+    # Pose names -> integer refs. Names of the form prefix.tN (everything the
+    # Fusion post writes) map to N without being stored; anything else gets a
+    # negative ref from a dictionary.
+    def __init__(self):
+        self.other = {}
+
+    def ref(self, name):
+        match = _NUMBERED_NAME.match(name)
+        if match:
+            return int(match.group(1))
+        return self.other.setdefault(name, -1 - len(self.other))
+
+
+def parse_speed(args, line):
+    # "25.00 mm/s ALWAYS" -> (mm/s, always). A bare number is a percentage of the
+    # robot's maximum, which has no absolute value; it is recorded as NaN.
+    words = args.split()
+    if not words:
+        raise ProgramError("SPEED without a value", line)
+    try:
+        value = float(words[0])
+    except ValueError:
+        raise ProgramError(f"bad SPEED value {words[0]!r}", line)
+    always = words[-1].upper() == "ALWAYS"
+    unit = words[1].upper() if len(words) > 1 and words[1].upper() != "ALWAYS" else None
+    if unit is None:
+        return float("nan"), always
+    if unit not in _UNIT_SCALE:
+        raise ProgramError(f"unsupported SPEED unit {words[1]!r}", line)
+    return value * _UNIT_SCALE[unit], always
+
+
+def iter_statements(lines):
+    # Yields (line_number, section, keyword, args) for every statement, where section is
+    # "program" or "trans" and keyword is upper case (the pose name for .TRANS rows)
+    section = None
+    for number, raw in enumerate(lines, start=1):
+        text = raw.strip()
+        if not text or text.startswith(";"):
+            continue
+        if text.startswith("."):
+            keyword = text.split(None, 1)[0].upper()
+            if keyword == ".PROGRAM":
+                section = "program"
+                yield number, section, keyword, text[len(keyword):].strip()
+            elif keyword == ".TRANS":
+                section = "trans"
+            elif keyword == ".END":
+                section = None
+            continue
+        if section is None:
+            continue
+        keyword, _, args = text.partition(" ")
+        yield number, section, keyword if section == "trans" else keyword.upper(), args.strip()
+
+
+def build_index(path, directory=None, rapid_feed=250.0, layer_tolerance=0.05, chunk_size=16384):
+    # Parses path and writes its move table; returns the opened MoveTable
+    directory = directory or index_dir(path)
+    os.makedirs(directory, exist_ok=True)
+    pending_path = os.path.join(directory, "pending.tmp")
+    poses_path = os.path.join(directory, "poses.tmp")
+    moves = _ChunkWriter(pending_path, _PENDING_DTYPE, chunk_size)
+    poses = _ChunkWriter(poses_path, _POSE_DTYPE, chunk_size)
+    references = _References()
+    program_name = None
+    accuracy = None
+    feed = float("nan")
+    next_feed = None
+    started = time.perf_counter()
+
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for number, section, keyword, args in iter_statements(f):
+            if section == "trans":
+                values = args.split()
+                if len(values) < 6:
+                    raise ProgramError(f"pose {keyword} needs x y z o a t", number)
+                try:
+                    pose = tuple(float(value) for value in values[:6])
+                except ValueError:
+                    raise ProgramError(f"bad pose values for {keyword}", number)
+                poses.append((references.ref(keyword), pose))
+            elif keyword == ".PROGRAM":
+                program_name = args.split("(")[0].strip() or None
+            elif keyword == "ACCURACY" and accuracy is None:
+                # Blending distance (mm) of the program's first ACCURACY statement
+                try:
+                    accuracy = float(args.split()[0])
+                except (IndexError, ValueError):
+                    raise ProgramError(f"bad ACCURACY {args!r}", number)
+            elif keyword == "SPEED":
+                value, always = parse_speed(args, number)
+                if always:
+                    feed, next_feed = value, None
+                else:
+                    # Without ALWAYS the speed only applies to the next motion statement
+                    next_feed = value
+            elif keyword in MOVE_TYPES:
+                if not args:
+                    raise ProgramError(f"{keyword} without a pose", number)
+                moves.append((references.ref(args.split()[0]), feed if next_feed is None else next_feed,
+                              MOVE_TYPES[keyword], number))
+                next_feed = None
+    moves.close()
+    poses.close()
+
+    table_path = os.path.join(directory, MOVES_FILE)
+    try:
+        _resolve(pending_path, moves.count, poses_path, poses.count, table_path, rapid_feed, chunk_size)
+    finally:
+        os.remove(pending_path)
+        os.remove(poses_path)
+    layers = _assign_layers(table_path, moves.count, layer_tolerance, chunk_size)
+
+    stat = os.stat(path)
+    header = {
+        "format_version": FORMAT_VERSION,
+        "source": os.path.abspath(path),
+        "source_size": stat.st_size,
+        "source_mtime": stat.st_mtime,
+        "program": program_name,
+        "accuracy": accuracy,
+        "moves": moves.count,
+        "poses": poses.count,
+        "rapid_feed": rapid_feed,
+        "layer_tolerance": layer_tolerance,
+        "dtype": [list(field) for field in MOVE_DTYPE.descr],
+        "layers": [[int(start), int(stop), float(z)] for start, stop, z in layers],
+        "build_seconds": time.perf_counter() - started,
+    }
+    with open(os.path.join(directory, INDEX_FILE), "w") as f:
+        json.dump(header, f)
+    return MoveTable(directory)
+
+
+def _resolve(pending_path, move_count, poses_path, pose_count, table_path, rapid_feed, chunk_size):
+    # Looks every move's pose up in the .TRANS rows, one chunk of moves at a time
+    poses = np.memmap(poses_path, dtype=_POSE_DTYPE, mode="r", shape=(pose_count,)) if pose_count else \
+        np.zeros(0, dtype=_POSE_DTYPE)
+    refs = np.asarray(poses["ref"])
+    order = np.argsort(refs, kind="stable")
+    sorted_refs = refs[order]
+    if len(sorted_refs) > 1 and np.any(sorted_refs[1:] == sorted_refs[:-1]):
+        duplicate = sorted_refs[1:][sorted_refs[1:] == sorted_refs[:-1]][0]
+        raise ProgramError(f"pose ref {duplicate} defined twice in .TRANS")
+
+    with open(table_path, "wb") as out:
+        if not move_count:
+            return
+        pending = np.memmap(pending_path, dtype=_PENDING_DTYPE, mode="r", shape=(move_count,))
+        table = np.zeros(min(chunk_size, move_count), dtype=MOVE_DTYPE)
+        for start in range(0, move_count, chunk_size):
+            chunk = pending[start:start + chunk_size]
+            rows = table[:len(chunk)]
+            position = np.searchsorted(sorted_refs, chunk["ref"])
+            position = np.minimum(position, max(len(sorted_refs) - 1, 0))
+            found = (sorted_refs[position] == chunk["ref"]) if len(sorted_refs) else np.zeros(len(chunk), bool)
+            if not found.all():
+                missing = int(np.flatnonzero(~found)[0])
+                raise ProgramError("move refers to a pose missing from .TRANS", int(chunk["line"][missing]))
+            trans = order[position]
+            pose = poses["pose"][trans]
+            for i, name in enumerate(("x", "y", "z", "o", "a", "t")):
+                rows[name] = pose[:, i]
+            rows["feed"] = chunk["feed"]
+            rows["type"] = chunk["type"]
+            rows["flags"] = np.where(np.isclose(chunk["feed"], rapid_feed), FLAG_RAPID, 0)
+            rows["layer"] = 0
+            rows["trans"] = trans
+            rows["line"] = chunk["line"]
+            out.write(rows.tobytes())
+
+
+def _assign_layers(table_path, move_count, tolerance, chunk_size):
+    # -> LAYER_DTYPE array; also writes each move's layer number into the table
+    if not move_count:
+        return np.zeros(0, dtype=LAYER_DTYPE)
+    table = np.memmap(table_path, dtype=MOVE_DTYPE, mode="r+", shape=(move_count,))
+    printing = np.flatnonzero((table["flags"] & FLAG_RAPID) == 0)
+    starts = [0]
+    z_levels = []
+    if len(printing):
+        z = np.asarray(table["z"][printing])
+        # Only points where the running maximum rises can open a layer
+        running = np.maximum.accumulate(z)
+        candidates = np.flatnonzero(np.r_[True, running[1:] > running[:-1]])
+        level = z[0]
+        z_levels.append(level)
+        first_printing = []
+        for i in candidates[1:]:
+            if z[i] > level + tolerance:
+                level = z[i]
+                z_levels.append(level)
+                first_printing.append(i)
+        for i in first_printing:
+            # The layer begins right after the previous printing move, so it owns its travel moves
+            starts.append(int(printing[i - 1]) + 1)
+    else:
+        z_levels.append(float(table["z"][0]))
+    layers = np.zeros(len(starts), dtype=LAYER_DTYPE)
+    layers["start"] = starts
+    layers["stop"] = starts[1:] + [move_count]
+    layers["z"] = z_levels
+    for number, (start, stop, _) in enumerate(layers):
+        for chunk_start in range(start, stop, chunk_size):
+            table["layer"][chunk_start:min(stop, chunk_start + chunk_size)] = number
+    table.flush()
+    return layers
+
+
+class MoveTable:
+    # Read-only view of an index directory written by build_index
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILE)) as f:
+            self.header = json.load(f)
+        count = self.header["moves"]
+        path = os.path.join(directory, MOVES_FILE)
+        self.moves = np.memmap(path, dtype=MOVE_DTYPE, mode="r", shape=(count,)) if count else \
+            np.zeros(0, dtype=MOVE_DTYPE)
+        self.layers = np.array([tuple(layer) for layer in self.header["layers"]], dtype=LAYER_DTYPE)
+
+    def __len__(self):
+        return len(self.moves)
+
+    @property
+    def program(self):
+        return self.header["program"]
+
+    @property
+    def layer_count(self):
+        return len(self.layers)
+
+    def layer(self, number):
+        start, stop, _ = self.layers[number]
+        return self.moves[start:stop]
+
+    def layer_of(self, move_index):
+        return int(np.searchsorted(self.layers["start"], move_index, side="right") - 1)
+
+    def layer_at_z(self, z):
+        # Last layer whose Z is at or below z
+        return max(0, int(np.searchsorted(self.layers["z"], z, side="right") - 1))
+
+    def is_fresh(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return (self.header.get("format_version") == FORMAT_VERSION and
+                self.header["source_size"] == stat.st_size and self.header["source_mtime"] == stat.st_mtime)
+
+
+def open_program(path, directory=None, rebuild=False, **options):
+    # Opens the index next to path, rebuilding it if it is missing, stale or was built with other options
+    directory = directory or index_dir(path)
+    if not rebuild and os.path.exists(os.path.join(directory, INDEX_FILE)):
+        try:
+            table = MoveTable(directory)
+        except (OSError, ValueError, KeyError):
+            table = None
+        if (table is not None and table.is_fresh(path) and
+                all(table.header.get(key) == value for key, value in options.items())):
+            return table
+    return build_index(path, directory, **options)
+
+
+def chunk_ranges(types, chunk_size):
+    # (start, stop) row ranges of about chunk_size moves that never separate a C1MOVE from its C2MOVE
+    start = 0
+    count = len(types)
+    while start < count:
+        stop = min(start + chunk_size, count)
+        if stop < count and types[stop - 1] == C1MOVE:
+            stop += 1
+        yield start, stop
+        start = stop
+
+
+def read_preamble(path):
+    # -> the .PROGRAM name and the statements before its first SPEED or move (ACCURACY, HERE, SETHOME ...)
+    name = None
+    preamble = []
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for number, section, keyword, args in iter_statements(f):
+            if keyword == ".PROGRAM":
+                name = args.split("(")[0].strip() or None
+            elif section != "program" or keyword == "SPEED" or keyword in MOVE_TYPES:
+                break
+            else:
+                preamble.append(f"{keyword} {args}".strip())
+    return name, preamble
+
+
+class ProgramWriter:
+    # Writes moves in the post-processor's layout: SPEED before every LMOVE,
+    # SPEED ... ALWAYS before a C1MOVE/C2MOVE pair, poses numbered from
+    # linear.t1 / circular.t1 in one .TRANS section at the end. Poses are
+    # absolute (base offsets included), like the move table. The .TRANS rows
+    # are staged in a temporary file until close(). pose_tag is inserted into
+    # the pose names (linear<tag>.tN) so several programs can be resident at
+    # once; stop=False leaves out .STOP for programs that are CALLed.
+    def __init__(self, path, name, preamble=("ACCURACY 0.01 ALWAYS",), pose_tag="", stop=True):
+        self.path = path
+        self.file = open(path, "w")
+        self.trans = open(path + ".trans.tmp", "w+")
+        self.pose_tag = pose_tag
+        self.stop = stop
+        self.count = 0
+        self.file.write(f".PROGRAM {name}\n")
+        for line in preamble:
+            self.file.write(line + "\n")
+
+    def move(self, kind, pose, feed):
+        # kind is one of MOVE_TYPES' values, pose (x, y, z, o, a, t), feed in mm/s
+        if not np.isfinite(feed):
+            raise ValueError("moves with a percentage SPEED cannot be written")
+        self.count += 1
+        prefix = ("circular" if kind in (C1MOVE, C2MOVE) else "linear") + self.pose_tag
+        if kind == C1MOVE:
+            self.file.write(f"SPEED {feed:.2f} mm/s ALWAYS\n")
+        elif kind != C2MOVE:
+            self.file.write(f"SPEED {feed:.2f} mm/s\n")
+        self.file.write(f"{MOVE_NAMES[kind]} {prefix}.t{self.count} \n")
+        x, y, z, o, a, t = pose
+        self.trans.write(f"{prefix}.t{self.count}  {x:.4f} {y:.4f} {z:.4f} {o:.3f} {a:.3f} {t:.3f}\n")
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.write(".STOP\n.END\n" if self.stop else ".END\n")
+        self.file.write(";Starting buffer output\n.TRANS\n")
+        self.trans.seek(0)
+        for line in self.trans:
+            self.file.write(line)
+        self.file.write(".END\n;END OF TRANS\n")
+        self.file.close()
+        self.trans.close()
+        os.remove(self.trans.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index a Kawasaki AS program")
+    parser.add_argument("program", help=".pg file")
+    parser.add_argument("--index-dir", help=f"Index directory (default: <program>{INDEX_SUFFIX})")
+    parser.add_argument("--rapid-feed", type=float, default=250.0, help="Feed (mm/s) the post uses for rapids")
+    parser.add_argument("--layer-tolerance", type=float, default=0.05, help="Z rise (mm) that starts a new layer")
+    parser.add_argument("--rebuild", action="store_true")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    table = open_program(args.program, args.index_dir, args.rebuild, rapid_feed=args.rapid_feed,
+                         layer_tolerance=args.layer_tolerance)
+    elapsed = time.perf_counter() - started
+    moves = table.moves
+    print(f"{table.program}: {len(table)} moves, {table.header['poses']} poses, {table.layer_count} layers "
+          f"({elapsed:.2f} s, index built in {table.header['build_seconds']:.2f} s)")
+    for value, name in MOVE_NAMES.items():
+        count = int(np.count_nonzero(moves["type"] == value))
+        if count:
+            print(f"  {name}: {count}")
+    print(f"  rapids: {int(np.count_nonzero(moves['flags'] & FLAG_RAPID))}")
+    if table.layer_count:
+        print(f"  Z {table.layers['z'][0]:.3f} .. {table.layers['z'][-1]:.3f} mm")
+
+
+if __name__ == "__main__":
+    main()
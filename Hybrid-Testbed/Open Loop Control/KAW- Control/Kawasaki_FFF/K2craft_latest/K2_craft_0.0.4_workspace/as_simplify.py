@@ -0,0 +1,241 @@
+"""
+Offline toolpath simplification for AS programs.
+
+The post-processor writes one LMOVE per Fusion linear segment, so curved
+perimeters arrive as thousands of millimetre-long moves that starve the
+controller's look-ahead. This pass rewrites a program with fewer moves:
+
+- runs of LMOVEs whose points stay within the tolerance of one straight line
+  become a single LMOVE
+- runs of short LMOVEs whose points, and the segments between them, stay
+  within the tolerance of one circular arc become a C1MOVE/C2MOVE pair
+
+Only consecutive LMOVEs of the same layer with the same SPEED, the same
+rapid/printing flag and the same tool orientation are merged; every other
+move is copied as it is. End points of kept moves are never moved, so the
+deviation from the original path is bounded by the tolerance. A run is
+extended greedily from its first point, trying longer spans by doubling and
+then bisecting, and the arc is used when it reaches at least two segments
+further than the straight line.
+
+The result is written with as_program.ProgramWriter (same layout as the
+post) and the move-count reduction and the worst deviation are reported.
+
+Usage:
+python as_simplify.py part.pg part_simple.pg [--tolerance 0.05] [--max-arc-segment 5] [--verify]
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+
+import as_program
+from as_estimate import arc_angles, circle_through
+from as_program import C1MOVE, C2MOVE, LMOVE, ProgramWriter
+
+DEFAULT_TOLERANCE = 0.05          # mm
+DEFAULT_MAX_ARC_SEGMENT = 5.0     # mm, longer segments are treated as deliberate corners, not a tessellated curve
+MAX_ARC_SWEEP = 1.5 * math.pi     # keeps the C1MOVE via point well away from both ends
+MAX_ARC_RADIUS = 1e5              # mm, flatter "arcs" are left to the straight-line merge
+ORIENTATION_TOLERANCE = 1e-3      # degrees
+
+
+def line_fit(points, tolerance):
+    # -> max distance of the inner points from the chord, or None if they leave the
+    # tolerance or do not advance along it
+    chord = points[-1] - points[0]
+    length2 = chord @ chord
+    if length2 == 0.0:
+        return None
+    relative = points[1:-1] - points[0]
+    t = relative @ chord / length2
+    if t.min() < 0.0 or t.max() > 1.0 or np.any(np.diff(t) < 0.0):
+        return None
+    deviation = np.linalg.norm(relative - t[:, None] * chord, axis=1).max()
+    return deviation if deviation <= tolerance else None
+
+
+def arc_fit(points, tolerance, max_sweep=MAX_ARC_SWEEP):
+    # -> (max deviation, via point) of the arc from points[0] through points[len // 2] to points[-1],
+    # or None if any point or any segment between them is further than the tolerance from it
+    center, normal, radius, round_ = circle_through(points[:1], points[len(points) // 2][None], points[-1:])
+    if not round_[0] or radius[0] > MAX_ARC_RADIUS:
+        return None
+    center, normal, radius = center[0], normal[0], radius[0]
+    theta, relative = arc_angles(points, center, normal, radius)
+    theta[0] = 0.0
+    steps = np.diff(theta)
+    if theta[-1] > max_sweep or np.any(steps <= 0.0):
+        return None
+    height = relative @ normal
+    radial = np.linalg.norm(relative - height[:, None] * normal, axis=1)
+    off_circle = np.sqrt(height ** 2 + (radial - radius) ** 2).max()
+    sagitta = (radius * (1.0 - np.cos(steps / 2.0))).max()
+    deviation = max(off_circle, sagitta)
+    if deviation > tolerance:
+        return None
+    e1 = (points[0] - center) / radius
+    e2 = np.cross(normal, e1)
+    half = theta[-1] / 2.0
+    return deviation, center + radius * (math.cos(half) * e1 + math.sin(half) * e2)
+
+
+def _longest(first, last, fit):
+    # -> (j, fit(j)) for the largest j in first..last that fits, searching by doubling and then
+    # bisecting (a span that fits usually means every shorter one does too), or None
+    result = fit(first)
+    if result is None:
+        return None
+    best, best_result = first, result
+    failed = None
+    step = 1
+    while best < last:
+        j = min(best + step, last)
+        result = fit(j)
+        if result is None:
+            failed = j
+            break
+        best, best_result = j, result
+        step *= 2
+    if failed is not None:
+        low, high = best + 1, failed - 1
+        while low <= high:
+            j = (low + high) // 2
+            result = fit(j)
+            if result is None:
+                high = j - 1
+            else:
+                best, best_result = j, result
+                low = j + 1
+    return best, best_result
+
+
+def simplify_run(points, tolerance, max_arc_segment):
+    # points[0] is where the run starts (already written), points[1:] the run's LMOVE targets.
+    # -> list of ("line", end index, deviation) / ("arc", end index, deviation, via point)
+    count = len(points) - 1
+    lengths = np.linalg.norm(np.diff(points, axis=0), axis=1)
+    # Distance of every inner point from the chord of its neighbours: a line merge can only start where it is small
+    chords = points[2:] - points[:-2]
+    relative = points[1:-1] - points[:-2]
+    chord_length2 = np.maximum(np.einsum("ij,ij->i", chords, chords), 1e-30)
+    t = np.einsum("ij,ij->i", relative, chords) / chord_length2
+    corner = np.linalg.norm(relative - t[:, None] * chords, axis=1)
+    short = lengths <= max_arc_segment
+
+    out = []
+    a = 0
+    while a < count:
+        end, deviation = a + 1, 0.0
+        if a + 2 <= count and corner[a] <= tolerance:
+            found = _longest(a + 2, count, lambda j: line_fit(points[a:j + 1], tolerance))
+            if found is not None:
+                end, deviation = found
+        if a + 3 <= count and short[a] and short[a + 1] and short[a + 2]:
+            found = _longest(a + 3, count, lambda j: arc_fit(points[a:j + 1], tolerance))
+            if found is not None and found[0] >= end + 2:
+                arc_end, (arc_deviation, via) = found
+                out.append(("arc", arc_end, arc_deviation, via))
+                a = arc_end
+                continue
+        out.append(("line", end, deviation))
+        a = end
+    return out
+
+
+def _runs(moves):
+    # -> (start, stop) row ranges of consecutive LMOVEs that may be merged with each other
+    mergeable = np.asarray(moves["type"]) == LMOVE
+    same = mergeable.copy()
+    same[0] = False
+    same[1:] &= mergeable[:-1]
+    same[1:] &= moves["feed"][1:] == moves["feed"][:-1]
+    same[1:] &= moves["flags"][1:] == moves["flags"][:-1]
+    for name in ("o", "a", "t"):
+        same[1:] &= np.abs(moves[name][1:] - moves[name][:-1]) <= ORIENTATION_TOLERANCE
+    starts = np.flatnonzero(mergeable & ~same)
+    stops = np.flatnonzero(mergeable & ~np.r_[same[1:], False]) + 1
+    return zip(starts, stops)
+
+
+def simplify(table, path, tolerance=DEFAULT_TOLERANCE, max_arc_segment=DEFAULT_MAX_ARC_SEGMENT, name=None,
+             preamble=("ACCURACY 0.01 ALWAYS",)):
+    # Writes the simplified program to path; returns a dict of statistics
+    stats = {"moves_in": len(table), "moves_out": 0, "merged_lines": 0, "arcs": 0, "max_deviation": 0.0}
+    previous = None
+    with ProgramWriter(path, name or table.program or "JDHsimplified", preamble) as writer:
+        for number in range(table.layer_count):
+            moves = np.array(table.layer(number))
+            xyz = np.column_stack((moves["x"], moves["y"], moves["z"]))
+            orientation = np.column_stack((moves["o"], moves["a"], moves["t"])).astype(np.float64)
+            written = 0
+
+            def copy(row):
+                writer.move(int(moves["type"][row]), (*xyz[row], *orientation[row]), float(moves["feed"][row]))
+
+            for start, stop in _runs(moves):
+                for row in range(written, start):
+                    copy(row)
+                if previous is None and number == 0 and start == 0:
+                    # The program's first move starts from wherever the robot is; keep it as it is
+                    copy(start)
+                    start += 1
+                    if start == stop:
+                        written = stop
+                        continue
+                begin = xyz[start - 1] if start > 0 else previous
+                points = np.vstack((begin, xyz[start:stop]))
+                feed = float(moves["feed"][start])
+                pose = orientation[start]
+                reached = 0
+                for piece in simplify_run(points, tolerance, max_arc_segment):
+                    row = start + piece[1] - 1
+                    stats["max_deviation"] = max(stats["max_deviation"], float(piece[2]))
+                    if piece[0] == "arc":
+                        stats["arcs"] += 1
+                        writer.move(C1MOVE, (*piece[3], *pose), feed)
+                        writer.move(C2MOVE, (*xyz[row], *pose), feed)
+                    else:
+                        if piece[1] - reached > 1:
+                            stats["merged_lines"] += 1
+                        writer.move(LMOVE, (*xyz[row], *pose), feed)
+                    reached = piece[1]
+                written = stop
+            for row in range(written, len(moves)):
+                copy(row)
+            if len(moves):
+                previous = xyz[-1]
+        stats["moves_out"] = writer.count
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge collinear LMOVEs and refit tessellated curves as arcs")
+    parser.add_argument("program", help=".pg file to simplify")
+    parser.add_argument("output", help="Simplified .pg file to write")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Allowed deviation (mm)")
+    parser.add_argument("--max-arc-segment", type=float, default=DEFAULT_MAX_ARC_SEGMENT,
+                        help="Only segments up to this long (mm) are refitted as arcs")
+    parser.add_argument("--verify", action="store_true", help="Index the output and check its move count")
+    args = parser.parse_args()
+
+    table = as_program.open_program(args.program)
+    name, preamble = as_program.read_preamble(args.program)
+    started = time.perf_counter()
+    stats = simplify(table, args.output, args.tolerance, args.max_arc_segment, name, preamble)
+    elapsed = time.perf_counter() - started
+    removed = stats["moves_in"] - stats["moves_out"]
+    print(f"{table.program}: {stats['moves_in']} -> {stats['moves_out']} moves "
+          f"({-removed / max(stats['moves_in'], 1) * 100:+.1f}%) in {elapsed:.2f} s")
+    print(f"  {stats['merged_lines']} merged LMOVEs, {stats['arcs']} arcs, "
+          f"max deviation {stats['max_deviation']:.4f} mm (tolerance {args.tolerance} mm)")
+    if args.verify:
+        result = as_program.open_program(args.output, rebuild=True)
+        if len(result) != stats["moves_out"]:
+            raise SystemExit(f"{args.output} has {len(result)} moves, expected {stats['moves_out']}")
+        print(f"  {args.output}: {len(result)} moves, {result.layer_count} layers (input {table.layer_count})")
+
+
+if __name__ == "__main__":
+    main()
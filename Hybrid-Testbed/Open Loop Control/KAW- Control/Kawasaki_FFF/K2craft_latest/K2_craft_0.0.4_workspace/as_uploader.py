@@ -0,0 +1,294 @@
+"""
+Chunked streaming of an AS program to the robot controller.
+
+The post writes a whole print into one .pg file, so the print size is bound
+by the controller's program memory and the upload has to finish before the
+robot can start. StreamingUploader instead splits the indexed program
+(as_program.MoveTable) into subprograms of about chunk_moves moves, each with
+its own .TRANS section holding only the poses it uses, and keeps a fixed
+number of them (double buffering by default) resident on the controller:
+
+    slot 0: JDHpart_0  poses linear0.tN / circular0.tN   <- running chunk i
+    slot 1: JDHpart_1  poses linear1.tN / circular1.tN   <- chunk i + 1, queued
+
+As soon as chunk i has finished, chunk i + 2 is written over slot 0 while
+chunk i + 1 runs, so controller memory never holds more than two chunks and
+the robot never waits for an upload as long as one chunk takes longer to
+run than to upload. C1MOVE/C2MOVE pairs are never split across chunks; a
+chunk starts wherever the previous one ended, which is where the robot is.
+
+Only the first chunk carries the program's full preamble (HERE #wcs,
+SETHOME ... set up the work coordinates once, before the first move); the
+later chunks repeat just its motion mode statements (ACCURACY, ACCEL,
+DECEL), so HOME is never redefined in the middle of a print.
+
+The controller side is an endpoint object:
+
+    load(slot, name, data)    store subprogram name (program and .TRANS text, bytes) in slot,
+                              replacing what the slot held; raises UploadError
+    run(name) -> job          queue name to run after everything queued before it
+    wait(job, timeout) -> bool
+                              True once the job has finished
+    finish()                  no more jobs will be queued
+    stats() -> dict
+    close()
+
+SimulatedController implements it in memory with an upload rate, a memory
+limit and a fixed time per move, and counts the stalls where the robot ran
+out of queued chunks. Talking to a real controller (loading over the AS
+terminal connection and a resident main program that CALLs the slots in
+turn) is not implemented here.
+
+Usage:
+python as_uploader.py part.pg [--chunk-moves 2000] [--buffers 2] [--upload-rate 20000] [--move-time 0.05]
+                              [--speedup 100] [--memory-limit 500000] [--spool dir]
+"""
+import argparse
+import collections
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import as_program
+from as_program import C2MOVE, MOVE_TYPES, ProgramWriter
+
+# Kawasaki program and variable names are limited to 15 characters
+MAX_NAME_LENGTH = 15
+# Preamble statements that only set the motion mode and are repeated at the top of every chunk
+MODE_STATEMENTS = {"ACCURACY", "ACCEL", "DECEL"}
+
+
+class UploadError(RuntimeError):
+    pass
+
+
+class ControllerEndpoint:
+    # Interface of the controller side; see the module docstring
+    def load(self, slot, name, data):
+        raise NotImplementedError
+
+    def run(self, name):
+        raise NotImplementedError
+
+    def wait(self, job, timeout=None):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+    def stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+class SimulatedController(ControllerEndpoint):
+    # Uploads take len(data) / upload_rate seconds, a program runs for move_time
+    # seconds per motion statement; both are divided by speedup. Loading more than
+    # memory_limit bytes in total, or over a slot whose program is still queued or
+    # running, raises UploadError, as a real controller would refuse it.
+    def __init__(self, upload_rate=20000.0, move_time=0.05, speedup=1.0, memory_limit=None):
+        self.upload_rate = upload_rate
+        self.move_time = move_time
+        self.speedup = speedup
+        self.memory_limit = memory_limit
+        self.slots = {}             # slot -> (name, size, moves)
+        self.queue = collections.deque()
+        self.busy = set()           # names queued or running
+        self.finished_jobs = set()
+        self.condition = threading.Condition()
+        self.next_job = 0
+        self.done = False
+        self.closed = False
+        self.counters = {"uploads": 0, "uploaded_bytes": 0, "upload_s": 0.0, "jobs": 0, "moves": 0,
+                         "peak_resident_bytes": 0, "stalls": 0, "stall_s": 0.0, "run_s": 0.0}
+        self.thread = threading.Thread(target=self._execute, daemon=True)
+        self.thread.start()
+
+    def load(self, slot, name, data):
+        started = time.monotonic()
+        time.sleep(len(data) / self.upload_rate / self.speedup)
+        moves = sum(1 for line in data.splitlines() if line.split(b" ", 1)[0].decode() in MOVE_TYPES)
+        with self.condition:
+            if name in self.busy or (slot in self.slots and self.slots[slot][0] in self.busy):
+                raise UploadError(f"slot {slot} is still in use")
+            resident = sum(size for s, (_, size, _) in self.slots.items() if s != slot) + len(data)
+            if self.memory_limit is not None and resident > self.memory_limit:
+                raise UploadError(f"controller memory full: {resident} > {self.memory_limit} bytes")
+            self.slots[slot] = (name, len(data), moves)
+            self.counters["uploads"] += 1
+            self.counters["uploaded_bytes"] += len(data)
+            self.counters["upload_s"] += time.monotonic() - started
+            self.counters["peak_resident_bytes"] = max(self.counters["peak_resident_bytes"], resident)
+
+    def run(self, name):
+        with self.condition:
+            moves = next((moves for loaded, _, moves in self.slots.values() if loaded == name), None)
+            if moves is None:
+                raise UploadError(f"program {name} is not loaded")
+            job = self.next_job
+            self.next_job += 1
+            self.busy.add(name)
+            self.queue.append((job, name, moves))
+            self.condition.notify_all()
+            return job
+
+    def wait(self, job, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(lambda: job in self.finished_jobs or self.closed, timeout)
+
+    def finish(self):
+        with self.condition:
+            self.done = True
+            self.condition.notify_all()
+
+    def _execute(self):
+        idle_since = None
+        while True:
+            with self.condition:
+                while not self.queue and not self.done and not self.closed:
+                    if idle_since is None and self.counters["jobs"]:
+                        # The robot finished a chunk and the next one is not there yet
+                        idle_since = time.monotonic()
+                        self.counters["stalls"] += 1
+                    self.condition.wait()
+                if self.closed or not self.queue:
+                    return
+                if idle_since is not None:
+                    self.counters["stall_s"] += (time.monotonic() - idle_since) * self.speedup
+                    idle_since = None
+                job, name, moves = self.queue.popleft()
+            duration = moves * self.move_time
+            time.sleep(duration / self.speedup)
+            with self.condition:
+                self.busy.discard(name)
+                self.finished_jobs.add(job)
+                self.counters["jobs"] += 1
+                self.counters["moves"] += moves
+                self.counters["run_s"] += duration
+                self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return dict(self.counters, resident_bytes=sum(size for _, size, _ in self.slots.values()))
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join(timeout=1.0)
+
+
+class StreamingUploader:
+    # Streams table to endpoint in chunks; the chunk files are written to spool_dir
+    # (a temporary directory by default) so they can be inspected afterwards
+    def __init__(self, table, endpoint, chunk_moves=2000, buffers=2, name=None, preamble=("ACCURACY 0.01 ALWAYS",),
+                 spool_dir=None):
+        if buffers < 2:
+            raise ValueError("need at least two buffers to upload while a chunk runs")
+        if chunk_moves < 2:
+            raise ValueError("chunk_moves must be at least 2")
+        base = name or table.program or "JDHprint"
+        self.names = [f"{base[:MAX_NAME_LENGTH - 1 - len(str(slot))]}_{slot}" for slot in range(buffers)]
+        # Pose names are linear<slot>.tN; N must stay short enough for the name limit
+        if len(f"circular{buffers - 1}.t{chunk_moves + 1}") > MAX_NAME_LENGTH:
+            raise ValueError(f"chunk_moves {chunk_moves} makes pose names longer than {MAX_NAME_LENGTH} characters")
+        self.table = table
+        self.endpoint = endpoint
+        self.chunk_moves = chunk_moves
+        self.buffers = buffers
+        self.preamble = preamble
+        self.chunk_preamble = [line for line in preamble if line.split(" ", 1)[0].upper() in MODE_STATEMENTS]
+        self.own_spool = spool_dir is None
+        self.spool_dir = spool_dir or tempfile.mkdtemp(prefix="as_upload_")
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.chunks = list(as_program.chunk_ranges(table.moves["type"], chunk_moves))
+        self.uploaded = 0
+        self.finished = 0
+
+    def render(self, index):
+        # -> bytes of chunk index as a subprogram for its slot
+        slot = index % self.buffers
+        start, stop = self.chunks[index]
+        path = os.path.join(self.spool_dir, f"chunk_{index:05d}.pg")
+        moves = self.table.moves[start:stop]
+        if moves["type"][0] == C2MOVE:
+            raise as_program.ProgramError("chunk starts with a C2MOVE", int(moves["line"][0]))
+        preamble = self.preamble if index == 0 else self.chunk_preamble
+        with ProgramWriter(path, self.names[slot], preamble, pose_tag=str(slot), stop=False) as writer:
+            for row in moves:
+                writer.move(int(row["type"]), (row["x"], row["y"], row["z"], row["o"], row["a"], row["t"]),
+                            float(row["feed"]))
+        with open(path, "rb") as f:
+            return f.read()
+
+    def run(self, progress=None, timeout=None):
+        # Uploads and queues every chunk, never more than buffers ahead of the robot; returns when the
+        # last chunk has finished. progress(index, count) is called after each upload.
+        jobs = []
+        count = len(self.chunks)
+        try:
+            for index in range(count):
+                if index >= self.buffers:
+                    # The slot is free once the chunk that used it last has finished
+                    if not self.endpoint.wait(jobs[index - self.buffers], timeout):
+                        raise UploadError(f"chunk {index - self.buffers} did not finish within {timeout} s")
+                    self.finished = index - self.buffers + 1
+                slot = index % self.buffers
+                self.endpoint.load(slot, self.names[slot], self.render(index))
+                jobs.append(self.endpoint.run(self.names[slot]))
+                self.uploaded = index + 1
+                if progress is not None:
+                    progress(index, count)
+            self.endpoint.finish()
+            for job in jobs[-self.buffers:]:
+                if not self.endpoint.wait(job, timeout):
+                    raise UploadError(f"job {job} did not finish within {timeout} s")
+            self.finished = count
+        finally:
+            if self.own_spool:
+                shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream an AS program to a (simulated) controller in chunks")
+    parser.add_argument("program", help=".pg file")
+    parser.add_argument("--chunk-moves", type=int, default=2000, help="Moves per subprogram")
+    parser.add_argument("--buffers", type=int, default=2, help="Subprograms resident on the controller")
+    parser.add_argument("--upload-rate", type=float, default=20000.0, help="Simulated upload speed (bytes/s)")
+    parser.add_argument("--move-time", type=float, default=0.05, help="Simulated run time per move (s)")
+    parser.add_argument("--speedup", type=float, default=100.0, help="Run the simulation this much faster")
+    parser.add_argument("--memory-limit", type=int, help="Simulated controller program memory (bytes)")
+    parser.add_argument("--spool", help="Keep the chunk files in this directory")
+    args = parser.parse_args()
+
+    table = as_program.open_program(args.program)
+    name, preamble = as_program.read_preamble(args.program)
+    controller = SimulatedController(args.upload_rate, args.move_time, args.speedup, args.memory_limit)
+    uploader = StreamingUploader(table, controller, args.chunk_moves, args.buffers, name, preamble, args.spool)
+    count = len(uploader.chunks)
+    print(f"{table.program}: {len(table)} moves in {count} chunks of up to {args.chunk_moves} moves "
+          f"({os.path.getsize(args.program)} bytes as one program)")
+    started = time.monotonic()
+
+    def progress(index, count):
+        if index % max(1, count // 10) == 0 or index == count - 1:
+            print(f"  uploaded chunk {index + 1}/{count}")
+
+    try:
+        uploader.run(progress)
+    finally:
+        controller.close()
+    elapsed = time.monotonic() - started
+    stats = controller.stats()
+    print(f"Done in {elapsed:.1f} s wall ({elapsed * args.speedup:.0f} s simulated): {stats['jobs']} chunks, "
+          f"{stats['moves']} moves run")
+    print(f"  uploaded {stats['uploaded_bytes']} bytes, peak resident {stats['peak_resident_bytes']} bytes")
+    print(f"  robot stalls waiting for a chunk: {stats['stalls']} ({stats['stall_s']:.1f} s simulated)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Index build time and memory for large AS programs.
+
+Writes a synthetic print in the exact layout of the Fusion post-processor
+(2023-11-15 simple.cps): rectangular perimeters with arc corners, zig-zag
+infill and rapids between them, then times as_program.build_index and
+reports its peak Python/NumPy allocation, and how long seeking a layer
+through the index takes.
+
+Usage:
+python bench_as_program.py [--layers 400] [--infill 100] [--arc-segments 0] [--keep part.pg]
+"""
+import argparse
+import math
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import as_program
+
+# Post-processor properties (xOffset .. tOffset, RapidFeed)
+OFFSET = (1156.0, 919.0, 1240.0)
+ORIENTATION = (90.0, 90.0, 0.0)
+RAPID_FEED = 250.0
+
+
+class _PostWriter:
+    # Mirrors the post's onLinear5D / onCircular output and its TRANS buffer
+    def __init__(self, program, trans):
+        self.program = program
+        self.trans = trans
+        self.index = 1
+
+    def _pose(self, prefix, x, y, z):
+        self.trans.write(f"{prefix}.t{self.index}  {x + OFFSET[0]:.4f} {y + OFFSET[1]:.4f} {z + OFFSET[2]:.4f}"
+                         f" {ORIENTATION[0]:.3f} {ORIENTATION[1]:.3f} {ORIENTATION[2]:.3f}\n")
+        self.index += 1
+
+    def linear(self, x, y, z, feed):
+        self.program.write(f"SPEED {feed:.2f} mm/s\n")
+        self.program.write(f"LMOVE linear.t{self.index} \n")
+        self._pose("linear", x, y, z)
+
+    def arc(self, mid, end, z, feed):
+        self.program.write(f"SPEED {feed:.2f} mm/s ALWAYS\n")
+        self.program.write(f"C1MOVE circular.t{self.index} \n")
+        self._pose("circular", mid[0], mid[1], z)
+        self.program.write(f"C2MOVE circular.t{self.index} \n")
+        self._pose("circular", end[0], end[1], z)
+
+
+def synthetic_program(path, layers=400, infill=100, width=120.0, depth=80.0, radius=5.0, layer_height=0.4,
+                      feed=25.0, arc_segments=0):
+    # -> number of moves written. The TRANS section is staged in a temporary file, like the post's buffer.
+    # With arc_segments the corners are written as that many LMOVEs each, like a post with arcs disabled.
+    with open(path, "w") as program, tempfile.TemporaryFile("w+") as trans:
+        program.write(".PROGRAM JDHsynthetic\nACCURACY 0.01 ALWAYS\nHERE #wcs\nSETHOME 0.1 #wcs\n")
+        post = _PostWriter(program, trans)
+        for layer in range(layers):
+            z = (layer + 1) * layer_height
+            post.linear(radius, 0.0, z + 2.0, RAPID_FEED)
+            post.linear(radius, 0.0, z, RAPID_FEED)
+            # Perimeter: straight edges joined by quarter arcs
+            corners = [((width - radius, 0.0), (width, radius), (width - radius, radius)),
+                       ((width, depth - radius), (width - radius, depth), (width - radius, depth - radius)),
+                       ((radius, depth), (0.0, depth - radius), (radius, depth - radius)),
+                       ((0.0, radius), (radius, 0.0), (radius, radius))]
+            for (ex, ey), end, center in corners:
+                post.linear(ex, ey, z, feed)
+                angle = math.atan2(ey - center[1], ex - center[0])
+                if arc_segments:
+                    for i in range(1, arc_segments + 1):
+                        step = angle + i * (math.pi / 2) / arc_segments
+                        post.linear(center[0] + radius * math.cos(step), center[1] + radius * math.sin(step), z, feed)
+                    continue
+                angle += math.pi / 4
+                mid = (center[0] + radius * math.cos(angle), center[1] + radius * math.sin(angle))
+                post.arc(mid, end, z, feed)
+            # Zig-zag infill, alternating direction per layer
+            post.linear(2 * radius, 2 * radius, z, RAPID_FEED)
+            for i in range(infill):
+                t = i / max(1, infill - 1)
+                if layer % 2:
+                    x = 2 * radius + t * (width - 4 * radius)
+                    post.linear(x, 2 * radius if i % 2 == 0 else depth - 2 * radius, z, feed)
+                else:
+                    y = 2 * radius + t * (depth - 4 * radius)
+                    post.linear(2 * radius if i % 2 == 0 else width - 2 * radius, y, z, feed)
+        program.write(".STOP\n.END\n;Starting buffer output\n.TRANS\n")
+        trans.seek(0)
+        shutil.copyfileobj(trans, program)
+        program.write(".END\n;END OF TRANS\n")
+        return post.index - 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the AS program index")
+    parser.add_argument("--layers", type=int, default=400)
+    parser.add_argument("--infill", type=int, default=100, help="Infill lines per layer")
+    parser.add_argument("--arc-segments", type=int, default=0, help="Write corners as this many LMOVEs")
+    parser.add_argument("--keep", help="Write the synthetic program here and keep it")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    path = args.keep or os.path.join(workdir, "synthetic.pg")
+    try:
+        moves = synthetic_program(path, args.layers, args.infill, arc_segments=args.arc_segments)
+        size_mb = os.path.getsize(path) / 1e6
+        started = time.perf_counter()
+        table = as_program.build_index(path, os.path.join(workdir, "index"))
+        elapsed = time.perf_counter() - started
+        # Second build under tracemalloc (which slows it down) for the peak allocation
+        tracemalloc.start()
+        as_program.build_index(path, os.path.join(workdir, "traced"))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{moves} moves, {size_mb:.1f} MB program: index built in {elapsed:.2f} s "
+              f"({moves / elapsed:.0f} moves/s), peak allocation {peak / 1e6:.1f} MB")
+        print(f"  {table.layer_count} layers found (expected {args.layers})")
+
+        rng = np.random.default_rng(0)
+        started = time.perf_counter()
+        samples = 1000
+        for layer in rng.integers(0, table.layer_count, samples):
+            table.layer(layer)["z"].max()
+        print(f"  layer seek + read: {(time.perf_counter() - started) / samples * 1e6:.0f} us")
+        started = time.perf_counter()
+        as_program.open_program(path, os.path.join(workdir, "index"))
+        print(f"  reopening a fresh index: {(time.perf_counter() - started) * 1000:.1f} ms")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
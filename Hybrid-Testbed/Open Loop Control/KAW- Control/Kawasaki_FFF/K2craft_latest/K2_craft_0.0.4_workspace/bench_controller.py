@@ -0,0 +1,140 @@
+"""
+End-to-end benchmark of the GUI's controller link against k2_simulator.
+
+Runs a K2Core, the control core K2_craft and k2_headless are built on, with
+its ControllerServer on 127.0.0.1 and no camera. A PLCSimulator connects to
+it from a second thread. The main thread plays the front end's role and
+calls core.poll(). The core's log lines are discarded while it runs, and its
+telemetry goes to a temporary directory.
+
+Two measurements:
+- command throughput: a burst of SET_OUTPUT commands, timed until every one
+  is acknowledged, plus the per-command round-trip percentiles
+- IO-update latency: the simulator toggles inputs at --io-rate and stamps
+  each IO_STATE frame; latency is taken when the frame reaches the dispatcher
+
+Usage:
+python bench_controller.py [--commands 5000] [--window 32] [--io-rate 200] [--duration 5] [--fragment 1 32] [--latency-ms 1]
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from k2_commands import LatencyHistogram
+from k2_core import K2Core
+from k2_protocol import IO_STATE, unpack_io_state
+from k2_server import ControllerServer
+from k2_simulator import PLCSimulator, millis
+
+
+class IOLatencyProbe:
+    # Times every IO_STATE frame when it reaches the core's dispatcher, then hands it to the core as usual
+    def __init__(self, core):
+        self.core = core
+        self.latency = LatencyHistogram()
+        self.updates = 0
+        core.dispatcher.on_binary(IO_STATE, self.on_io_state)
+
+    def on_io_state(self, payload):
+        seq, timestamp_ms, masks = unpack_io_state(payload)
+        self.updates += 1
+        self.latency.record((millis() - timestamp_ms) & 0xFFFFFFFF)
+        self.core.handle_io_state(payload)
+
+
+def make_core(telemetry_dir):
+    core = K2Core(ControllerServer("127.0.0.1", 0), telemetry_dir=telemetry_dir)
+    core.on_text = lambda line: None
+    core.start()
+    return core
+
+
+def start_simulator(simulator, duration):
+    thread = threading.Thread(target=lambda: asyncio.run(simulator.run(duration)), daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_connected(core, timeout=5.0):
+    # Also waits for the connected event, so the core has sent its REQUEST_IO_UPDATE before timing starts
+    deadline = time.monotonic() + timeout
+    while not (core.connected and core.acks.stats()["acked"]):
+        if time.monotonic() > deadline:
+            raise SystemExit("Simulator did not connect")
+        core.poll(timeout=0.001)
+
+
+def command_throughput(core, commands, window):
+    # Keeps at most window commands unacknowledged, like a client that respects the controller's pace
+    start = time.perf_counter()
+    sent = 0
+    while sent < commands or core.acks.stats()["pending"]:
+        while sent < commands and core.acks.stats()["pending"] < window:
+            core.set_output(sent % 2 + 1, sent % 16 + 1, sent % 2)
+            sent += 1
+        core.poll(timeout=0.001)
+    elapsed = time.perf_counter() - start
+    return elapsed, core.acks.summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the controller link against the simulator")
+    parser.add_argument("--commands", type=int, default=5000)
+    parser.add_argument("--window", type=int, default=32, help="Maximum unacknowledged commands")
+    parser.add_argument("--io-rate", type=float, default=200.0, help="Simulated input changes per second")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds of IO traffic to measure")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Simulated controller handling delay")
+    parser.add_argument("--fragment", type=int, nargs=2, metavar=("MIN", "MAX"))
+    args = parser.parse_args()
+
+    fragment = tuple(args.fragment) if args.fragment else None
+    telemetry_dir = tempfile.mkdtemp(prefix="bench_controller_")
+    quiet = open(os.devnull, "w")
+
+    try:
+        # Command throughput with IO pushes switched off
+        with contextlib.redirect_stdout(quiet):
+            core = make_core(os.path.join(telemetry_dir, "commands"))
+            simulator = PLCSimulator(*core.transport.address, io_rate_hz=0, latency_ms=args.latency_ms,
+                                     fragment=fragment)
+            thread = start_simulator(simulator, None)
+            wait_connected(core)
+            elapsed, summary = command_throughput(core, args.commands, args.window)
+            stats = core.acks.stats()
+            simulator.stop()
+            thread.join(timeout=2.0)
+            core.close()
+        print(f"Commands: {args.commands} acknowledged in {elapsed:.2f} s "
+              f"({args.commands / elapsed:.0f} commands/s), retried {stats['retried']}, failed {stats['failed']}")
+        for name, count, mean, p50, p95, p99, worst in summary:
+            print(f"  {name}: round trip mean {mean:.2f} ms, p50 {p50:.2f}, p95 {p95:.2f}, p99 {p99:.2f}, "
+                  f"max {worst:.2f}")
+
+        # IO-update latency
+        with contextlib.redirect_stdout(quiet):
+            core = make_core(os.path.join(telemetry_dir, "io"))
+            probe = IOLatencyProbe(core)
+            simulator = PLCSimulator(*core.transport.address, io_rate_hz=args.io_rate, fragment=fragment)
+            thread = start_simulator(simulator, args.duration)
+            wait_connected(core)
+            deadline = time.monotonic() + args.duration
+            while time.monotonic() < deadline:
+                core.poll(timeout=0.001)
+            simulator.stop()
+            thread.join(timeout=2.0)
+            core.close()
+        h = probe.latency
+        print(f"IO updates: {probe.updates} in {args.duration:.1f} s, latency mean {h.mean():.2f} ms, "
+              f"p50 {h.percentile(50):.2f}, p95 {h.percentile(95):.2f}, p99 {h.percentile(99):.2f}, max {h.max:.2f}")
+    finally:
+        quiet.close()
+        shutil.rmtree(telemetry_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
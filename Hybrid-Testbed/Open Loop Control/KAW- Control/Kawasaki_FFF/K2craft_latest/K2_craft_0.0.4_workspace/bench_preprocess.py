@@ -0,0 +1,111 @@
+"""
+Measures what the shared preprocessing cache saves per frame.
+
+Every detector is run on the same frame twice: once with a fresh FrameCache
+per detector (each recomputes gray/blur/HSV/Canny, like the old methods did)
+and once with one FrameCache shared by all of them. Then the display mode is
+run through VisionEngine.process, the GUI's path through the process pool,
+and the cache hits of the parent and its workers are reported.
+
+Usage:
+python bench_preprocess.py [--image frame.png] [--width 1920 --height 1200] [--frames 50]
+                           [--mode both] [--workers N]
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+import k2_vision
+
+DEFAULT_SETTINGS = {
+    "mode": "both",
+    "edge_low": 100,
+    "edge_high": 200,
+    "lower_hsv": (0, 120, 70),
+    "upper_hsv": (180, 255, 255),
+}
+
+
+def synthetic_frame(width, height, seed=0):
+    # Dark bed with bright bead lines, blobs and a few polygons plus sensor noise
+    rng = np.random.default_rng(seed)
+    image = np.full((height, width, 3), 40, dtype=np.uint8)
+    for _ in range(12):
+        x1, x2 = rng.integers(0, width, 2)
+        y1, y2 = rng.integers(0, height, 2)
+        cv2.line(image, (int(x1), int(y1)), (int(x2), int(y2)), (200, 200, 210), int(rng.integers(2, 8)))
+    for _ in range(20):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        cv2.circle(image, center, int(rng.integers(8, 40)), (30, 30, 180), -1)
+    for _ in range(6):
+        x, y = int(rng.integers(0, width - 100)), int(rng.integers(0, height - 100))
+        cv2.rectangle(image, (x, y), (x + int(rng.integers(20, 100)), y + int(rng.integers(20, 100))), (180, 220, 40), 2)
+    noise = rng.normal(0, 6, image.shape)
+    return np.clip(image + noise, 0, 255).astype(np.uint8)
+
+
+def run_all(image, settings, shared):
+    prep = k2_vision.FrameCache(image) if shared else None
+    for name in k2_vision.DETECTORS:
+        k2_vision.run_detector(name, image, settings, prep or k2_vision.FrameCache(image))
+    return prep
+
+
+def time_per_frame(image, settings, shared, frames):
+    run_all(image, settings, shared)  # warm up
+    start = time.perf_counter()
+    for _ in range(frames):
+        run_all(image, settings, shared)
+    return (time.perf_counter() - start) / frames * 1000.0
+
+
+def time_engine(image, settings, frames, workers):
+    # -> (ms per frame, cache hits/misses of the last frame) through the process pool
+    engine = k2_vision.VisionEngine(workers=workers)
+    try:
+        result = engine.process(1, image, settings)  # warm up the pool
+        start = time.perf_counter()
+        for frame_id in range(2, frames + 2):
+            result = engine.process(frame_id, image, settings)
+        return (time.perf_counter() - start) / frames * 1000.0, result.preprocess
+    finally:
+        engine.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the shared preprocessing cache")
+    parser.add_argument("--image", help="Frame to benchmark on (default: synthetic)")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1200)
+    parser.add_argument("--frames", type=int, default=50)
+    parser.add_argument("--mode", default=DEFAULT_SETTINGS["mode"], choices=sorted(k2_vision.MODE_DETECTORS),
+                        help="Display mode run through VisionEngine.process")
+    parser.add_argument("--workers", type=int, help="Engine worker processes (default: cores - 1)")
+    args = parser.parse_args()
+
+    image = cv2.imread(args.image) if args.image else synthetic_frame(args.width, args.height)
+    if image is None:
+        raise SystemExit(f"Could not read {args.image}")
+    if args.image:
+        # The pipeline works on RGB frames
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+    separate = time_per_frame(image, DEFAULT_SETTINGS, False, args.frames)
+    shared = time_per_frame(image, DEFAULT_SETTINGS, True, args.frames)
+    prep = run_all(image, DEFAULT_SETTINGS, True)
+    settings = dict(DEFAULT_SETTINGS, mode=args.mode)
+    engine, preprocess = time_engine(image, settings, args.frames, args.workers)
+
+    print(f"Frame {image.shape[1]}x{image.shape[0]}, all {len(k2_vision.DETECTORS)} detectors, {args.frames} frames")
+    print(f"  separate preprocessing: {separate:8.2f} ms/frame")
+    print(f"  shared preprocessing:   {shared:8.2f} ms/frame")
+    print(f"  saved:                  {separate - shared:8.2f} ms/frame ({(1 - shared / separate) * 100:.1f}%)")
+    print(f"  cache hits/misses per frame: {prep.hits}/{prep.misses}")
+    print(f"VisionEngine.process, mode {args.mode}:")
+    print(f"  {engine:8.2f} ms/frame, cache hits/misses per frame: {preprocess['hits']}/{preprocess['misses']}")
+
+
+if __name__ == "__main__":
+    main()
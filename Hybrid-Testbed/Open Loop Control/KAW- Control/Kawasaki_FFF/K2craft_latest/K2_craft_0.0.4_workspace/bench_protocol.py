@@ -0,0 +1,113 @@
+"""
+Fuzz and throughput harness for the k2_protocol framing layer.
+
+Builds a byte stream of PLC-style messages (IO state lines, status lines and
+binary frames), or loads a captured one, and replays it through a
+FrameDecoder in randomly sized chunks, from single bytes up to large
+coalesced reads. Every replay must decode to the same frames as a one-shot
+parse. A second pass feeds random garbage between valid frames to check the
+decoder never raises and resynchronises afterwards.
+
+Usage:
+python bench_protocol.py [--capture stream.bin] [--messages 20000] [--rounds 5]
+"""
+import argparse
+import random
+import time
+
+from k2_protocol import FrameDecoder, encode_line, encode_binary
+
+
+def synthetic_stream(messages, seed=0, crlf=True):
+    rng = random.Random(seed)
+    parts = []
+    for i in range(messages):
+        kind = rng.random()
+        if kind < 0.6:
+            channel = rng.choice((1, 2))
+            states = ",".join(rng.choice("01") for _ in range(16))
+            parts.append(encode_line(f"channel_{channel}_states:{states}"))
+        elif kind < 0.8:
+            parts.append(encode_line(rng.choice(("Print started.", "Print stopped.", "Output command processed."))))
+        else:
+            parts.append(encode_binary(rng.randrange(1, 8), rng.randbytes(rng.randrange(0, 64))))
+    stream = b"".join(parts)
+    # The PLC ends lines with println, i.e. "\r\n"; binary payloads are left alone
+    return stream if not crlf else b"".join(
+        part.replace(b"\n", b"\r\n") if part[0] != 0x02 else part for part in parts)
+
+
+def decode(stream, chunk_sizes=None, seed=0):
+    frames = []
+    decoder = FrameDecoder(lambda view: frames.append(bytes(view)),
+                           lambda frame_type, view: frames.append((frame_type, bytes(view))))
+    if chunk_sizes is None:
+        decoder.feed(stream)
+    else:
+        rng = random.Random(seed)
+        pos = 0
+        while pos < len(stream):
+            size = rng.randint(*chunk_sizes)
+            decoder.feed(stream[pos:pos + size])
+            pos += size
+    return frames, decoder
+
+
+def replay_rate(stream, chunk_size, rounds):
+    count = 0
+    decoder = FrameDecoder(lambda view: None, lambda frame_type, view: None)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for pos in range(0, len(stream), chunk_size):
+            count += decoder.feed(stream[pos:pos + chunk_size])
+    elapsed = time.perf_counter() - start
+    return count / elapsed, len(stream) * rounds / elapsed / 1e6
+
+
+def fuzz(iterations, seed=0):
+    rng = random.Random(seed)
+    marker = encode_line("MARKER")
+    for i in range(iterations):
+        # Garbage of random length and a newline, then whole frames that must all come through
+        garbage = rng.randbytes(rng.randrange(0, 300)).replace(b"\x02", b"\x03")
+        valid = synthetic_stream(50, seed=i) + marker
+        expected, _ = decode(valid)
+        frames, decoder = decode(garbage + b"\n" + valid, (1, 64), seed=i)
+        assert frames[-len(expected):] == expected, f"decoder did not resynchronise (iteration {i})"
+        # Oversized lines are dropped, not buffered forever
+        decoder.feed(b"x" * (decoder.max_line * 2))
+        assert decoder.pending() <= decoder.max_line + 64
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fuzz and benchmark the K2 framing layer")
+    parser.add_argument("--capture", help="Captured byte stream to replay (default: synthetic)")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--fuzz", type=int, default=200, help="Garbage/resync iterations")
+    args = parser.parse_args()
+
+    if args.capture:
+        with open(args.capture, "rb") as f:
+            stream = f.read()
+    else:
+        stream = synthetic_stream(args.messages)
+    reference, _ = decode(stream)
+    print(f"Stream: {len(stream)} bytes, {len(reference)} frames")
+
+    for chunk_sizes in ((1, 1), (1, 16), (1, 1500), (4096, 65536)):
+        frames, decoder = decode(stream, chunk_sizes, seed=chunk_sizes[1])
+        assert frames == reference, f"chunks {chunk_sizes}: decoded frames differ"
+        assert args.capture or decoder.pending() == 0
+    print("Fragmented and coalesced replays match the one-shot parse")
+
+    fuzz(args.fuzz)
+    print(f"Fuzz: {args.fuzz} garbage/resync iterations passed")
+
+    for chunk_size in (64, 1024, 65536):
+        frames_per_s, mb_per_s = replay_rate(stream, chunk_size, args.rounds)
+        print(f"{chunk_size:6d}-byte reads: {frames_per_s / 1e3:8.1f} k frames/s  {mb_per_s:6.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Per-frame cost of the K2 segmentation methods.
+
+Runs every detector in k2_vision.DETECTORS on its own (with a fresh
+FrameCache, so each pays for its own preprocessing, like the first detector of
+a frame does), the full process_image() path of the selected display modes and
+the same modes through VisionEngine.process (the process pool and shared
+memory the GUI and k2_headless use), at several resolutions. Frames are synthetic (bench_preprocess.synthetic_frame)
+or taken from a recorded print via k2_sources.open_source.
+
+For every input, resolution and stage it reports the latency percentiles and
+the frame rate that stage alone would sustain. --json writes the results in a
+machine-readable form; --baseline compares them against an earlier --json file
+and exits with status 1 if any stage's p50 got slower by more than
+--tolerance, so it can gate changes to the camera tab's hot path.
+
+Usage:
+python bench_vision.py [--resolutions 640x480 1280x720 1920x1200] [--frames 50] [--source recording]
+                       [--modes both] [--workers N] [--json results.json] [--baseline old.json --tolerance 0.2]
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import k2_vision
+from bench_preprocess import DEFAULT_SETTINGS, synthetic_frame
+from k2_sources import open_source
+
+PERCENTILES = (50, 95, 99)
+
+
+def parse_resolution(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def synthetic_frames(width, height, count):
+    return [synthetic_frame(width, height, seed) for seed in range(count)]
+
+
+def recorded_frames(path, count):
+    # Frames are copied out so the source can be closed before timing starts
+    source = open_source(path, fps=0)
+    source.open()
+    source.start()
+    frames = []
+    try:
+        while len(frames) < count:
+            image = source.read()
+            if image is None:
+                break
+            frames.append(np.array(image))
+    finally:
+        source.close()
+    if not frames:
+        raise SystemExit(f"No frames in {path}")
+    return frames
+
+
+def stages(modes, engine=None):
+    # (stage name, function(image, settings)) for every detector and every full-pipeline mode,
+    # single-process and, with an engine, through its process pool
+    result = []
+    for name, detector in k2_vision.DETECTORS.items():
+        result.append((detector.__name__, lambda image, settings, name=name:
+                       k2_vision.run_detector(name, image, settings, k2_vision.FrameCache(image))))
+    for mode in modes:
+        result.append((f"process_image[{mode}]", lambda image, settings, mode=mode:
+                       k2_vision.process_image(image, dict(settings, mode=mode))))
+    if engine is not None:
+        frame_ids = itertools.count(1)
+        for mode in modes:
+            result.append((f"VisionEngine.process[{mode}]", lambda image, settings, mode=mode:
+                           engine.process(next(frame_ids), image, dict(settings, mode=mode))))
+    return result
+
+
+def time_stage(function, frames, settings, iterations, warmup):
+    for i in range(warmup):
+        function(frames[i % len(frames)], settings)
+    samples = np.empty(iterations)
+    for i in range(iterations):
+        image = frames[i % len(frames)]
+        start = time.perf_counter()
+        function(image, settings)
+        samples[i] = (time.perf_counter() - start) * 1000.0
+    return samples
+
+
+def summarize(samples):
+    mean = float(samples.mean())
+    row = {"samples": len(samples), "mean_ms": mean}
+    for p, value in zip(PERCENTILES, np.percentile(samples, PERCENTILES)):
+        row[f"p{p}_ms"] = float(value)
+    row["max_ms"] = float(samples.max())
+    row["fps"] = 1000.0 / mean if mean > 0 else 0.0
+    return row
+
+
+def compare(results, baseline, tolerance):
+    # -> list of (key, old p50, new p50) for stages that got slower than the tolerance allows
+    old = {(row["input"], row["resolution"], row["stage"]): row for row in baseline["results"]}
+    regressions = []
+    for row in results:
+        key = (row["input"], row["resolution"], row["stage"])
+        if key in old and row["p50_ms"] > old[key]["p50_ms"] * (1.0 + tolerance):
+            regressions.append((key, old[key]["p50_ms"], row["p50_ms"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the K2 segmentation methods")
+    parser.add_argument("--resolutions", nargs="+", default=None,
+                        help="WIDTHxHEIGHT (default: 640x480 1280x720 1920x1200, or the recording's own size)")
+    parser.add_argument("--source", help="Recorded print to take frames from (video, image folder or raw recording)")
+    parser.add_argument("--frames", type=int, default=50, help="Timed runs per stage")
+    parser.add_argument("--distinct", type=int, default=8, help="Distinct frames cycled through")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--modes", nargs="*", default=["both"], help="Display modes to time end to end")
+    parser.add_argument("--workers", type=int, help="VisionEngine worker processes (default: cores - 1)")
+    parser.add_argument("--analysis-scale", type=float, default=1.0)
+    parser.add_argument("--threads", type=int, help="cv2.setNumThreads (default: OpenCV's choice)")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--baseline", help="Earlier --json output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p50 slowdown as a fraction")
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        cv2.setNumThreads(args.threads)
+    settings = dict(DEFAULT_SETTINGS, analysis_scale=args.analysis_scale)
+
+    if args.source:
+        base_frames = recorded_frames(args.source, args.distinct)
+        input_name = os.path.basename(os.path.normpath(args.source))
+        height, width = base_frames[0].shape[:2]
+        resolutions = [parse_resolution(r) for r in args.resolutions] if args.resolutions else [(width, height)]
+    else:
+        base_frames = None
+        input_name = "synthetic"
+        resolutions = [parse_resolution(r) for r in args.resolutions or ["640x480", "1280x720", "1920x1200"]]
+
+    engine = k2_vision.VisionEngine(workers=args.workers)
+    results = []
+    print(f"{'input':12s}{'resolution':>11s}  {'stage':32s}{'mean':>8s}{'p50':>8s}{'p95':>8s}{'p99':>8s}{'max':>8s}"
+          f"{'fps':>8s}")
+    try:
+        for width, height in resolutions:
+            if base_frames is None:
+                frames = synthetic_frames(width, height, args.distinct)
+            else:
+                frames = [frame if frame.shape[:2] == (height, width) else
+                          cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA) for frame in base_frames]
+            for stage, function in stages(args.modes, engine):
+                row = summarize(time_stage(function, frames, settings, args.frames, args.warmup))
+                row.update(input=input_name, resolution=f"{width}x{height}", stage=stage)
+                results.append(row)
+                print(f"{input_name[:11]:12s}{row['resolution']:>11s}  {stage:32s}{row['mean_ms']:8.2f}"
+                      f"{row['p50_ms']:8.2f}{row['p95_ms']:8.2f}{row['p99_ms']:8.2f}{row['max_ms']:8.2f}"
+                      f"{row['fps']:8.1f}")
+    finally:
+        engine.close()
+
+    report = {
+        "meta": {
+            "time": time.time(),
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "cv2_threads": cv2.getNumThreads(),
+            "workers": engine.workers,
+            "frames": args.frames,
+            "settings": settings,
+        },
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {len(results)} results to {args.json}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for (input_name, resolution, stage), old, new in regressions:
+            print(f"REGRESSION {input_name} {resolution} {stage}: p50 {old:.2f} -> {new:.2f} ms "
+                  f"(+{(new / old - 1) * 100:.0f}%)")
+        if regressions:
+            sys.exit(1)
+        print(f"No stage slower than {args.tolerance * 100:.0f}% over the baseline")
+
+
+if __name__ == "__main__":
+    main()
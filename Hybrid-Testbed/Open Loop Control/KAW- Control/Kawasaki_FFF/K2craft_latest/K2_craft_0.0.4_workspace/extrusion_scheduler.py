@@ -0,0 +1,262 @@
+"""
+Toolpath-synchronized extrusion setpoints.
+
+Extrusion is otherwise set by hand (toggle_extrusion, the speed slider), so
+the flow lags every feed change of the .pg program. build_profile() derives
+a time-indexed flow profile from the indexed program instead:
+
+- the run time of every segment comes from as_estimate (trapezoidal
+  profiles at each SPEED, corner speeds from ACCURACY)
+- a printing segment extrudes length x line width x layer height; rapids
+  extrude nothing. The first layer can have its own height and line width,
+  like the Quality tab's settings
+- the cumulative volume is sampled every `resolution` seconds, so each step's
+  rate is the volume actually laid down in it, and steps whose rate stays
+  within `deadband` of the previous one are merged (again volume-preserving)
+
+ExtrusionScheduler then replays the profile against the clock once the robot
+starts. Every setpoint is sent latency_ms early, to cover the command
+scheduler's batching window and the extruder's response, so the flow
+changes when the robot does. Rates are converted to the controller's
+setpoint with `scale`: 60 / (mm^3 per screw revolution) for RPM.
+
+On its own the replay is time-based: the clock starts when the printer is
+started and nothing checks it against the robot, so model errors add up
+over the print. sync(layer) re-anchors the clock when the actual start of a
+layer is known; layer_started() does so for a layer-start signal, one pulse
+per layer from the first one on (in the GUI: a robot output pulsed at every
+layer start and wired to a controller input, which arrives as an IO update).
+
+Usage:
+python extrusion_scheduler.py part.pg --line-width 6 --mm3-per-rev 1200 [--layer-height 2]
+                              [--first-layer-height 1.5] [--first-layer-line-width 8] [--csv profile.csv]
+"""
+import argparse
+import threading
+import time
+
+import numpy as np
+
+import as_estimate
+import as_program
+
+DEFAULT_RESOLUTION = 0.1      # s, step of the profile
+DEFAULT_DEADBAND = 0.02       # relative rate change below which steps are merged
+DEFAULT_LATENCY_MS = 150      # lead of every setpoint over the motion it belongs to
+
+PROFILE_DTYPE = np.dtype([("time", "<f8"), ("rate", "<f8"), ("layer", "<i4")])
+
+
+def build_profile(table, line_width, layer_height=None, first_layer_height=None, first_layer_line_width=None,
+                  accel=as_estimate.DEFAULT_ACCEL, accuracy=None, resolution=DEFAULT_RESOLUTION,
+                  deadband=DEFAULT_DEADBAND):
+    # -> PROFILE_DTYPE array: from each row's time (s after the program starts) the flow is rate (mm^3/s).
+    # The last row is the end of the program, with rate 0.
+    heights = as_estimate.layer_heights(table, layer_height, first_layer_height)
+    widths = np.full(table.layer_count, float(line_width))
+    if first_layer_line_width and len(widths):
+        widths[0] = first_layer_line_width
+    area = heights * widths
+
+    end_times, volumes, layers = [], [], []
+    elapsed = 0.0
+    for rows, length, times, layer, printing in as_estimate.iter_segments(table, accel, accuracy):
+        end_times.append(elapsed + np.cumsum(times))
+        elapsed = end_times[-1][-1]
+        volumes.append(np.where(printing, length * area[layer], 0.0))
+        layers.append(layer)
+    if not end_times or elapsed <= 0.0:
+        # Nothing to replay: no segments, or only zero-length ones (a single-move program)
+        return np.zeros(1, dtype=PROFILE_DTYPE)
+    end_times = np.concatenate(end_times)
+    cumulative = np.concatenate(([0.0], np.cumsum(np.concatenate(volumes))))
+    layers = np.concatenate(layers)
+
+    # Volume laid down in every step of the grid
+    grid = np.arange(0.0, elapsed + resolution, resolution)
+    grid[-1] = elapsed
+    volume = np.interp(grid, np.concatenate(([0.0], end_times)), cumulative)
+    step_rates = np.diff(volume) / np.maximum(np.diff(grid), 1e-9)
+    step_layers = layers[np.minimum(np.searchsorted(end_times, grid[:-1], side="right"), len(layers) - 1)]
+
+    # A new setpoint where the rate moves by more than the deadband, starts/stops, or the layer changes
+    previous = step_rates[:-1]
+    change = np.abs(step_rates[1:] - previous) > deadband * np.maximum(previous, 1e-9)
+    change |= (step_rates[1:] > 0) != (previous > 0)
+    change |= step_layers[1:] != step_layers[:-1]
+    starts = np.concatenate(([0], np.flatnonzero(change) + 1))
+    stops = np.concatenate((starts[1:], [len(step_rates)]))
+
+    profile = np.zeros(len(starts) + 1, dtype=PROFILE_DTYPE)
+    profile["time"][:-1] = grid[starts]
+    profile["time"][-1] = elapsed
+    profile["rate"][:-1] = (volume[stops] - volume[starts]) / np.maximum(grid[stops] - grid[starts], 1e-9)
+    profile["layer"][:-1] = step_layers[starts]
+    profile["layer"][-1] = step_layers[-1] if len(step_layers) else 0
+    return profile
+
+
+class ExtrusionScheduler:
+    # Sends set_variable(variable, rate * scale) for every profile step, latency_ms
+    # before the step begins. after(delay_ms, callback) schedules the next send
+    # (root.after in the GUI, a threading.Timer otherwise); stale callbacks left
+    # over from a stop or pause are ignored.
+    def __init__(self, profile, set_variable, after=None, latency_ms=DEFAULT_LATENCY_MS, variable="extrudeFlowrate",
+                 scale=1.0, clock=time.monotonic):
+        self.profile = profile
+        self.set_variable = set_variable
+        self.after = after or self._timer_after
+        self.latency = latency_ms / 1000.0
+        self.variable = variable
+        self.scale = scale
+        self.clock = clock
+        self.started_at = None
+        self.paused_at = None
+        self.index = -1
+        self.generation = 0
+        self.setpoints = 0
+        self.layers_signalled = 0
+        self.synced_layer = None
+
+    @staticmethod
+    def _timer_after(delay_ms, callback):
+        timer = threading.Timer(delay_ms / 1000.0, callback)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    @property
+    def running(self):
+        return self.started_at is not None
+
+    @property
+    def paused(self):
+        return self.paused_at is not None
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.paused_at if self.paused_at is not None else self.clock()) - self.started_at
+
+    def start(self, at=None):
+        # at: clock time the motion started, when the scheduler is started after the fact
+        self.started_at = self.clock() if at is None else at
+        self.paused_at = None
+        self.index = -1
+        self.layers_signalled = 0
+        self.synced_layer = None
+        self._reschedule(0)
+
+    def pause(self):
+        if self.running and not self.paused:
+            self.paused_at = self.clock()
+            self.generation += 1
+            self._send(0.0)
+            self.index = -1
+
+    def resume(self):
+        if self.paused:
+            self.started_at += self.clock() - self.paused_at
+            self.paused_at = None
+            self._reschedule(0)
+
+    def stop(self):
+        if self.running:
+            self.generation += 1
+            self.started_at = None
+            self.paused_at = None
+            self.index = -1
+            self._send(0.0)
+
+    def sync(self, layer):
+        # The robot has just started layer: move the clock to that layer's first step
+        steps = np.flatnonzero(self.profile["layer"][:-1] >= layer)
+        if self.running and len(steps):
+            self.started_at = (self.paused_at or self.clock()) - self.profile["time"][steps[0]]
+            self.synced_layer = layer
+            if not self.paused:
+                self._reschedule(0)
+
+    def layer_started(self):
+        # One pulse of the layer-start signal: the layer after the last one signalled has begun
+        self.layers_signalled += 1
+        self.sync(self.layers_signalled - 1)
+
+    def _reschedule(self, delay_ms):
+        self.generation += 1
+        generation = self.generation
+        self.after(max(0, int(delay_ms)), lambda: self._tick(generation))
+
+    def _tick(self, generation):
+        if generation != self.generation or not self.running or self.paused:
+            return
+        times = self.profile["time"]
+        ahead = self.elapsed + self.latency
+        index = max(0, int(np.searchsorted(times, ahead, side="right")) - 1)
+        if index >= len(times) - 1:
+            # Past the end of the program
+            self._send(0.0)
+            self.started_at = None
+            self.index = -1
+            return
+        if index != self.index:
+            self.index = index
+            self._send(self.profile["rate"][index])
+        self._reschedule((times[index + 1] - ahead) * 1000.0 + 1)
+
+    def _send(self, rate):
+        self.setpoints += 1
+        self.set_variable(self.variable, round(float(rate) * self.scale, 2))
+
+    def status(self):
+        index = max(self.index, 0)
+        return {
+            "running": self.running,
+            "paused": self.paused,
+            "elapsed_s": self.elapsed,
+            "total_s": float(self.profile["time"][-1]),
+            "layer": int(self.profile["layer"][index]),
+            "rate": float(self.profile["rate"][index]) if self.index >= 0 else 0.0,
+            "setpoint": round(float(self.profile["rate"][index]) * self.scale, 2) if self.index >= 0 else 0.0,
+            "setpoints": self.setpoints,
+            "synced_layer": self.synced_layer,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the extrusion profile of an AS program")
+    parser.add_argument("program", help=".pg file")
+    parser.add_argument("--line-width", type=float, required=True, help="Bead width (mm)")
+    parser.add_argument("--layer-height", type=float, help="Layer height (mm, default: each layer's Z step)")
+    parser.add_argument("--first-layer-height", type=float)
+    parser.add_argument("--first-layer-line-width", type=float)
+    parser.add_argument("--mm3-per-rev", type=float, help="Extruder displacement, to report setpoints in RPM")
+    parser.add_argument("--accel", type=float, default=as_estimate.DEFAULT_ACCEL, help="Path acceleration (mm/s^2)")
+    parser.add_argument("--resolution", type=float, default=DEFAULT_RESOLUTION, help="Profile step (s)")
+    parser.add_argument("--deadband", type=float, default=DEFAULT_DEADBAND, help="Relative change that is sent")
+    parser.add_argument("--csv", help="Write the profile to this file")
+    args = parser.parse_args()
+
+    table = as_program.open_program(args.program)
+    started = time.perf_counter()
+    profile = build_profile(table, args.line_width, args.layer_height, args.first_layer_height,
+                            args.first_layer_line_width, args.accel, resolution=args.resolution,
+                            deadband=args.deadband)
+    elapsed = time.perf_counter() - started
+    durations = np.diff(profile["time"])
+    volume = float((profile["rate"][:-1] * durations).sum())
+    print(f"{table.program}: {len(profile) - 1} setpoints over {as_estimate.format_duration(profile['time'][-1])} "
+          f"(built in {elapsed:.2f} s)")
+    print(f"  volume {volume / 1000:.1f} cm^3, peak {profile['rate'].max():.1f} mm^3/s, "
+          f"shortest step {durations.min() if len(durations) else 0:.2f} s")
+    if args.mm3_per_rev:
+        print(f"  peak {profile['rate'].max() * 60 / args.mm3_per_rev:.1f} RPM at {args.mm3_per_rev} mm^3/rev")
+    if args.csv:
+        np.savetxt(args.csv, profile, delimiter=",", header="time_s,rate_mm3_s,layer", comments="",
+                   fmt=["%.3f", "%.3f", "%d"])
+        print(f"Wrote {len(profile)} rows to {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
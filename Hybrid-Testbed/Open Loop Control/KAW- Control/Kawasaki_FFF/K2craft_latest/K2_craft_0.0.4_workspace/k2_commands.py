@@ -0,0 +1,259 @@
+"""
+Outbound command scheduling for the K2 controller link.
+
+Slider-driven setpoints (extruder RPM, temperature, ...) fire on every Tk
+motion event. CommandScheduler keeps only the latest value per variable
+within a short window and sends all pending variables as one batch of
+"name:value" lines in a single write. One-off commands (start_print,
+SET_OUTPUT, ...) go out immediately, after any pending setpoints, so the
+controller always sees them in the order they were issued.
+
+AckTracker sits between the scheduler and the socket: it gives every
+command line a sequence id, matches the controller's acknowledgements,
+retries lost commands and keeps per-command latency histograms.
+"""
+import bisect
+import math
+import os
+import threading
+import time
+
+
+class CommandScheduler:
+    # send(text) performs one write. after(delay_ms, callback) schedules the
+    # batch flush; pass root.after to flush on the Tk thread, otherwise a
+    # threading.Timer is used.
+    def __init__(self, send, window_ms=50, after=None):
+        self.send = send
+        self.window_ms = window_ms
+        self.after = after or self._timer_after
+        self.pending = {}
+        self.flush_scheduled = False
+        self.lock = threading.RLock()
+        self.submitted = 0
+        self.coalesced = 0
+        self.sent = 0
+        self.batches = 0
+
+    @staticmethod
+    def _timer_after(delay_ms, callback):
+        timer = threading.Timer(delay_ms / 1000.0, callback)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def set(self, name, value):
+        # Last write wins: an update replaces any value of the same variable still waiting
+        with self.lock:
+            self.submitted += 1
+            if name in self.pending:
+                self.coalesced += 1
+            self.pending[name] = value
+            if not self.flush_scheduled:
+                self.flush_scheduled = True
+                self.after(self.window_ms, self.flush)
+
+    def send_now(self, text):
+        # Sends a command immediately, preceded by anything still pending
+        with self.lock:
+            self.submitted += 1
+            batch = self._take_pending() + text
+            self.sent += 1
+            self.batches += 1
+            self.send(batch)
+
+    def flush(self):
+        with self.lock:
+            self.flush_scheduled = False
+            batch = self._take_pending()
+            if batch:
+                self.batches += 1
+                self.send(batch)
+
+    def _take_pending(self):
+        batch = "".join(f"{name}:{value}\n" for name, value in self.pending.items())
+        self.sent += len(self.pending)
+        self.pending.clear()
+        return batch
+
+    def stats(self):
+        with self.lock:
+            return {
+                "submitted": self.submitted,
+                "sent": self.sent,
+                "coalesced": self.coalesced,
+                "batches": self.batches,
+                "pending": len(self.pending),
+            }
+
+
+class LatencyHistogram:
+    # Log-spaced histogram: bins_per_decade bins per factor of 10 between
+    # min_ms and max_ms, plus an underflow and an overflow bin. Percentiles
+    # are reported as the upper edge of the bin they fall in.
+    def __init__(self, min_ms=0.1, max_ms=10000.0, bins_per_decade=10):
+        decades = math.log10(max_ms / min_ms)
+        bins = int(round(decades * bins_per_decade))
+        self.edges = [min_ms * 10 ** (i / bins_per_decade) for i in range(bins + 1)]
+        self.counts = [0] * (bins + 2)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, latency_ms):
+        self.counts[bisect.bisect_right(self.edges, latency_ms)] += 1
+        self.count += 1
+        self.total += latency_ms
+        self.max = max(self.max, latency_ms)
+
+    def percentile(self, p):
+        if self.count == 0:
+            return 0.0
+        target = p / 100.0 * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return min(self.edges[i], self.max) if i < len(self.edges) else self.max
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class AckTracker:
+    # Tags every outbound command line with a sequence id ("@<seq> <command>")
+    # and waits for the controller's "ACK:<seq>". Commands not acknowledged
+    # within timeout_ms are resent with the same id (the controller re-acks
+    # duplicates without applying them again) up to retries times, then
+    # counted as failed. Round-trip latency is recorded per command name,
+    # from the first transmission, so a retried command shows its full delay.
+    # send(text) returns False when the text could not be written (no
+    # connection); those commands are dropped at once and counted as unsent
+    # instead of being retried into a timeout.
+    def __init__(self, send, timeout_ms=500, retries=2, log_path=None):
+        self.send_raw = send
+        self.timeout_ms = timeout_ms
+        self.retries = retries
+        self.next_seq = 1
+        self.pending = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.acked = 0
+        self.retried = 0
+        self.failed = 0
+        self.unsent = 0
+        self.unexpected = 0
+        self.log = None
+        if log_path is not None:
+            os.makedirs(os.path.dirname(log_path), exist_ok=True)
+            self.log = open(log_path, "a", buffering=1)
+            self.log.write("wall_time,seq,command,result,latency_ms,attempts\n")
+
+    @staticmethod
+    def command_name(line):
+        # "eMotorRPM:12.0" -> "eMotorRPM", "command:start_print" -> "command:start_print"
+        name, _, value = line.partition(":")
+        if name == "command":
+            return f"{name}:{value.strip()}"
+        return name
+
+    def send(self, text):
+        now = time.monotonic()
+        tagged = []
+        seqs = []
+        with self.lock:
+            for line in text.split("\n"):
+                if not line.strip():
+                    continue
+                seq = self.next_seq
+                self.next_seq += 1
+                self.pending[seq] = [line, now, now, 1]
+                tagged.append(f"@{seq} {line}\n")
+                seqs.append(seq)
+        if tagged and not self.send_raw("".join(tagged)):
+            self._drop_unsent(seqs)
+
+    def ack(self, seq):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.pending.pop(seq, None)
+            if entry is None:
+                # Late ack for a command that already timed out, or a duplicate
+                self.unexpected += 1
+                return None
+            line, first_sent, last_sent, attempts = entry
+            # An ack that arrives just after a resend usually answers the first transmission
+            latency_ms = (now - first_sent) * 1000.0
+            name = self.command_name(line)
+            if name not in self.histograms:
+                self.histograms[name] = LatencyHistogram()
+            self.histograms[name].record(latency_ms)
+            self.acked += 1
+        self._log(seq, name, "ack", latency_ms, attempts)
+        return latency_ms
+
+    def poll(self):
+        # Call periodically: resends timed-out commands and gives up on exhausted ones
+        now = time.monotonic()
+        resend = []
+        with self.lock:
+            for seq, entry in list(self.pending.items()):
+                line, first_sent, last_sent, attempts = entry
+                if (now - last_sent) * 1000.0 < self.timeout_ms:
+                    continue
+                if attempts > self.retries:
+                    del self.pending[seq]
+                    self.failed += 1
+                    print(f"No acknowledgement for '{line}' after {attempts} attempts")
+                    self._log(seq, self.command_name(line), "timeout", (now - first_sent) * 1000.0, attempts)
+                    continue
+                entry[2] = now
+                entry[3] += 1
+                self.retried += 1
+                resend.append((seq, f"@{seq} {line}\n"))
+        if resend and not self.send_raw("".join(text for _, text in resend)):
+            self._drop_unsent([seq for seq, _ in resend])
+
+    def _drop_unsent(self, seqs):
+        # The transport refused the write: nothing is on its way, so there is nothing to wait for
+        with self.lock:
+            for seq in seqs:
+                entry = self.pending.pop(seq, None)
+                if entry is not None:
+                    self.unsent += 1
+                    self._log(seq, self.command_name(entry[0]), "unsent", 0.0, entry[3])
+
+    def reset(self):
+        # Connection lost: outstanding commands will never be acknowledged
+        with self.lock:
+            self.failed += len(self.pending)
+            self.pending.clear()
+
+    def _log(self, seq, name, result, latency_ms, attempts):
+        if self.log is not None:
+            self.log.write(f"{time.time():.3f},{seq},{name},{result},{latency_ms:.2f},{attempts}\n")
+
+    def summary(self):
+        # Rows of (command, count, mean, p50, p95, p99, max) in ms
+        with self.lock:
+            return [(name, h.count, h.mean(), h.percentile(50), h.percentile(95), h.percentile(99), h.max)
+                    for name, h in sorted(self.histograms.items())]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "acked": self.acked,
+                "pending": len(self.pending),
+                "retried": self.retried,
+                "failed": self.failed,
+                "unsent": self.unsent,
+                "unexpected": self.unexpected,
+            }
+
+    def close(self):
+        if self.log is not None:
+            for row in self.summary():
+                self.log.write("# {} n={} mean={:.2f} p50={:.2f} p95={:.2f} p99={:.2f} max={:.2f}\n".format(*row))
+            self.log.close()
+            self.log = None
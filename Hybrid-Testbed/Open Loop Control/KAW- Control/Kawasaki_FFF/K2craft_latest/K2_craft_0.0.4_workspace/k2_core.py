@@ -0,0 +1,323 @@
+"""
+Display-independent core of the K2 FFF control application.
+
+K2Core owns the controller link (dispatcher, command scheduler, ack tracker),
+the IO state, the camera/vision threads and the telemetry store. It has no
+Tk dependency: K2_craft attaches its GUI to it, and k2_headless.py runs it on
+a cell computer with no display.
+
+It is wired to three interchangeable pieces:
+- transport: start(), stop(), send(bytes) -> bool, connected, and events, a
+  queue.Queue of (kind, addr, payload) tuples (k2_server.ControllerServer)
+- source: a k2_sources.FrameSource, or None to run without a camera
+- vision: process(frame_id, image, settings) -> object with .image and
+  .counts, plus slots, new_session() and close() (k2_vision.VisionEngine)
+
+The front end calls poll() periodically from its own thread; the callbacks
+on_connection(connected), on_input(channel, pin, state) and on_text(line)
+run inside poll(). Vision results are picked up with take_result() and
+handed back with release_result() once displayed.
+"""
+import os
+import queue
+import threading
+import time
+import types
+
+import cv2
+
+from k2_commands import AckTracker, CommandScheduler, LatencyHistogram
+from k2_frames import AcquisitionThread, BufferPool, FrameRing, LatestResult, VisionWorker
+from k2_protocol import IO_STATE, MessageDispatcher, bits_to_mask, changed_pins, parse_bits, unpack_io_state
+from k2_telemetry import TelemetryStore
+from k2_timing import StageTimer
+
+# Setpoints that may be coalesced (last value wins) when they change faster than the controller needs them
+COALESCED_VARIABLES = {"eMotorRPM", "extrudeFlowrate", "temperature", "layer_height"}
+COMMAND_WINDOW_MS = 50
+# Commands not acknowledged within ACK_TIMEOUT_MS are resent up to ACK_RETRIES times
+ACK_TIMEOUT_MS = 500
+ACK_RETRIES = 2
+
+DEFAULT_VISION_SETTINGS = {
+    "mode": "both",
+    "edge_low": 100,
+    "edge_high": 200,
+    "lower_hsv": (0, 120, 70),
+    "upper_hsv": (180, 255, 255),
+    "roi": None,
+    "analysis_scale": 1.0,
+    "display": False,
+}
+
+
+def default_telemetry_dir():
+    return os.path.join(os.path.expanduser("~"), "K2_telemetry", time.strftime("%Y%m%d_%H%M%S"))
+
+
+class K2Core:
+    # after(delay_ms, callback) schedules the scheduler's batch flushes on the
+    # front end's thread (root.after in the GUI). display_size=(width, height)
+    # makes process_frame resize every result into a pooled display buffer
+    # while settings["display"] is set.
+    def __init__(self, transport, source=None, vision=None, telemetry_dir=None, after=None, display_size=None):
+        self.transport = transport
+        self.source = source
+        self.vision = vision
+        self.display_size = display_size
+
+        # Per-frame vision metrics, spilled to disk in chunks during long prints
+        self.telemetry = TelemetryStore(telemetry_dir or default_telemetry_dir())
+
+        # All outbound commands go through the scheduler (setpoints are batched every COMMAND_WINDOW_MS),
+        # then get a sequence id so the controller's acknowledgements can be matched and timed
+        self.acks = AckTracker(self.send, ACK_TIMEOUT_MS, ACK_RETRIES,
+                               log_path=os.path.join(self.telemetry.directory, "command_latency.csv"))
+        self.commands = CommandScheduler(self.acks.send, COMMAND_WINDOW_MS, after=after)
+
+        # Complete messages from every controller connection are routed here
+        self.dispatcher = MessageDispatcher()
+        self.dispatcher.on("channel_1_states", lambda states: self.update_channel_states(1, states), parse_bits)
+        self.dispatcher.on("channel_2_states", lambda states: self.update_channel_states(2, states), parse_bits)
+        self.dispatcher.on("ACK", self.acks.ack, int)
+        self.dispatcher.on_binary(IO_STATE, self.handle_io_state)
+        self.dispatcher.on_text(lambda line: self.on_text(line))
+
+        # Front-end callbacks
+        self.on_connection = lambda connected: None
+        self.on_input = lambda channel, pin, state: None
+        self.on_text = lambda line: print(f"Received data: {line.strip()}")
+
+        # IO state
+        self.input_masks = {1: None, 2: None}  # Last known input bitmask per channel
+        self.io_seq = None
+        self.io_seq_gaps = 0
+        self.io_updates = 0
+
+        # Vision; vision_settings is replaced as a whole by the front end, never mutated in place
+        self.vision_settings = dict(DEFAULT_VISION_SETTINGS)
+        self.frame_ring = None
+        self.display_buffers = None
+        self.vision_results = None
+        self.acquisition_thread = None
+        self.vision_threads = []
+        self.vision_latency = LatencyHistogram()
+        self.stats_lock = threading.Lock()
+
+        # Per-stage pipeline timing; disabled (and nearly free) until a front end switches it on
+        self.timer = StageTimer()
+        self.timer.open_log(os.path.join(self.telemetry.directory, "stage_timing.csv"))
+        if source is not None:
+            source.timer = self.timer
+
+    # --- lifecycle ---
+
+    def start(self):
+        self.transport.start()
+
+    def close(self):
+        self.close_camera()
+        if self.vision is not None:
+            self.vision.close()
+            self.vision = None
+        self.telemetry.close()
+        self.acks.close()
+        self.timer.close()
+        self.transport.stop()
+
+    # --- controller link ---
+
+    @property
+    def connected(self):
+        return self.transport.connected
+
+    def poll(self, max_events=200, timeout=0.0):
+        # Hands messages from the transport thread to the dispatcher. With a timeout,
+        # blocks up to that long for the first event. Returns the number of events handled.
+        handled = 0
+        for _ in range(max_events):
+            try:
+                if handled == 0 and timeout > 0:
+                    kind, addr, payload = self.transport.events.get(timeout=timeout)
+                else:
+                    kind, addr, payload = self.transport.events.get_nowait()
+            except queue.Empty:
+                break
+            handled += 1
+            if kind == "line":
+                self.dispatcher.dispatch_line(payload)
+            elif kind == "binary":
+                self.dispatcher.dispatch_binary(*payload)
+            elif kind in ("connected", "disconnected"):
+                if not self.connected:
+                    self.acks.reset()
+                if kind == "connected":
+                    # The PLC only pushes IO changes, so ask for the full state once
+                    self.input_masks = {1: None, 2: None}
+                    self.request_io_update()
+                self.on_connection(self.connected)
+        self.acks.poll()
+        return handled
+
+    def send(self, message):
+        # -> whether the transport took the message; the ack tracker drops commands it refused
+        if self.transport.send(message.encode()):
+            print(f"Sent data: {message!r}")
+            return True
+        print("Cannot send data. No active connection.")
+        return False
+
+    def set_variable(self, name, value):
+        if not self.connected:
+            print("Cannot send data. No active connection.")
+            return False
+        if name in COALESCED_VARIABLES:
+            self.commands.set(name, value)
+        else:
+            self.commands.send_now(f"{name}:{value}\n")
+        return True
+
+    def set_output(self, channel, pin, state):
+        command = f"SET_OUTPUT:{channel}:{pin}:{1 if state else 0}"
+        self.commands.send_now(command + "\n")
+        return command
+
+    def request_io_update(self):
+        if self.connected:
+            self.commands.send_now("REQUEST_IO_UPDATE\n")
+
+    def update_channel_states(self, channel, states):
+        # Legacy ASCII IO report
+        self.apply_input_mask(channel, bits_to_mask(states[:16]))
+
+    def handle_io_state(self, payload):
+        seq, timestamp_ms, masks = unpack_io_state(payload)
+        if self.io_seq is not None and seq != (self.io_seq + 1) & 0xFFFFFFFF:
+            self.io_seq_gaps += 1
+        self.io_seq = seq
+        self.io_updates += 1
+        for channel, mask in enumerate(masks, start=1):
+            self.apply_input_mask(channel, mask)
+
+    def apply_input_mask(self, channel, mask):
+        # Only pins that toggled are reported
+        for pin, state in changed_pins(self.input_masks.get(channel), mask):
+            self.on_input(channel, pin, state)
+        self.input_masks[channel] = mask
+
+    # --- camera and vision ---
+
+    @property
+    def capturing(self):
+        return self.source is not None and self.source.grabbing
+
+    def open_camera(self):
+        self.close_camera()
+        if self.source is None:
+            return
+        self.source.open()
+        self.start_vision_threads()
+
+    def start_capture(self):
+        if self.source is not None and not self.source.grabbing:
+            self.frame_ring.clear()
+            self.source.start()
+
+    def stop_capture(self):
+        if self.source is not None and self.source.grabbing:
+            self.source.stop()
+
+    def close_camera(self):
+        self.stop_vision_threads()
+        if self.source is not None:
+            self.source.close()
+
+    def start_vision_threads(self):
+        # Camera grabs and vision both run off the front end's thread; it only picks up finished results.
+        # The detectors of a display mode run in parallel in the engine's process pool, and one worker
+        # thread per engine slot keeps consecutive frames in flight.
+        # Recordings are replayed without dropping frames; a live camera drops the oldest when vision falls behind
+        self.frame_ring = FrameRing(capacity=self.vision.slots, lossless=getattr(self.source, "lossless", False))
+        # The new ring numbers its frames from 1 again
+        self.vision.new_session()
+        if self.display_size is not None:
+            # Display frames are resized into pooled buffers; results never shown hand theirs back
+            width, height = self.display_size
+            self.display_buffers = BufferPool((height, width, 3), count=self.vision.slots + 2)
+        self.vision_results = LatestResult(on_discard=self.release_result)
+        self.acquisition_thread = AcquisitionThread(self.source.read, self.frame_ring)
+        self.vision_threads = [VisionWorker(self.frame_ring, self.process_frame, self.vision_results)
+                               for _ in range(self.vision.slots)]
+        self.acquisition_thread.start()
+        for thread in self.vision_threads:
+            thread.start()
+
+    def stop_vision_threads(self):
+        if self.acquisition_thread is not None:
+            self.acquisition_thread.stop()
+            self.acquisition_thread = None
+        for thread in self.vision_threads:
+            thread.stop()
+        self.vision_threads = []
+
+    def process_frame(self, frame):
+        # Runs on a vision worker thread
+        settings = self.vision_settings
+        t = self.timer.lap("queue", frame.timestamp)
+        result = self.vision.process(frame.frame_id, frame.image, settings)
+        t = self.timer.lap("detect", t)
+        display_image = None
+        if settings.get("display", True) and self.display_buffers is not None:
+            # Skip the resize entirely while nothing is shown; counts and telemetry still update
+            display_image = self.display_buffers.acquire()
+            if display_image is not None:
+                cv2.resize(result.image, self.display_size, dst=display_image, interpolation=cv2.INTER_AREA)
+                self.timer.lap("resize", t)
+        line_count, blob_count = result.counts.get("lines"), result.counts.get("blobs")
+        latency_ms = (time.monotonic() - frame.timestamp) * 1000.0
+        self.telemetry.append(time.time(), settings["mode"], line_count, blob_count, latency_ms)
+        with self.stats_lock:
+            self.vision_latency.record(latency_ms)
+        return types.SimpleNamespace(frame_id=frame.frame_id, timestamp=frame.timestamp, image=display_image,
+                                     line_count=line_count, blob_count=blob_count)
+
+    def take_result(self):
+        return self.vision_results.take() if self.vision_results is not None else None
+
+    def release_result(self, result):
+        if result.image is not None:
+            self.display_buffers.release(result.image)
+            result.image = None
+
+    # --- telemetry ---
+
+    def stats(self):
+        # Snapshot of the link, IO and vision counters; plain types so it can be dumped as JSON
+        with self.stats_lock:
+            latency = self.vision_latency
+            vision = {
+                "frames": latency.count,
+                "latency_ms": {"mean": latency.mean(), "p50": latency.percentile(50),
+                               "p95": latency.percentile(95), "p99": latency.percentile(99), "max": latency.max},
+            }
+        if self.acquisition_thread is not None:
+            vision["grabbed"] = self.acquisition_thread.grabbed
+            vision["dropped"] = self.frame_ring.dropped
+        vision["errors"] = sum(thread.errors for thread in self.vision_threads)
+        if self.vision_results is not None:
+            vision["skipped"] = self.vision_results.skipped
+        stages = {}
+        if self.timer.enabled:
+            for stage, count, mean, p50, p95, p99, worst in self.timer.summary():
+                stages[stage] = {"samples": count, "mean": mean, "p50": p50, "p95": p95, "p99": p99, "max": worst}
+        return {
+            "time": time.time(),
+            "connected": self.connected,
+            "commands": self.commands.stats(),
+            "acks": self.acks.stats(),
+            "io": {"updates": self.io_updates, "seq": self.io_seq, "seq_gaps": self.io_seq_gaps,
+                   "inputs": [self.input_masks[1], self.input_masks[2]]},
+            "vision": vision,
+            "stages": stages,
+            "telemetry_rows": len(self.telemetry),
+        }
@@ -0,0 +1,191 @@
+"""
+Frame acquisition and vision worker threads for the K2 camera tab.
+
+The camera is drained on its own thread into a small drop-oldest ring, a
+worker thread runs the vision pipeline on those frames, and the Tk thread
+only picks up the most recent finished result.
+"""
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+class Frame:
+    def __init__(self, frame_id, timestamp, image):
+        self.frame_id = frame_id
+        self.timestamp = timestamp
+        self.image = image
+
+
+class FrameRing:
+    # Bounded FIFO of frames. When full, the oldest frame is dropped so the
+    # acquisition thread never blocks on a slow consumer. With lossless=True
+    # (replaying a recording) put() waits for room instead, so every frame is
+    # processed.
+    def __init__(self, capacity=2, lossless=False):
+        self.frames = deque(maxlen=capacity)
+        self.condition = threading.Condition()
+        self.lossless = lossless
+        self.next_id = 0
+        self.dropped = 0
+
+    def put(self, image, timestamp=None):
+        with self.condition:
+            while self.lossless and len(self.frames) == self.frames.maxlen:
+                self.condition.wait(0.1)
+            if len(self.frames) == self.frames.maxlen:
+                self.dropped += 1
+            self.next_id += 1
+            frame = Frame(self.next_id, time.monotonic() if timestamp is None else timestamp, image)
+            self.frames.append(frame)
+            self.condition.notify()
+            return frame
+
+    def get(self, timeout=None):
+        with self.condition:
+            if not self.frames:
+                self.condition.wait(timeout)
+            if self.frames:
+                frame = self.frames.popleft()
+                self.condition.notify_all()
+                return frame
+            return None
+
+    def clear(self):
+        with self.condition:
+            self.frames.clear()
+
+    def __len__(self):
+        with self.condition:
+            return len(self.frames)
+
+
+class BufferPool:
+    # Fixed set of preallocated image buffers handed out to the vision workers
+    # and given back once the Tk thread has copied them to the display. When
+    # every buffer is in flight, acquire() returns None and the caller skips
+    # the display update for that frame instead of allocating.
+    def __init__(self, shape, count=4, dtype=np.uint8):
+        self.shape = tuple(shape)
+        self.free = deque(np.empty(self.shape, dtype=dtype) for _ in range(count))
+        self.lock = threading.Lock()
+        self.exhausted = 0
+
+    def acquire(self):
+        with self.lock:
+            if not self.free:
+                self.exhausted += 1
+                return None
+            return self.free.popleft()
+
+    def release(self, buffer):
+        if buffer is None:
+            return
+        with self.lock:
+            self.free.append(buffer)
+
+
+class LatestResult:
+    # Single-slot mailbox holding the newest finished result. Older results
+    # that were never picked up are simply overwritten, and results for a
+    # frame older than the one already published (possible with several
+    # workers) are discarded.
+    # on_discard(result) is called for every result that is never taken.
+    def __init__(self, on_discard=None):
+        self.lock = threading.Lock()
+        self.result = None
+        self.fresh = False
+        self.published = 0
+        self.skipped = 0
+        self.on_discard = on_discard
+
+    def publish(self, result):
+        with self.lock:
+            if self.result is not None and getattr(result, "frame_id", 0) < getattr(self.result, "frame_id", 0):
+                self.skipped += 1
+                discarded = result
+            else:
+                discarded = self.result if self.fresh else None
+                if self.fresh:
+                    self.skipped += 1
+                self.result = result
+                self.fresh = True
+                self.published += 1
+        if discarded is not None and self.on_discard is not None:
+            self.on_discard(discarded)
+
+    def take(self):
+        # Returns the newest result once, then None until a new one arrives
+        with self.lock:
+            if not self.fresh:
+                return None
+            self.fresh = False
+            return self.result
+
+
+class AcquisitionThread(threading.Thread):
+    # Calls grab_frame() in a loop and pushes every image it returns into the
+    # ring. grab_frame() should return None on timeout or a failed grab.
+    def __init__(self, grab_frame, ring, idle_wait=0.05):
+        super().__init__(name="k2-acquisition", daemon=True)
+        self.grab_frame = grab_frame
+        self.ring = ring
+        self.idle_wait = idle_wait
+        self.stop_event = threading.Event()
+        self.grabbed = 0
+        self.errors = 0
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                image = self.grab_frame()
+            except Exception as e:
+                self.errors += 1
+                print(f"Error during frame acquisition: {e}")
+                image = None
+            if image is None:
+                self.stop_event.wait(self.idle_wait)
+                continue
+            self.ring.put(image)
+            self.grabbed += 1
+
+    def stop(self, timeout=1.0):
+        self.stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+
+
+class VisionWorker(threading.Thread):
+    # Pulls frames from the ring, runs process(frame) and publishes whatever
+    # it returns to the result mailbox.
+    def __init__(self, ring, process, results, poll_interval=0.1):
+        super().__init__(name="k2-vision", daemon=True)
+        self.ring = ring
+        self.process = process
+        self.results = results
+        self.poll_interval = poll_interval
+        self.stop_event = threading.Event()
+        self.processed = 0
+        self.errors = 0
+
+    def run(self):
+        while not self.stop_event.is_set():
+            frame = self.ring.get(timeout=self.poll_interval)
+            if frame is None:
+                continue
+            try:
+                result = self.process(frame)
+            except Exception as e:
+                self.errors += 1
+                print(f"Error processing frame {frame.frame_id}: {e}")
+                continue
+            if result is not None:
+                self.results.publish(result)
+                self.processed += 1
+
+    def stop(self, timeout=1.0):
+        self.stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
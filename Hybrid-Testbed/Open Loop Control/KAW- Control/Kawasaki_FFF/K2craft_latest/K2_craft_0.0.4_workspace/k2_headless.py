@@ -0,0 +1,124 @@
+"""
+Runs the K2 control core without a display and streams telemetry as JSON lines.
+
+One JSON object per line on stdout:
+- {"event": "connection", "connected": true}
+- {"event": "input", "channel": 1, "pin": 3, "state": true}
+- {"event": "text", "line": "Print started."}
+- {"event": "stats", ...} every --interval seconds (see K2Core.stats); with
+  --timing it includes per-stage latency percentiles
+
+Log messages from the server and the core go to stderr, so stdout can be piped
+straight into a collector. The Tk front end (K2_craft_0.0.4.py) is only needed
+when someone wants to watch the camera or drive the printer by hand.
+
+--source is "pylon", "synthetic", "none" or the path of a recorded print (a
+video file, an image folder or a raw recording made with --record). A
+recording is replayed once at its recorded rate, or at --replay-fps (0 for as
+fast as possible), and the run ends when it has been processed.
+
+Usage:
+python k2_headless.py [--host 192.168.1.1] [--port 10000] [--source pylon|synthetic|none|PATH] [--mode both]
+                      [--replay-fps 0] [--loop] [--record DIR] [--timing] [--interval 1.0] [--duration 60]
+                      [--telemetry-dir DIR]
+"""
+import argparse
+import contextlib
+import json
+import sys
+import time
+
+from k2_core import K2Core
+from k2_server import ControllerServer
+from k2_sources import FrameRecorder, RecordingSource, SyntheticFrameSource, open_source
+from k2_vision import VisionEngine, MODE_DETECTORS
+
+
+def make_source(args):
+    if args.source == "none":
+        return None
+    if args.source == "synthetic":
+        source = SyntheticFrameSource(args.width, args.height, args.fps)
+    else:
+        source = open_source(args.source, args.replay_fps, args.loop)
+    if args.record:
+        source = RecordingSource(source, FrameRecorder(args.record))
+    return source
+
+
+def replay_done(core):
+    # A finished recording whose last frames have been through the vision workers
+    source = getattr(core.source, "source", core.source)
+    if not getattr(source, "finished", False) or len(core.frame_ring):
+        return False
+    return sum(thread.processed + thread.errors for thread in core.vision_threads) >= source.played
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless K2 controller core")
+    parser.add_argument("--host", default="192.168.1.1")
+    parser.add_argument("--port", type=int, default=10000)
+    parser.add_argument("--source", default="pylon", help="pylon, synthetic, none or a recording path")
+    parser.add_argument("--replay-fps", type=float, help="Replay rate (default: as recorded, 0: as fast as possible)")
+    parser.add_argument("--loop", action="store_true", help="Replay the recording in a loop")
+    parser.add_argument("--record", help="Record every frame to this directory as a raw recording")
+    parser.add_argument("--mode", choices=sorted(MODE_DETECTORS), default="both")
+    parser.add_argument("--workers", type=int, help="Vision worker processes (default: CPUs - 1)")
+    parser.add_argument("--width", type=int, default=1280, help="Synthetic frame width")
+    parser.add_argument("--height", type=int, default=720, help="Synthetic frame height")
+    parser.add_argument("--fps", type=float, default=30.0, help="Synthetic frame rate, 0 for as fast as possible")
+    parser.add_argument("--timing", action="store_true",
+                        help="Time every pipeline stage; percentiles go into the stats lines and stage_timing.csv")
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds between stats lines")
+    parser.add_argument("--duration", type=float, help="Seconds to run (default: until interrupted)")
+    parser.add_argument("--telemetry-dir", help="Telemetry store directory (default: ~/K2_telemetry/<time>)")
+    args = parser.parse_args()
+
+    out = sys.stdout
+
+    def emit(record):
+        out.write(json.dumps(record) + "\n")
+        out.flush()
+
+    with contextlib.redirect_stdout(sys.stderr):
+        source = make_source(args)
+        core = K2Core(ControllerServer(args.host, args.port), source,
+                      VisionEngine(args.workers) if source is not None else None, args.telemetry_dir)
+        core.on_connection = lambda connected: emit({"event": "connection", "time": time.time(),
+                                                     "connected": connected})
+        core.on_input = lambda channel, pin, state: emit({"event": "input", "time": time.time(),
+                                                          "channel": channel, "pin": pin, "state": state})
+        core.on_text = lambda line: emit({"event": "text", "time": time.time(), "line": line.strip()})
+        core.timer.enabled = args.timing
+        settings = dict(core.vision_settings)
+        settings["mode"] = args.mode
+        core.vision_settings = settings
+
+        core.start()
+        if source is not None:
+            core.open_camera()
+            core.start_capture()
+        deadline = time.monotonic() + args.duration if args.duration is not None else None
+        next_stats = time.monotonic() + args.interval
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                core.poll(timeout=0.01)
+                # Nothing is displayed, so results are only taken to keep the mailbox's counters honest
+                result = core.take_result()
+                if result is not None:
+                    core.release_result(result)
+                if time.monotonic() >= next_stats:
+                    next_stats += args.interval
+                    emit(dict(event="stats", **core.stats()))
+                    core.timer.export()
+                if replay_done(core):
+                    break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            core.close()
+        emit(dict(event="stats", **core.stats()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Live count plots for the K2 camera tab.
+
+Samples go into preallocated NumPy ring buffers, the lines are updated with
+set_data and blitted over a cached background, and redraws are throttled to a
+refresh rate independent of the camera rate. A min/max decimated history
+keeps the whole print in a fixed amount of memory.
+"""
+import time
+
+import numpy as np
+
+
+class RingBuffer:
+    # Fixed-size buffer of the most recent samples. Every value is written
+    # twice (at i and i + capacity) so view() is always one contiguous slice.
+    def __init__(self, capacity, dtype=np.float64):
+        self.capacity = capacity
+        self.data = np.zeros(2 * capacity, dtype=dtype)
+        self.index = 0
+        self.count = 0
+
+    def append(self, value):
+        self.data[self.index] = value
+        self.data[self.index + self.capacity] = value
+        self.index = (self.index + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def view(self):
+        start = self.index + self.capacity - self.count
+        return self.data[start:start + self.count]
+
+    def clear(self):
+        self.index = 0
+        self.count = 0
+
+
+class MinMaxHistory:
+    # Whole-run history decimated into buckets holding the min and max of
+    # bucket_size samples. When the buckets run out, neighbouring buckets are
+    # merged and bucket_size doubles, so memory stays constant.
+    def __init__(self, max_buckets=2048):
+        self.max_buckets = max_buckets
+        self.mins = np.zeros(max_buckets)
+        self.maxs = np.zeros(max_buckets)
+        self.buckets = 0
+        self.bucket_size = 1
+        self.in_bucket = 0
+        self.samples = 0
+
+    def append(self, value):
+        if self.in_bucket == 0:
+            if self.buckets == self.max_buckets:
+                self._merge()
+            self.mins[self.buckets] = value
+            self.maxs[self.buckets] = value
+            self.buckets += 1
+        else:
+            i = self.buckets - 1
+            self.mins[i] = min(self.mins[i], value)
+            self.maxs[i] = max(self.maxs[i], value)
+        self.in_bucket = (self.in_bucket + 1) % self.bucket_size
+        self.samples += 1
+
+    def _merge(self):
+        half = self.buckets // 2
+        self.mins[:half] = np.minimum(self.mins[0:2 * half:2], self.mins[1:2 * half:2])
+        self.maxs[:half] = np.maximum(self.maxs[0:2 * half:2], self.maxs[1:2 * half:2])
+        self.buckets = half
+        self.bucket_size *= 2
+        self.in_bucket = 0
+
+    def view(self):
+        # Returns the sample index each bucket starts at plus its min and max
+        x = np.arange(self.buckets) * self.bucket_size
+        return x, self.mins[:self.buckets], self.maxs[:self.buckets]
+
+    def clear(self):
+        self.buckets = 0
+        self.bucket_size = 1
+        self.in_bucket = 0
+        self.samples = 0
+
+
+class RollingPlot:
+    # One rolling line per axes. append() is cheap and can be called for every
+    # frame; refresh() redraws at most refresh_hz times per second.
+    def __init__(self, fig, canvas, axes, titles, colors, window=600, refresh_hz=5.0):
+        self.fig = fig
+        self.canvas = canvas
+        self.axes = list(axes)
+        self.window = window
+        self.refresh_hz = refresh_hz
+        self.show_history = False
+        self.buffers = [RingBuffer(window) for _ in self.axes]
+        self.histories = [MinMaxHistory() for _ in self.axes]
+        self.x = np.arange(window)
+        self.ymax = [10.0 for _ in self.axes]
+        self.background = None
+        self.last_refresh = 0.0
+        self.dirty = False
+
+        self.lines = []
+        for ax, title, color in zip(self.axes, titles, colors):
+            ax.set_title(title)
+            ax.set_xlim(0, window)
+            ax.set_ylim(0, 10)
+            line, = ax.plot([], [], color=color, animated=True)
+            self.lines.append(line)
+        self.canvas.mpl_connect("draw_event", self.on_draw)
+        self.canvas.draw()
+
+    def append(self, *values):
+        for buffer, history, value in zip(self.buffers, self.histories, values):
+            buffer.append(value)
+            history.append(value)
+        self.dirty = True
+
+    def set_history_mode(self, show_history):
+        self.show_history = show_history
+        for ax in self.axes:
+            ax.set_xlim(0, self.window)
+        self.refresh(force=True)
+
+    def clear(self):
+        for buffer, history in zip(self.buffers, self.histories):
+            buffer.clear()
+            history.clear()
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and (not self.dirty or now - self.last_refresh < 1.0 / self.refresh_hz):
+            return
+        self.last_refresh = now
+        self.dirty = False
+
+        needs_full_draw = force or self.background is None
+        for i, ax in enumerate(self.axes):
+            if self.show_history:
+                x, mins, maxs = self.histories[i].view()
+                # Draw the min and max traces as one polyline that zig-zags between them
+                self.lines[i].set_data(np.repeat(x, 2), np.column_stack((mins, maxs)).ravel())
+                peak = maxs.max() if len(maxs) else 0.0
+                xmax = max(self.window, self.histories[i].samples)
+                if ax.get_xlim()[1] < xmax:
+                    ax.set_xlim(0, xmax * 1.25)
+                    needs_full_draw = True
+            else:
+                data = self.buffers[i].view()
+                self.lines[i].set_data(self.x[:len(data)], data)
+                peak = data.max() if len(data) else 0.0
+            if peak > self.ymax[i]:
+                # Rescaling invalidates the cached background; this only happens when the data outgrows the axes
+                self.ymax[i] = peak * 1.5
+                ax.set_ylim(0, self.ymax[i])
+                needs_full_draw = True
+
+        if needs_full_draw:
+            self.canvas.draw()
+        else:
+            self.blit()
+
+    def on_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.draw_artists()
+
+    def draw_artists(self):
+        for ax, line in zip(self.axes, self.lines):
+            ax.draw_artist(line)
+
+    def blit(self):
+        self.canvas.restore_region(self.background)
+        self.draw_artists()
+        for ax in self.axes:
+            self.canvas.blit(ax.bbox)
@@ -0,0 +1,191 @@
+"""
+Incremental framing for the K2 controller socket.
+
+TCP is a byte stream: one recv() can hold half a message or several. Every
+connection gets a FrameDecoder with its own receive buffer, and only complete
+frames are handed on. Two kinds of frame share the stream:
+
+- text lines terminated by "\\n" (what the PLC sends with client.println)
+- binary frames: STX (0x02), a type byte, a 2-byte big-endian payload length
+  and the payload
+
+Frames are sliced out of the receive buffer as memoryviews, without copying.
+A view is only valid for the duration of the handler call; copy it (bytes())
+to keep it. A MessageDispatcher routes "key:value" lines and binary frame
+types to typed handlers.
+"""
+import struct
+
+STX = 0x02
+BINARY_HEADER = struct.Struct(">BBH")
+MAX_PAYLOAD = 0xFFFF
+
+# Binary frame types
+IO_STATE = 0x01
+
+# IO_STATE payload: sequence number, controller millis(), then one bitmask per
+# input channel (bit 0 = pin 1). The PLC pushes it whenever an input changes
+# and in reply to REQUEST_IO_UPDATE.
+IO_STATE_PAYLOAD = struct.Struct(">IIHH")
+
+
+def encode_line(text):
+    return text.encode("ascii") + b"\n"
+
+
+def encode_binary(frame_type, payload=b""):
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"Binary payload too long: {len(payload)} bytes")
+    return BINARY_HEADER.pack(STX, frame_type, len(payload)) + bytes(payload)
+
+
+class FrameDecoder:
+    # on_line(view) gets each text line without its "\r\n"; on_binary(frame_type, view)
+    # gets each binary payload. Lines longer than max_line are dropped (the
+    # decoder resynchronises at the next newline) and counted in errors.
+    def __init__(self, on_line, on_binary=None, max_line=4096):
+        self.on_line = on_line
+        self.on_binary = on_binary
+        self.max_line = max_line
+        self.buffer = bytearray()
+        self.discarding = False
+        self.frames = 0
+        self.errors = 0
+        self.bytes_received = 0
+
+    def feed(self, data):
+        # Returns the number of complete frames dispatched
+        self.bytes_received += len(data)
+        buffer = self.buffer
+        buffer += data
+        pos = 0
+        count = 0
+        end_of_data = len(buffer)
+        with memoryview(buffer) as view:
+            while pos < end_of_data:
+                if self.discarding:
+                    newline = buffer.find(b"\n", pos)
+                    if newline < 0:
+                        pos = end_of_data
+                        break
+                    pos = newline + 1
+                    self.discarding = False
+                    continue
+
+                if buffer[pos] == STX:
+                    if end_of_data - pos < BINARY_HEADER.size:
+                        break
+                    _, frame_type, length = BINARY_HEADER.unpack_from(buffer, pos)
+                    start = pos + BINARY_HEADER.size
+                    if end_of_data - start < length:
+                        break
+                    pos = start + length
+                    count += 1
+                    if self.on_binary is not None:
+                        self.on_binary(frame_type, view[start:pos])
+                    continue
+
+                newline = buffer.find(b"\n", pos)
+                if newline < 0:
+                    if end_of_data - pos > self.max_line:
+                        self.errors += 1
+                        self.discarding = True
+                        pos = end_of_data
+                    break
+                end = newline
+                if end > pos and buffer[end - 1] == 0x0D:
+                    end -= 1
+                if end - pos > self.max_line:
+                    self.errors += 1
+                elif end > pos:
+                    count += 1
+                    self.on_line(view[pos:end])
+                pos = newline + 1
+        # Handlers are done with their views, so the buffer can be compacted
+        del buffer[:pos]
+        self.frames += count
+        return count
+
+    def pending(self):
+        return len(self.buffer)
+
+    def reset(self):
+        self.buffer.clear()
+        self.discarding = False
+
+
+def parse_bits(value):
+    # "1,0,1,..." -> (True, False, True, ...)
+    return tuple(bit.strip() == "1" for bit in value.split(","))
+
+
+def bits_to_mask(states):
+    mask = 0
+    for i, state in enumerate(states):
+        if state:
+            mask |= 1 << i
+    return mask
+
+
+def unpack_io_state(payload):
+    # -> (seq, timestamp_ms, (channel_1_mask, channel_2_mask))
+    seq, timestamp_ms, channel_1, channel_2 = IO_STATE_PAYLOAD.unpack(payload)
+    return seq, timestamp_ms, (channel_1, channel_2)
+
+
+def pack_io_state(seq, timestamp_ms, channel_1, channel_2):
+    return encode_binary(IO_STATE, IO_STATE_PAYLOAD.pack(seq & 0xFFFFFFFF, timestamp_ms & 0xFFFFFFFF,
+                                                         channel_1, channel_2))
+
+
+def changed_pins(old_mask, new_mask, pins=16):
+    # Yields (pin, state) for every pin that differs; old_mask None means all pins
+    changed = (old_mask ^ new_mask) if old_mask is not None else (1 << pins) - 1
+    while changed:
+        bit = changed & -changed
+        yield bit.bit_length(), bool(new_mask & bit)
+        changed ^= bit
+
+
+class MessageDispatcher:
+    # Routes frames to handlers registered per message type.
+    #   dispatcher.on("channel_1_states", handler, parse_bits)  -> handler(states)
+    #   dispatcher.on_binary(0x01, handler)                     -> handler(view)
+    #   dispatcher.on_text(handler)                             -> handler(line) for anything else
+    # One dispatcher can serve several connections; each gets its own decoder().
+    def __init__(self):
+        self.line_handlers = {}
+        self.binary_handlers = {}
+        self.text_handler = None
+        self.unhandled = 0
+
+    def on(self, key, handler, parser=None):
+        self.line_handlers[key] = (handler, parser)
+
+    def on_binary(self, frame_type, handler):
+        self.binary_handlers[frame_type] = handler
+
+    def on_text(self, handler):
+        self.text_handler = handler
+
+    def decoder(self, max_line=4096):
+        return FrameDecoder(self.dispatch_line, self.dispatch_binary, max_line)
+
+    def dispatch_line(self, view):
+        line = str(view, "ascii", "replace")
+        key, sep, value = line.partition(":")
+        entry = self.line_handlers.get(key.strip()) if sep else None
+        if entry is not None:
+            handler, parser = entry
+            handler(parser(value) if parser is not None else value)
+        elif self.text_handler is not None:
+            self.text_handler(line)
+        else:
+            self.unhandled += 1
+
+    def dispatch_binary(self, frame_type, view):
+        handler = self.binary_handlers.get(frame_type)
+        if handler is not None:
+            handler(view)
+        else:
+            self.unhandled += 1
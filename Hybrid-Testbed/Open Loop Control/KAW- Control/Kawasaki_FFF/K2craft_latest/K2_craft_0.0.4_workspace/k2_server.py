@@ -0,0 +1,172 @@
+"""
+asyncio TCP server for the K2 controllers (PLC, ClearCore).
+
+The event loop runs on its own thread. Each client gets a reader task that
+feeds a k2_protocol.FrameDecoder and a writer task that drains an outbound
+queue, awaiting drain() so a slow client applies backpressure instead of
+growing a socket buffer. Nothing is echoed back.
+
+The GUI talks to the server through two thread-safe calls:
+- commands: send() / send_line() / send_binary() from any thread
+- telemetry: events, a queue.Queue of (kind, client, payload) tuples that the
+  Tk thread drains with root.after(), where kind is "connected",
+  "disconnected", "line" (payload is bytes) or "binary" (payload is
+  (frame_type, bytes))
+"""
+import asyncio
+import queue
+import threading
+
+from k2_protocol import FrameDecoder, encode_binary, encode_line
+
+
+class ClientConnection:
+    def __init__(self, addr, reader, writer, max_pending):
+        self.addr = addr
+        self.reader = reader
+        self.writer = writer
+        self.outbound = asyncio.Queue(maxsize=max_pending)
+        self.handler_task = None
+        self.bytes_sent = 0
+        self.dropped = 0
+
+
+class ControllerServer:
+    def __init__(self, host, port, max_pending=256, read_size=4096):
+        self.host = host
+        self.port = port
+        self.max_pending = max_pending
+        self.read_size = read_size
+        self.events = queue.Queue()
+        self.clients = {}
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.started = threading.Event()
+        self.error = None
+
+    # --- lifecycle (any thread) ---
+
+    def start(self, timeout=5.0):
+        self.thread = threading.Thread(target=self._run, name="k2-server", daemon=True)
+        self.thread.start()
+        self.started.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        print(f"Listening on {self.address}")
+
+    def stop(self, timeout=2.0):
+        if self.loop is None or not self.loop.is_running():
+            return
+        future = asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop)
+        try:
+            future.result(timeout)
+        except Exception as e:
+            print(f"Error stopping server: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+
+    @property
+    def address(self):
+        # Actual bound address, useful with port 0
+        return self.server.sockets[0].getsockname()[:2] if self.server else (self.host, self.port)
+
+    @property
+    def connected(self):
+        return bool(self.clients)
+
+    # --- command API (any thread) ---
+
+    def send(self, data, client=None):
+        # Queues raw bytes for one client (by addr) or all of them; returns False if nobody got it
+        if self.loop is None or not self.clients:
+            return False
+        self.loop.call_soon_threadsafe(self._enqueue, bytes(data), client)
+        return True
+
+    def send_line(self, text, client=None):
+        return self.send(encode_line(text), client)
+
+    def send_binary(self, frame_type, payload=b"", client=None):
+        return self.send(encode_binary(frame_type, payload), client)
+
+    # --- event loop side ---
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.server = self.loop.run_until_complete(
+                asyncio.start_server(self._handle_client, self.host, self.port))
+        except OSError as e:
+            self.error = e
+            self.started.set()
+            return
+        self.started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    async def _shutdown(self):
+        self.server.close()
+        handlers = [client.handler_task for client in self.clients.values()]
+        for client in list(self.clients.values()):
+            client.writer.close()
+        await asyncio.gather(*handlers, return_exceptions=True)
+        await self.server.wait_closed()
+
+    def _enqueue(self, data, addr):
+        targets = [self.clients[addr]] if addr in self.clients else list(self.clients.values())
+        for client in targets:
+            try:
+                client.outbound.put_nowait(data)
+            except asyncio.QueueFull:
+                client.dropped += 1
+                if client.dropped % 100 == 1:
+                    print(f"Outbound queue to {client.addr} full, {client.dropped} writes dropped so far")
+
+    async def _handle_client(self, reader, writer):
+        addr = writer.get_extra_info("peername")
+        client = ClientConnection(addr, reader, writer, self.max_pending)
+        client.handler_task = asyncio.current_task()
+        self.clients[addr] = client
+        print(f"Accepted connection from {addr}")
+        self.events.put(("connected", addr, None))
+        writer_task = asyncio.ensure_future(self._write_loop(client))
+        try:
+            await self._read_loop(client)
+        except (ConnectionError, OSError) as e:
+            print(f"Connection to {addr} lost: {e}")
+        finally:
+            writer_task.cancel()
+            await asyncio.gather(writer_task, return_exceptions=True)
+            del self.clients[addr]
+            writer.close()
+            print(f"Closing connection to {addr}")
+            self.events.put(("disconnected", addr, None))
+
+    async def _read_loop(self, client):
+        events = self.events
+        addr = client.addr
+        decoder = FrameDecoder(lambda view: events.put(("line", addr, bytes(view))),
+                               lambda frame_type, view: events.put(("binary", addr, (frame_type, bytes(view)))))
+        while True:
+            data = await client.reader.read(self.read_size)
+            if not data:
+                return
+            decoder.feed(data)
+
+    async def _write_loop(self, client):
+        try:
+            while True:
+                data = await client.outbound.get()
+                client.writer.write(data)
+                client.bytes_sent += len(data)
+                # Waits here while the client's receive window is full
+                await client.writer.drain()
+        except asyncio.CancelledError:
+            pass
+        except (ConnectionError, OSError) as e:
+            print(f"Error sending data to {client.addr}: {e}")
+            client.writer.close()
@@ -0,0 +1,193 @@
+"""
+Simulated K2 controller for exercising the GUI's networking without the PLC.
+
+Connects to the controller server like Kaw_PLC_code_0.0.5.ino does and speaks
+the same protocol:
+- handles "@<seq> <command>" lines (and untagged ones) and answers "ACK:<seq>"
+- SET_OUTPUT:<ch>:<pin>:<state>, REQUEST_IO_UPDATE, command:<action> and
+  <name>:<value> variables, with the PLC's status replies
+- pushes input changes as binary IO_STATE frames, or as the legacy
+  channel_N_states: ASCII lines with --ascii-io
+
+Inputs toggle at a configurable rate, replies are delayed by a configurable
+latency, and every write can be split into randomly sized fragments to
+exercise the GUI's reassembly.
+
+Usage:
+python k2_simulator.py [--host 192.168.1.1] [--port 10000] [--io-rate 5] [--latency-ms 2] [--fragment 1 64]
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from k2_protocol import FrameDecoder, pack_io_state
+
+
+def millis():
+    # Same clock as time.monotonic(), so a benchmark on this machine can compute IO latency
+    return int(time.monotonic() * 1000) & 0xFFFFFFFF
+
+
+class PLCSimulator:
+    def __init__(self, host, port, io_rate_hz=5.0, latency_ms=0.0, jitter_ms=0.0, fragment=None,
+                 ascii_io=False, seed=0):
+        self.host = host
+        self.port = port
+        self.io_rate_hz = io_rate_hz
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.fragment = fragment
+        self.ascii_io = ascii_io
+        self.rng = random.Random(seed)
+        self.inputs = [0, 0]
+        self.outputs = {}
+        self.variables = {}
+        self.io_seq = 0
+        self.writer = None
+        self.write_lock = None
+        self.stop_event = None
+        self.loop = None
+        self.commands = 0
+        self.acks = 0
+        self.io_updates = 0
+        self.bytes_sent = 0
+
+    async def run(self, duration=None):
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        self.write_lock = asyncio.Lock()
+        reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        tasks = [asyncio.ensure_future(self._read_loop(reader))]
+        if self.io_rate_hz > 0:
+            tasks.append(asyncio.ensure_future(self._io_loop()))
+        if duration is not None:
+            self.loop.call_later(duration, self.stop_event.set)
+        await self.stop_event.wait()
+        for task in tasks:
+            task.cancel()
+        self.writer.close()
+
+    def stop(self):
+        # Any thread: asyncio.Event is not thread-safe, so the set() runs on the simulator's own loop
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.stop_event.set)
+
+    # --- outbound ---
+
+    async def write(self, data):
+        # One logical write, optionally split into fragments with a yield between them
+        async with self.write_lock:
+            if self.fragment is None:
+                self.writer.write(data)
+            else:
+                pos = 0
+                while pos < len(data):
+                    size = self.rng.randint(*self.fragment)
+                    self.writer.write(data[pos:pos + size])
+                    await self.writer.drain()
+                    await asyncio.sleep(0)
+                    pos += size
+            await self.writer.drain()
+            self.bytes_sent += len(data)
+
+    async def println(self, text):
+        await self.write(text.encode("ascii") + b"\r\n")
+
+    async def send_io_state(self):
+        self.io_updates += 1
+        if self.ascii_io:
+            lines = [f"channel_{channel}_states:" + ",".join("1" if mask >> pin & 1 else "0" for pin in range(16))
+                     for channel, mask in enumerate(self.inputs, start=1)]
+            await self.println("\r\n".join(lines))
+        else:
+            await self.write(pack_io_state(self.io_seq, millis(), *self.inputs))
+        self.io_seq += 1
+
+    async def _io_loop(self):
+        while True:
+            await asyncio.sleep(self.rng.expovariate(self.io_rate_hz))
+            channel = self.rng.randrange(2)
+            self.inputs[channel] ^= 1 << self.rng.randrange(16)
+            await self.send_io_state()
+
+    # --- inbound ---
+
+    async def _read_loop(self, reader):
+        lines = []
+        decoder = FrameDecoder(lambda view: lines.append(str(view, "ascii", "replace")))
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                self.stop_event.set()
+                return
+            decoder.feed(data)
+            for line in lines:
+                await self.handle_line(line)
+            lines.clear()
+
+    async def handle_line(self, line):
+        self.commands += 1
+        if self.latency_ms or self.jitter_ms:
+            await asyncio.sleep(max(0.0, self.latency_ms + self.rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000.0)
+        seq = None
+        if line.startswith("@"):
+            tag, _, line = line.partition(" ")
+            seq = int(tag[1:])
+        await self.handle_command(line)
+        if seq is not None:
+            self.acks += 1
+            await self.println(f"ACK:{seq}")
+
+    async def handle_command(self, command):
+        if command == "REQUEST_IO_UPDATE":
+            await self.send_io_state()
+        elif command.startswith("SET_OUTPUT:"):
+            try:
+                _, channel, pin, state = command.split(":")
+                self.outputs[(int(channel), int(pin))] = state == "1"
+                await self.println("Output command processed.")
+            except ValueError:
+                await self.println("Invalid output command.")
+        elif command.startswith("command:"):
+            action = command.split(":", 1)[1]
+            replies = {"start_print": "Print started.", "stop_print": "Print stopped.",
+                       "pause_print": "Print paused.", "resume_print": "Print resumed."}
+            self.variables["command"] = action
+            if action in replies:
+                await self.println(replies[action])
+            elif action == "stop_client":
+                self.stop_event.set()
+        elif ":" in command:
+            name, value = command.split(":", 1)
+            self.variables[name] = value
+
+    def stats(self):
+        return {"commands": self.commands, "acks": self.acks, "io_updates": self.io_updates,
+                "bytes_sent": self.bytes_sent}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated K2 PLC controller")
+    parser.add_argument("--host", default="192.168.1.1")
+    parser.add_argument("--port", type=int, default=10000)
+    parser.add_argument("--io-rate", type=float, default=5.0, help="Input changes per second")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Delay before handling each command")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--fragment", type=int, nargs=2, metavar=("MIN", "MAX"),
+                        help="Split every write into MIN..MAX byte fragments")
+    parser.add_argument("--ascii-io", action="store_true", help="Report inputs as channel_N_states: lines")
+    parser.add_argument("--duration", type=float, help="Seconds to run (default: until disconnected)")
+    args = parser.parse_args()
+
+    simulator = PLCSimulator(args.host, args.port, args.io_rate, args.latency_ms, args.jitter_ms,
+                             tuple(args.fragment) if args.fragment else None, args.ascii_io)
+    try:
+        asyncio.run(simulator.run(args.duration))
+    except KeyboardInterrupt:
+        pass
+    print(simulator.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,437 @@
+"""
+Frame sources for the K2 vision pipeline.
+
+K2Core pulls camera frames through the FrameSource interface, so the same
+acquisition and vision threads run against a Basler camera, a synthetic test
+pattern or a recorded print:
+
+    source.open()      # acquire the device
+    source.start()     # begin streaming
+    image = source.read()   # on the acquisition thread; RGB uint8 or None
+    source.stop()
+    source.close()
+
+read() returns None on a timeout, a failed grab or while the source is not
+streaming; the acquisition thread then waits briefly and tries again.
+
+Recorded sources (video files, image folders and raw recordings made with
+FrameRecorder) replay at their recorded rate, at a fixed rate or as fast as
+the consumer reads. open_source() picks the right class for a path, so
+offline runs only need the path of a recording.
+
+Raw recording layout (one directory):
+    recording.json    shape, dtype and frame count
+    frames.raw        frames back to back, memory-mapped on replay
+    timestamps.f8     acquisition time of every frame (float64 seconds)
+"""
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from k2_timing import StageTimer
+
+RECORDING_HEADER = "recording.json"
+RECORDING_FRAMES = "frames.raw"
+RECORDING_TIMESTAMPS = "timestamps.f8"
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+pylon = None
+
+
+def _import_pylon():
+    # pypylon is only needed when a Basler camera is actually used
+    global pylon
+    if pylon is None:
+        from pypylon import pylon as _pylon
+        pylon = _pylon
+    return pylon
+
+
+class FrameSource:
+    # timer is replaced by K2Core's StageTimer; sources report "retrieve"
+    # (waiting for / decoding a frame) and, where it applies, "convert"
+    def __init__(self):
+        self.streaming = False
+        self.timer = StageTimer()
+
+    def open(self):
+        pass
+
+    def start(self):
+        self.streaming = True
+
+    def stop(self):
+        self.streaming = False
+
+    @property
+    def grabbing(self):
+        return self.streaming
+
+    def read(self):
+        raise NotImplementedError
+
+    def close(self):
+        self.stop()
+
+
+class PylonFrameSource(FrameSource):
+    # First Basler camera found, converted to RGB8packed so neither the vision
+    # pipeline nor the display has to swap channels
+    def __init__(self, timeout_ms=500):
+        super().__init__()
+        self.timeout_ms = timeout_ms
+        self.camera = None
+        self.converter = None
+
+    def open(self):
+        pylon = _import_pylon()
+        self.camera = pylon.InstantCamera(pylon.TlFactory.GetInstance().CreateFirstDevice())
+        self.camera.Open()
+        self.converter = pylon.ImageFormatConverter()
+        self.converter.OutputPixelFormat = pylon.PixelType_RGB8packed
+
+    def start(self):
+        if self.camera is not None and not self.camera.IsGrabbing():
+            self.camera.StartGrabbing(pylon.GrabStrategy_LatestImages)
+
+    def stop(self):
+        if self.camera is not None and self.camera.IsGrabbing():
+            self.camera.StopGrabbing()
+
+    @property
+    def grabbing(self):
+        return self.camera is not None and self.camera.IsGrabbing()
+
+    def read(self):
+        if not self.grabbing:
+            return None
+        t = self.timer.start()
+        grabResult = self.camera.RetrieveResult(self.timeout_ms, pylon.TimeoutHandling_Return)
+        try:
+            if grabResult.IsValid() and grabResult.GrabSucceeded():
+                t = self.timer.lap("retrieve", t)
+                image = self.converter.Convert(grabResult).GetArray()
+                self.timer.lap("convert", t)
+                return image
+            return None
+        finally:
+            grabResult.Release()
+
+    def close(self):
+        if self.camera is not None:
+            self.stop()
+            self.camera.Close()
+            self.camera = None
+
+
+class SyntheticFrameSource(FrameSource):
+    # Cycles through a few bench_preprocess.synthetic_frame images at a fixed
+    # frame rate (fps=0 delivers them as fast as the consumer reads)
+    def __init__(self, width=1280, height=720, fps=30.0, variants=8):
+        super().__init__()
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.variants = variants
+        self.frames = []
+        self.index = 0
+        self.next_time = 0.0
+
+    def open(self):
+        from bench_preprocess import synthetic_frame
+        self.frames = [synthetic_frame(self.width, self.height, seed) for seed in range(self.variants)]
+
+    def start(self):
+        super().start()
+        self.next_time = time.monotonic()
+
+    def read(self):
+        if not self.streaming or not self.frames:
+            return None
+        if self.fps > 0:
+            delay = self.next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.next_time = max(self.next_time + 1.0 / self.fps, time.monotonic() - 1.0 / self.fps)
+        # A copy, like a camera that hands out a fresh buffer per grab
+        image = self.frames[self.index % len(self.frames)].copy()
+        self.index += 1
+        return image
+
+
+class ReplaySource(FrameSource):
+    # Base for recorded sources. fps=None replays at the recorded rate, fps=0
+    # as fast as the consumer reads, anything else at that fixed rate. At the
+    # end, loop=True starts over; otherwise finished is set and read() keeps
+    # returning None. Subclasses implement _next() -> (image, media_time) or
+    # None at the end (media_time in seconds, or None if the source has none)
+    # and _rewind().
+    native_fps = 0.0
+    lossless = True
+
+    def __init__(self, fps=None, loop=False):
+        super().__init__()
+        self.fps = fps
+        self.loop = loop
+        self.finished = False
+        self.played = 0
+        self.start_time = 0.0
+        self.media_start = None
+
+    def start(self):
+        super().start()
+        self.finished = False
+        self._restart_clock()
+
+    def _restart_clock(self):
+        self.start_time = time.monotonic()
+        self.media_start = None
+        self.played = 0
+
+    def read(self):
+        if not self.streaming or self.finished:
+            return None
+        t = self.timer.start()
+        item = self._next()
+        if item is None and self.loop:
+            self._rewind()
+            self._restart_clock()
+            item = self._next()
+        if item is None:
+            self.finished = True
+            return None
+        image, media_time = item
+        self.timer.lap("retrieve", t)
+        self._pace(media_time)
+        self.played += 1
+        return image
+
+    def _pace(self, media_time):
+        # Sleeps until the frame is due; a consumer that falls behind gets every frame without waiting
+        if self.fps == 0:
+            return
+        if self.fps is None and media_time is not None:
+            if self.media_start is None:
+                self.media_start = media_time
+            offset = media_time - self.media_start
+        else:
+            rate = self.fps or self.native_fps
+            if not rate:
+                return
+            offset = self.played / rate
+        delay = self.start_time + offset - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _next(self):
+        raise NotImplementedError
+
+    def _rewind(self):
+        raise NotImplementedError
+
+
+class VideoFileSource(ReplaySource):
+    # Any file OpenCV can decode; frames are converted to RGB like the camera's
+    def __init__(self, path, fps=None, loop=False):
+        super().__init__(fps, loop)
+        self.path = path
+        self.capture = None
+
+    def open(self):
+        self.capture = cv2.VideoCapture(self.path)
+        if not self.capture.isOpened():
+            raise IOError(f"Cannot open video {self.path}")
+        self.native_fps = self.capture.get(cv2.CAP_PROP_FPS) or 0.0
+
+    def _next(self):
+        ok, image = self.capture.read()
+        if not ok:
+            return None
+        media_time = self.capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+        if media_time <= 0 and self.played > 0:
+            # Backend without timestamps; pace by the container's frame rate instead
+            media_time = None
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB), media_time
+
+    def _rewind(self):
+        self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def close(self):
+        super().close()
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+
+
+class ImageFolderSource(ReplaySource):
+    # Every image in a folder, in file name order. Folders carry no timing, so
+    # fps=None replays as fast as the consumer reads.
+    def __init__(self, directory, fps=None, loop=False):
+        super().__init__(fps, loop)
+        self.directory = directory
+        self.paths = []
+        self.index = 0
+
+    def open(self):
+        self.paths = sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                            if name.lower().endswith(IMAGE_EXTENSIONS))
+        if not self.paths:
+            raise IOError(f"No images in {self.directory}")
+        self.index = 0
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _next(self):
+        while self.index < len(self.paths):
+            path = self.paths[self.index]
+            self.index += 1
+            image = cv2.imread(path, cv2.IMREAD_COLOR)
+            if image is not None:
+                return cv2.cvtColor(image, cv2.COLOR_BGR2RGB), None
+            print(f"Skipping unreadable image {path}")
+        return None
+
+    def _rewind(self):
+        self.index = 0
+
+
+class RawRecordingSource(ReplaySource):
+    # Replays a FrameRecorder directory straight out of a read-only memmap.
+    # The frame count is taken from the file size, so a recording cut short by
+    # a crash replays up to its last complete frame.
+    def __init__(self, directory, fps=None, loop=False, start=0, stop=None):
+        super().__init__(fps, loop)
+        self.directory = directory
+        self.start_frame = start
+        self.stop_frame = stop
+        self.frames = None
+        self.timestamps = None
+        self.index = start
+
+    def open(self):
+        with open(os.path.join(self.directory, RECORDING_HEADER)) as f:
+            header = json.load(f)
+        shape = tuple(header["shape"])
+        dtype = np.dtype(header["dtype"])
+        path = os.path.join(self.directory, RECORDING_FRAMES)
+        count = os.path.getsize(path) // (int(np.prod(shape)) * dtype.itemsize)
+        self.frames = np.memmap(path, dtype=dtype, mode="r", shape=(count,) + shape) if count else \
+            np.empty((0,) + shape, dtype=dtype)
+        timestamps_path = os.path.join(self.directory, RECORDING_TIMESTAMPS)
+        if os.path.exists(timestamps_path):
+            self.timestamps = np.fromfile(timestamps_path, dtype="<f8")
+        self.index = self.start_frame
+
+    def __len__(self):
+        return len(self.frames[self.start_frame:self.stop_frame])
+
+    def _next(self):
+        stop = len(self.frames) if self.stop_frame is None else min(self.stop_frame, len(self.frames))
+        if self.index >= stop:
+            return None
+        i = self.index
+        self.index += 1
+        media_time = float(self.timestamps[i]) if self.timestamps is not None and i < len(self.timestamps) else None
+        return self.frames[i], media_time
+
+    def _rewind(self):
+        self.index = self.start_frame
+
+    def close(self):
+        super().close()
+        self.frames = None
+
+
+class FrameRecorder:
+    # Appends frames to a raw recording that RawRecordingSource can replay.
+    # Shape and dtype are fixed by the first frame; the header is rewritten on
+    # close with the final frame count.
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.shape = None
+        self.dtype = None
+        self.count = 0
+        self.frames_file = None
+        self.timestamps_file = None
+
+    def write(self, image, timestamp=None):
+        image = np.ascontiguousarray(image)
+        if self.frames_file is None:
+            self.shape = image.shape
+            self.dtype = image.dtype
+            self.frames_file = open(os.path.join(self.directory, RECORDING_FRAMES), "wb")
+            self.timestamps_file = open(os.path.join(self.directory, RECORDING_TIMESTAMPS), "wb")
+            self._write_header()
+        elif image.shape != self.shape or image.dtype != self.dtype:
+            raise ValueError(f"Frame {image.shape} {image.dtype} does not match recording {self.shape} {self.dtype}")
+        self.frames_file.write(image.data)
+        np.float64(time.monotonic() if timestamp is None else timestamp).tofile(self.timestamps_file)
+        self.count += 1
+
+    def _write_header(self):
+        with open(os.path.join(self.directory, RECORDING_HEADER), "w") as f:
+            json.dump({"shape": list(self.shape), "dtype": np.dtype(self.dtype).str, "frames": self.count,
+                       "created": time.time()}, f, indent=2)
+
+    def close(self):
+        if self.frames_file is not None:
+            self.frames_file.close()
+            self.timestamps_file.close()
+            self.frames_file = None
+            self._write_header()
+
+
+class RecordingSource(FrameSource):
+    # Wraps another source and records every frame it delivers
+    def __init__(self, source, recorder):
+        super().__init__()
+        self.source = source
+        self.recorder = recorder
+
+    def open(self):
+        self.source.timer = self.timer
+        self.source.open()
+
+    def start(self):
+        self.source.start()
+
+    def stop(self):
+        self.source.stop()
+
+    @property
+    def grabbing(self):
+        return self.source.grabbing
+
+    def read(self):
+        image = self.source.read()
+        if image is not None:
+            self.recorder.write(image)
+        return image
+
+    @property
+    def lossless(self):
+        return getattr(self.source, "lossless", False)
+
+    def close(self):
+        self.source.close()
+        self.recorder.close()
+
+
+def open_source(spec, fps=None, loop=False):
+    # "pylon", "synthetic", a raw recording directory, an image folder or a video file
+    if spec == "pylon":
+        return PylonFrameSource()
+    if spec == "synthetic":
+        return SyntheticFrameSource(fps=30.0 if fps is None else fps)
+    if os.path.isdir(spec):
+        if os.path.exists(os.path.join(spec, RECORDING_HEADER)):
+            return RawRecordingSource(spec, fps, loop)
+        return ImageFolderSource(spec, fps, loop)
+    if os.path.isfile(spec):
+        return VideoFileSource(spec, fps, loop)
+    raise ValueError(f"Unknown frame source {spec!r}")
@@ -0,0 +1,139 @@
+"""
+Bounded, columnar store for per-frame vision telemetry.
+
+Rows are written into a preallocated chunk of typed NumPy columns. Full
+chunks are appended to one raw binary file per column in the store
+directory, next to a meta.json describing the columns, so memory stays flat
+for long prints and the data can be memory-mapped for post-print analysis.
+
+    store = TelemetryStore("/path/to/run")
+    store.append(time.time(), "both", 12, 3, 41.5)
+    ...
+    store.close()
+    columns = load("/path/to/run")        # dict of np.memmap columns
+"""
+import csv
+import json
+import os
+import threading
+
+import numpy as np
+
+COLUMNS = [
+    ("timestamp", "<f8"),
+    ("mode", "u1"),
+    ("line_count", "<i4"),
+    ("blob_count", "<i4"),
+    ("latency_ms", "<f4"),
+]
+
+MODES = ["lines", "blobs", "color", "edges", "contours", "shapes", "both"]
+
+META_FILE = "meta.json"
+
+
+def column_path(directory, name, dtype):
+    return os.path.join(directory, f"{name}.{np.dtype(dtype).str.lstrip('<>|')}")
+
+
+class TelemetryStore:
+    def __init__(self, directory, chunk_size=65536, columns=COLUMNS, modes=MODES):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.columns = list(columns)
+        self.modes = list(modes)
+        self.chunk = {name: np.zeros(chunk_size, dtype=dtype) for name, dtype in self.columns}
+        self.filled = 0
+        self.spilled_rows = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.spilled_rows + self.filled
+
+    def append(self, timestamp, mode, line_count=None, blob_count=None, latency_ms=0.0, **extra):
+        # Missing counts are stored as -1; extra keyword columns must exist in self.columns
+        with self.lock:
+            i = self.filled
+            self.chunk["timestamp"][i] = timestamp
+            self.chunk["mode"][i] = self.modes.index(mode) if mode in self.modes else 255
+            self.chunk["line_count"][i] = -1 if line_count is None else line_count
+            self.chunk["blob_count"][i] = -1 if blob_count is None else blob_count
+            self.chunk["latency_ms"][i] = latency_ms
+            for name, value in extra.items():
+                self.chunk[name][i] = value
+            self.filled += 1
+            if self.filled == self.chunk_size:
+                self._spill()
+
+    def _spill(self):
+        if self.filled == 0:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for name, dtype in self.columns:
+            with open(column_path(self.directory, name, dtype), "ab") as f:
+                self.chunk[name][:self.filled].tofile(f)
+        self.spilled_rows += self.filled
+        self.filled = 0
+        self._write_meta()
+
+    def _write_meta(self):
+        meta = {
+            "rows": self.spilled_rows,
+            "columns": [[name, np.dtype(dtype).str] for name, dtype in self.columns],
+            "modes": self.modes,
+        }
+        tmp_path = os.path.join(self.directory, META_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.directory, META_FILE))
+
+    def flush(self):
+        with self.lock:
+            self._spill()
+
+    def close(self):
+        self.flush()
+
+    def recent(self, name):
+        # Rows of the in-memory chunk only (the most recent rows)
+        with self.lock:
+            return self.chunk[name][:self.filled].copy()
+
+    def export_csv(self, path, block_rows=65536):
+        # Streams spilled rows (memory-mapped) and the in-memory chunk to CSV
+        with self.lock:
+            spilled = load(self.directory) if self.spilled_rows else None
+            pending = {name: self.chunk[name][:self.filled].copy() for name, _ in self.columns}
+        names = [name for name, _ in self.columns]
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(names)
+            blocks = []
+            if spilled is not None:
+                rows = len(spilled[names[0]])
+                for start in range(0, rows, block_rows):
+                    blocks.append({name: spilled[name][start:start + block_rows] for name in names})
+            blocks.append(pending)
+            for block in blocks:
+                modes = [self.modes[m] if m < len(self.modes) else "" for m in block["mode"]]
+                for i in range(len(block["timestamp"])):
+                    writer.writerow([block["timestamp"][i], modes[i]] +
+                                    [block[name][i] for name in names[2:]])
+        return len(self)
+
+
+def load(directory):
+    # Returns {column: np.memmap} for everything spilled to the store directory
+    with open(os.path.join(directory, META_FILE)) as f:
+        meta = json.load(f)
+    columns = {}
+    for name, dtype in meta["columns"]:
+        path = column_path(directory, name, dtype)
+        columns[name] = np.memmap(path, dtype=dtype, mode="r", shape=(meta["rows"],)) if meta["rows"] else \
+            np.zeros(0, dtype=dtype)
+    return columns
+
+
+def load_modes(directory):
+    with open(os.path.join(directory, META_FILE)) as f:
+        return json.load(f)["modes"]
@@ -0,0 +1,108 @@
+"""
+Per-stage timing of the camera pipeline.
+
+The hot path brackets each stage with two calls:
+
+    t = timer.start()
+    grab = camera.RetrieveResult(...)
+    t = timer.lap("retrieve", t)     # records the stage, returns the new start
+    image = converter.Convert(grab)
+    timer.lap("convert", t)
+
+Timestamps come from time.monotonic(), the clock Frame.timestamp uses, so a
+stage can also be measured from the moment a frame was grabbed. Every stage
+keeps a rolling window of its latest samples; percentiles are only computed
+when someone asks (the overlay, the stats stream or the CSV export).
+
+While the timer is disabled start() returns 0 and lap() returns at once, so
+the instrumentation costs one method call per stage.
+"""
+import os
+import threading
+import time
+
+import numpy as np
+
+# Stages in pipeline order, as shown in the overlay
+STAGES = ("retrieve", "convert", "queue", "detect", "resize", "photo", "graphs", "frame")
+
+
+class StageTimer:
+    def __init__(self, window=256, enabled=False, stages=STAGES):
+        self.window = window
+        self.enabled = enabled
+        self.order = list(stages)
+        self.samples = {}
+        self.lock = threading.Lock()
+        self.log = None
+
+    def start(self):
+        return time.monotonic() if self.enabled else 0.0
+
+    def lap(self, stage, start):
+        # Records now - start for stage and returns now
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic()
+        if start:
+            self.record(stage, (now - start) * 1000.0)
+        return now
+
+    def record(self, stage, ms):
+        with self.lock:
+            entry = self.samples.get(stage)
+            if entry is None:
+                entry = self.samples[stage] = [np.zeros(self.window), 0]
+                if stage not in self.order:
+                    self.order.append(stage)
+            buffer, count = entry
+            buffer[count % self.window] = ms
+            entry[1] = count + 1
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+
+    def summary(self):
+        # Rows of (stage, samples seen, mean, p50, p95, p99, max) in ms over the rolling window
+        windows = []
+        with self.lock:
+            for stage in self.order:
+                entry = self.samples.get(stage)
+                if entry is not None:
+                    buffer, count = entry
+                    windows.append((stage, count, buffer[:min(count, self.window)].copy()))
+        rows = []
+        for stage, count, values in windows:
+            p50, p95, p99 = np.percentile(values, (50, 95, 99))
+            rows.append((stage, count, float(values.mean()), float(p50), float(p95), float(p99), float(values.max())))
+        return rows
+
+    def format(self):
+        lines = [f"{'stage':9s}{'p50':>7s}{'p95':>7s}{'p99':>7s}{'max':>7s}"]
+        for stage, count, mean, p50, p95, p99, worst in self.summary():
+            lines.append(f"{stage[:8]:9s}{p50:7.1f}{p95:7.1f}{p99:7.1f}{worst:7.1f}")
+        return "\n".join(lines)
+
+    def open_log(self, path):
+        # Snapshots written by export() go to this CSV, next to the rest of the run's telemetry
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        new = not os.path.exists(path)
+        self.log = open(path, "a", buffering=1)
+        if new:
+            self.log.write("wall_time,stage,samples,mean_ms,p50_ms,p95_ms,p99_ms,max_ms\n")
+
+    def export(self):
+        if self.log is None or not self.enabled:
+            return 0
+        now = time.time()
+        rows = self.summary()
+        for row in rows:
+            self.log.write("{:.3f},{},{},{:.3f},{:.3f},{:.3f},{:.3f},{:.3f}\n".format(now, *row))
+        return len(rows)
+
+    def close(self):
+        if self.log is not None:
+            self.export()
+            self.log.close()
+            self.log = None
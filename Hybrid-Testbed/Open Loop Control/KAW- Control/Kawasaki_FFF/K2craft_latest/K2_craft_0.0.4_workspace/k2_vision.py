@@ -0,0 +1,424 @@
+"""
+Image segmentation methods for the K2 camera tab and a multi-process engine
+that runs the detectors of a display mode in parallel.
+
+Frames are handed to the worker processes through shared memory; only the
+detector name, the buffer names and the settings snapshot are pickled.
+
+Detectors pull their grayscale, blurred, HSV and edge images from a per-frame
+FrameCache, so detectors that run on the same frame in the same process pay
+for each transform once. Gray is the only intermediate the detectors of a
+combined mode have in common; the engine computes it once in the parent and
+hands it to every worker through shared memory.
+
+Detection can be limited to a region of interest and run at a reduced
+analysis scale ("roi" and "analysis_scale" in the settings); overlays are
+mapped back onto the full frame so they line up with the displayed image.
+
+Frames are RGB: the pylon converter outputs RGB8packed so the display path
+never has to swap channels.
+"""
+import os
+import queue
+import threading
+import types
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+# Detectors each display mode needs, in the order they are composed
+MODE_DETECTORS = {
+    "lines": ("lines",),
+    "blobs": ("blobs",),
+    "color": ("color",),
+    "edges": ("edges",),
+    "contours": ("contours",),
+    "shapes": ("shapes",),
+    "both": ("lines", "blobs"),
+}
+
+_local = threading.local()
+
+
+class FrameCache:
+    # Intermediate images of one frame, keyed by transform and parameters
+    def __init__(self, image, frame_id=None):
+        self.image = image
+        self.frame_id = frame_id
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key, compute):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            value = self.entries[key] = compute()
+        else:
+            self.hits += 1
+        return value
+
+    def gray(self):
+        return self._get(("gray",), lambda: cv2.cvtColor(self.image, cv2.COLOR_RGB2GRAY))
+
+    def blurred_gray(self, ksize=5):
+        return self._get(("blurred_gray", ksize), lambda: cv2.GaussianBlur(self.gray(), (ksize, ksize), 0))
+
+    def hsv(self):
+        return self._get(("hsv",), lambda: cv2.cvtColor(self.image, cv2.COLOR_RGB2HSV))
+
+    def put(self, key, value):
+        # Seeds an intermediate computed elsewhere (the engine's shared gray image)
+        self.entries.setdefault(key, value)
+
+    def edges(self, low, high, blur_ksize=None, aperture_size=3):
+        # blur_ksize=None runs Canny on the unblurred gray image
+        def compute():
+            source = self.gray() if blur_ksize is None else self.blurred_gray(blur_ksize)
+            return cv2.Canny(source, low, high, apertureSize=aperture_size)
+        return self._get(("edges", low, high, blur_ksize, aperture_size), compute)
+
+
+class PreprocessCache:
+    # Keeps the FrameCache of the most recent frames so every detector run on
+    # a frame gets the same intermediates. Frames are keyed by (session,
+    # frame_id): frame ids restart with every new FrameRing, so a new session
+    # drops everything cached for the previous one.
+    def __init__(self, max_frames=4):
+        self.max_frames = max_frames
+        self.frames = {}
+        self.session = None
+        self.lock = threading.Lock()
+
+    def for_frame(self, frame_id, image, session=0):
+        if frame_id is None:
+            return FrameCache(image)
+        with self.lock:
+            if session != self.session:
+                self.frames.clear()
+                self.session = session
+            cache = self.frames.get(frame_id)
+            if cache is None:
+                if len(self.frames) >= self.max_frames:
+                    del self.frames[min(self.frames)]
+                cache = self.frames[frame_id] = FrameCache(image, frame_id)
+            return cache
+
+
+ANALYSIS_SCALES = (1.0, 0.5, 0.25)
+
+
+def clip_roi(roi, shape):
+    # roi is (x, y, width, height) in full-frame pixels; None or an empty ROI means the whole frame
+    height, width = shape[:2]
+    if not roi:
+        return 0, 0, width, height
+    x, y, w, h = (int(v) for v in roi)
+    x = min(max(x, 0), width - 1)
+    y = min(max(y, 0), height - 1)
+    w = width - x if w <= 0 else min(w, width - x)
+    h = height - y if h <= 0 else min(h, height - y)
+    return x, y, w, h
+
+
+def analysis_image(image, settings):
+    # Crop to the ROI and decimate to the analysis scale before any detector runs
+    x, y, w, h = clip_roi(settings.get("roi"), image.shape)
+    scale = settings.get("analysis_scale", 1.0)
+    view = image[y:y + h, x:x + w]
+    if scale != 1.0:
+        view = cv2.resize(view, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    return view
+
+
+def restore_overlay(image, overlay, settings):
+    # Places an analysis-space overlay back into the full frame
+    x, y, w, h = clip_roi(settings.get("roi"), image.shape)
+    full_frame = (x, y, w, h) == (0, 0, image.shape[1], image.shape[0])
+    if full_frame and overlay.shape[:2] == image.shape[:2]:
+        return overlay
+    if overlay.shape[:2] != (h, w):
+        overlay = cv2.resize(overlay, (w, h), interpolation=cv2.INTER_LINEAR)
+    if full_frame:
+        return overlay
+    restored = image.copy()
+    restored[y:y + h, x:x + w] = overlay
+    cv2.rectangle(restored, (x, y), (x + w - 1, y + h - 1), (0, 255, 255), 2)
+    return restored
+
+
+def setup_blob_detector(scale=1.0):
+    params = cv2.SimpleBlobDetector_Params()
+    params.filterByArea = True
+    params.minArea = 150 * scale * scale
+    params.filterByCircularity = True
+    params.minCircularity = 0.1
+    params.filterByConvexity = True
+    params.minConvexity = 0.5
+    params.filterByInertia = True
+    params.minInertiaRatio = 0.01
+    return cv2.SimpleBlobDetector_create(params)
+
+
+def get_blob_detector(scale=1.0):
+    # One detector per thread (and therefore per worker process) and analysis scale
+    detectors = getattr(_local, "blob_detectors", None)
+    if detectors is None:
+        detectors = _local.blob_detectors = {}
+    detector = detectors.get(scale)
+    if detector is None:
+        detector = detectors[scale] = setup_blob_detector(scale)
+    return detector
+
+
+def detect_lines(image, settings, prep=None):
+    prep = prep or FrameCache(image)
+    edges = prep.edges(settings["edge_low"], settings["edge_high"], blur_ksize=5)
+    # Pixel thresholds are tuned for the full-resolution image
+    scale = settings.get("analysis_scale", 1.0)
+    lines = cv2.HoughLinesP(edges, 1, np.pi / 180, max(1, int(50 * scale)),
+                            minLineLength=50 * scale, maxLineGap=20 * scale)
+    line_image = image.copy()
+    if lines is not None:
+        for line in lines:
+            x1, y1, x2, y2 = line[0]
+            cv2.line(line_image, (x1, y1), (x2, y2), (0, 255, 0), 2)
+    return line_image, len(lines) if lines is not None else 0
+
+
+def detect_blobs(image, settings=None, prep=None):
+    prep = prep or FrameCache(image)
+    # SimpleBlobDetector converts to gray internally; hand it the shared one instead
+    scale = settings.get("analysis_scale", 1.0) if settings else 1.0
+    keypoints = get_blob_detector(scale).detect(prep.gray())
+    blob_image = cv2.drawKeypoints(image, keypoints, None, (255, 0, 0), cv2.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS)
+    return blob_image, len(keypoints)
+
+
+def color_segmentation(image, settings, prep=None):
+    prep = prep or FrameCache(image)
+    hsv = prep.hsv()
+    lower_bound = np.array(settings["lower_hsv"])
+    upper_bound = np.array(settings["upper_hsv"])
+    mask = cv2.inRange(hsv, lower_bound, upper_bound)
+    segmented_image = cv2.bitwise_and(image, image, mask=mask)
+    return segmented_image, None
+
+
+def edge_detection(image, settings, prep=None):
+    prep = prep or FrameCache(image)
+    edges = prep.edges(settings["edge_low"], settings["edge_high"])
+    edge_image = cv2.cvtColor(edges, cv2.COLOR_GRAY2RGB)
+    return edge_image, None
+
+
+def contour_detection(image, settings=None, prep=None):
+    prep = prep or FrameCache(image)
+    edged = prep.edges(50, 150, blur_ksize=5)
+    contours, _ = cv2.findContours(edged, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    contour_image = image.copy()
+    cv2.drawContours(contour_image, contours, -1, (0, 255, 0), 2)
+    return contour_image, len(contours)
+
+
+def shape_detection(image, settings=None, prep=None):
+    prep = prep or FrameCache(image)
+    edged = prep.edges(50, 150, blur_ksize=5)
+    contours, _ = cv2.findContours(edged, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    shape_image = image.copy()
+    for contour in contours:
+        approx = cv2.approxPolyDP(contour, 0.04 * cv2.arcLength(contour, True), True)
+        if len(approx) == 3:
+            shape = "Triangle"
+        elif len(approx) == 4:
+            (x, y, w, h) = cv2.boundingRect(approx)
+            ar = w / float(h)
+            shape = "Square" if 0.95 <= ar <= 1.05 else "Rectangle"
+        elif len(approx) == 5:
+            shape = "Pentagon"
+        else:
+            shape = "Circle"
+        cv2.drawContours(shape_image, [approx], -1, (0, 255, 0), 2)
+        x, y = approx[0][0]
+        cv2.putText(shape_image, shape, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 0), 2)
+    return shape_image, len(contours)
+
+
+DETECTORS = {
+    "lines": detect_lines,
+    "blobs": detect_blobs,
+    "color": color_segmentation,
+    "edges": edge_detection,
+    "contours": contour_detection,
+    "shapes": shape_detection,
+}
+
+
+def run_detector(name, image, settings, prep=None):
+    return DETECTORS[name](image, settings, prep)
+
+
+def compose(mode, overlays):
+    # Blend the detector overlays of a mode into the single image shown in the GUI
+    names = MODE_DETECTORS.get(mode, MODE_DETECTORS["both"])
+    if len(names) == 1:
+        return overlays[names[0]]
+    return cv2.addWeighted(overlays[names[0]], 0.5, overlays[names[1]], 0.5, 0)
+
+
+def run_mode(image, settings, prep):
+    # Runs every detector of the mode on one analysis image, sharing prep between them
+    overlays = {}
+    counts = {}
+    for name in MODE_DETECTORS.get(settings["mode"], MODE_DETECTORS["both"]):
+        overlays[name], counts[name] = run_detector(name, image, settings, prep)
+    return overlays, counts
+
+
+def process_image(image, settings, frame_id=None):
+    # Single-process path: runs every detector of the mode on the calling thread
+    analysis = analysis_image(image, settings)
+    overlays, counts = run_mode(analysis, settings, FrameCache(analysis, frame_id))
+    return restore_overlay(image, compose(settings["mode"], overlays), settings), counts
+
+
+# Worker process side
+
+_attached = {}
+_worker_cache = PreprocessCache()
+
+
+def _attach(name):
+    shm = _attached.get(name)
+    if shm is None:
+        if len(_attached) > 64:
+            # The parent reallocated its slots; drop stale mappings
+            for old in _attached.values():
+                old.close()
+            _attached.clear()
+        # Pool workers share the parent's resource tracker, so attaching here
+        # does not take ownership; the parent unlinks the block in close()
+        shm = shared_memory.SharedMemory(name=name)
+        _attached[name] = shm
+    return shm
+
+
+def _detector_task(name, session, frame_id, input_name, output_name, shape, settings, gray_name=None):
+    image = np.ndarray(shape, dtype=np.uint8, buffer=_attach(input_name).buf)
+    prep = _worker_cache.for_frame(frame_id, image, session)
+    if gray_name is not None:
+        prep.put(("gray",), np.ndarray(shape[:2], dtype=np.uint8, buffer=_attach(gray_name).buf))
+    # Report only this detector's lookups; another task of the frame may have used the same cache
+    hits, misses = prep.hits, prep.misses
+    overlay, count = run_detector(name, image, settings, prep)
+    output = np.ndarray(overlay.shape, dtype=np.uint8, buffer=_attach(output_name).buf)
+    output[...] = overlay
+    return overlay.shape, count, {"hits": prep.hits - hits, "misses": prep.misses - misses}
+
+
+# Parent process side
+
+class _FrameSlot:
+    # Shared input buffer for one in-flight frame plus one output buffer per detector (and one for its gray image)
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+        self.input = shared_memory.SharedMemory(create=True, size=nbytes)
+        self.outputs = {}
+
+    def output(self, name):
+        shm = self.outputs.get(name)
+        if shm is None:
+            shm = self.outputs[name] = shared_memory.SharedMemory(create=True, size=self.nbytes)
+        return shm
+
+    def view(self, shm, shape):
+        return np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+
+    def close(self):
+        for shm in [self.input] + list(self.outputs.values()):
+            shm.close()
+            shm.unlink()
+        self.outputs = {}
+
+
+class VisionEngine:
+    # Fans the detectors of the selected display mode out over a process pool.
+    # Up to `slots` frames can be in flight at once, so several callers (for
+    # example several VisionWorker threads) pipeline consecutive frames.
+    def __init__(self, workers=None, slots=3):
+        if workers is None:
+            workers = max(1, (os.cpu_count() or 2) - 1)
+        self.workers = workers
+        self.slots = slots
+        self.pool = ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+        self.session = 0
+        self.free_slots = queue.Queue()
+        self.all_slots = []
+        for _ in range(slots):
+            self.free_slots.put(None)
+
+    def new_session(self):
+        # Frame ids start over (a new FrameRing); results cached under the old ids must not be reused
+        self.session += 1
+
+    def process(self, frame_id, image, settings):
+        if self.pool is None:
+            analysis = analysis_image(image, settings)
+            prep = FrameCache(analysis, frame_id)
+            overlays, counts = run_mode(analysis, settings, prep)
+            display_image = restore_overlay(image, compose(settings["mode"], overlays), settings)
+            return types.SimpleNamespace(frame_id=frame_id, image=display_image, counts=counts,
+                                         preprocess={"hits": prep.hits, "misses": prep.misses})
+
+        # Only the cropped, decimated analysis image goes through shared memory
+        analysis = analysis_image(image, settings)
+        names = MODE_DETECTORS.get(settings["mode"], MODE_DETECTORS["both"])
+        slot = self._acquire_slot(analysis.nbytes)
+        try:
+            slot.view(slot.input, analysis.shape)[...] = analysis
+            gray_name = None
+            preprocess = {"hits": 0, "misses": 0}
+            if len(names) > 1:
+                # Computed once here instead of once per detector process
+                gray = slot.output("gray")
+                cv2.cvtColor(analysis, cv2.COLOR_RGB2GRAY, dst=slot.view(gray, analysis.shape[:2]))
+                gray_name = gray.name
+                preprocess["misses"] += 1
+            futures = {}
+            for name in names:
+                futures[name] = self.pool.submit(_detector_task, name, self.session, frame_id, slot.input.name,
+                                                 slot.output(name).name, analysis.shape, settings, gray_name)
+            overlays = {}
+            counts = {}
+            for name, future in futures.items():
+                shape, counts[name], lookups = future.result()
+                overlays[name] = slot.view(slot.output(name), shape)
+                preprocess["hits"] += lookups["hits"]
+                preprocess["misses"] += lookups["misses"]
+            display_image = restore_overlay(image, compose(settings["mode"], overlays), settings)
+            if any(display_image is overlay for overlay in overlays.values()):
+                # Copy out of the slot before it is handed to the next frame
+                display_image = display_image.copy()
+        finally:
+            self.free_slots.put(slot)
+        return types.SimpleNamespace(frame_id=frame_id, image=display_image, counts=counts, preprocess=preprocess)
+
+    def _acquire_slot(self, nbytes):
+        slot = self.free_slots.get()
+        if slot is None or slot.nbytes < nbytes:
+            if slot is not None:
+                self.all_slots.remove(slot)
+                slot.close()
+            slot = _FrameSlot(nbytes)
+            self.all_slots.append(slot)
+        return slot
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            self.pool = None
+        for slot in self.all_slots:
+            slot.close()
+        self.all_slots = []
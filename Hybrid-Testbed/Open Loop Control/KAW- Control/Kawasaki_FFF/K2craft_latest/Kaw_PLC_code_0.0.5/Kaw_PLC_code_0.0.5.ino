@@ -22,6 +22,21 @@ ModbusClientKAW ModbusClientKAW;
 unsigned long lastIOSendTime = 0;
 const unsigned long ioUpdateInterval = 50; // Milliseconds
 
+// Binary IO state frame: STX, type, 2-byte length, then seq, millis() and one
+// 16-bit input mask per channel, all big-endian (see k2_protocol.py)
+const byte STX = 0x02;
+const byte IO_STATE = 0x01;
+const int ioStatePayloadSize = 12;
+uint32_t ioSeq = 0;
+uint16_t lastIOMasks[2] = { 0, 0 };
+bool ioMasksSent = false;  // Forces a full report after (re)connecting
+
+// Commands arrive as "@<seq> <command>" and are acknowledged with "ACK:<seq>".
+// Retransmissions of a recently applied seq are acknowledged but not applied again.
+const int recentSeqCount = 16;
+unsigned long recentSeqs[recentSeqCount];
+int recentSeqIndex = 0;
+
 signed int extruderData[25];
 signed int heater1Data[25];
 int extruderMotorEnable = 0;
@@ -98,7 +113,7 @@ void serverListen() {
             } else if (c == '\n') {
                 Serial.print("Complete Command: ");
                 Serial.println(incomingByte);
-                handleCommand(incomingByte, client);
+                handleTaggedCommand(incomingByte, client);
                 incomingByte = ""; // Reset the string for the next command
             }
         }
@@ -111,6 +126,34 @@ void serverListen() {
     }
 }
 
+bool seenRecently(unsigned long seq) {
+    for (int i = 0; i < recentSeqCount; i++) {
+        if (recentSeqs[i] == seq) {
+            return true;
+        }
+    }
+    return false;
+}
+
+void handleTaggedCommand(String line, EthernetClient &client) {
+    if (!line.startsWith("@")) {
+        handleCommand(line, client);  // Untagged command from an older GUI
+        return;
+    }
+    int space = line.indexOf(' ');
+    if (space == -1) {
+        return;
+    }
+    unsigned long seq = strtoul(line.substring(1, space).c_str(), NULL, 10);
+    if (!seenRecently(seq)) {
+        handleCommand(line.substring(space + 1), client);
+        recentSeqs[recentSeqIndex] = seq;
+        recentSeqIndex = (recentSeqIndex + 1) % recentSeqCount;
+    }
+    client.print("ACK:");
+    client.println(seq);
+}
+
 void handleOutputCommand(int channel, int pin, bool state) {
     P1.writeDiscrete(state, channel, pin);  // Assuming P1 is a method or object dealing with I/O
     Serial.print("Output set on channel ");
@@ -124,6 +167,11 @@ void handleCommand(String command, EthernetClient &client) {
     Serial.print("Handling command: ");  // Debugging statement
     Serial.println(command);
 
+    if (command == "REQUEST_IO_UPDATE") {
+        sendIOState(client, readInputMask(1), readInputMask(2));
+        return;
+    }
+
     if (command.startsWith("SET_OUTPUT:")) {
         if (sscanf(command.c_str(), "SET_OUTPUT:%d:%d:%d", &channel, &pin, &state) == 3) {
             handleOutputCommand(channel, pin, state);
@@ -254,11 +302,14 @@ void loop() {
 
     if (client.connected()) {
         serverListen();
+        pushIOChanges(client);
     } else if (!isClientConnected) {
         Serial.println("Attempting to reconnect...");
         if (client.connect(server, 10000)) {
             Serial.println("Reconnected");
             isClientConnected = true;
+            ioMasksSent = false;
+            memset(recentSeqs, 0, sizeof(recentSeqs));
         } else {
             Serial.println("Reconnection failed");
             delay(5000);  // Wait before retrying
@@ -266,30 +317,45 @@ void loop() {
     }
 }
 
-void sendIODigitalSignals(EthernetClient &client) {
-    String channel_1_states = "channel_1_states:";
-    String channel_2_states = "channel_2_states:";
-    for (int channel = 1; channel <= 2; channel++) {
-        for (int pin = 1; pin <= 16; pin++) {
-            bool state = P1.readDiscrete({ channel, pin });
-            if (channel == 1) {
-                channel_1_states += state ? "1" : "0";
-                if (pin != 16) {
-                    channel_1_states += ",";
-                }
-            }
-            if (channel == 2) {
-                channel_2_states += state ? "1" : "0";
-                if (pin != 16) {
-                    channel_2_states += ",";
-                }
-            }
-        }
+uint16_t readInputMask(int channel) {
+    // Reading channel 0 returns every input of the module, bit 0 = pin 1
+    return (uint16_t)(P1.readDiscrete(channel, 0) & 0xFFFF);
+}
+
+void putBigEndian(byte *buffer, uint32_t value, int bytes) {
+    for (int i = bytes - 1; i >= 0; i--) {
+        buffer[i] = value & 0xFF;
+        value >>= 8;
     }
-    Serial.println(channel_1_states);  // Debugging statement
-    Serial.println(channel_2_states);  // Debugging statement
+}
+
+void sendIOState(EthernetClient &client, uint16_t channel1Mask, uint16_t channel2Mask) {
+    byte frame[4 + ioStatePayloadSize];
+    frame[0] = STX;
+    frame[1] = IO_STATE;
+    putBigEndian(frame + 2, ioStatePayloadSize, 2);
+    putBigEndian(frame + 4, ioSeq++, 4);
+    putBigEndian(frame + 8, millis(), 4);
+    putBigEndian(frame + 12, channel1Mask, 2);
+    putBigEndian(frame + 14, channel2Mask, 2);
     if (client.connected()) {
-        client.println(channel_1_states + "\n" + channel_2_states + "\n");
+        client.write(frame, sizeof(frame));
+    }
+    lastIOMasks[0] = channel1Mask;
+    lastIOMasks[1] = channel2Mask;
+    ioMasksSent = true;
+}
+
+void pushIOChanges(EthernetClient &client) {
+    // Sample the inputs every ioUpdateInterval and only send when something changed
+    if (millis() - lastIOSendTime < ioUpdateInterval) {
+        return;
+    }
+    lastIOSendTime = millis();
+    uint16_t channel1Mask = readInputMask(1);
+    uint16_t channel2Mask = readInputMask(2);
+    if (!ioMasksSent || channel1Mask != lastIOMasks[0] || channel2Mask != lastIOMasks[1]) {
+        sendIOState(client, channel1Mask, channel2Mask);
     }
 }
 